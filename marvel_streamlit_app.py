@@ -4,15 +4,32 @@ import json
 import pickle
 import time
 import sys
+import uuid
 from datetime import datetime
 from pathlib import Path
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 from langchain.storage import InMemoryStore
 from langchain.retrievers.multi_vector import MultiVectorRetriever
 from langchain.schema.document import Document
 import requests
-import torch
+
+sys.path.insert(0, str(Path(__file__).parent / "marvel_vector_db" / "scripts"))
+from marvel_metrics import metrics, InstrumentedEmbeddings
+from marvel_shards import ShardedVectorStore
+from marvel_retrieval import MarvelRetriever, MetadataIndex, build_where, normalize_filters
+from marvel_rerank import CrossEncoderReranker
+from marvel_warm_start import startup, WarmEmbeddings, resolve_model_path
+from marvel_model_host import connect_model_host
+from marvel_columnar import ColumnarDocument, COLUMNAR_NAME, document_data_path
+from marvel_chunk_index import ChunkIndex
+from marvel_conversation import ConversationMemory, ollama_llm, estimate_tokens
+from marvel_federated import FederatedSearch
+from marvel_facts import FactStore, FACTS_PATH
+from marvel_entities import EntityIndex, ENTITIES_PATH
+from marvel_compression import load_compressor
+from marvel_singleflight import SingleFlight, flight_key
+from marvel_admission import AdmissionController, Rejected
+from marvel_router import ModelRouter, SMALL_MODEL, LARGE_MODEL
 
 # Fix Windows console encoding
 if sys.platform == 'win32':
@@ -161,21 +178,68 @@ if 'selected_audio' not in st.session_state:
     st.session_state.selected_audio = None
 if 'marvel_vector_db' not in st.session_state:
     st.session_state.marvel_vector_db = None
+if 'marvel_retriever' not in st.session_state:
+    st.session_state.marvel_retriever = None
+if 'conversations' not in st.session_state:
+    st.session_state.conversations = {}
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
 # Initialize models
 @st.cache_resource
 def load_embeddings():
-    """Load embeddings model"""
+    """Load embeddings model in the background so the first page renders right away"""
     try:
-        embeddings = HuggingFaceEmbeddings(
-            model_name="BAAI/bge-large-en-v1.5",
-            model_kwargs={"device": "cpu"}
-        )
-        return embeddings
+        # Every Streamlit server on the machine shares the model host's copy when one is running
+        embeddings = (connect_model_host(normalize=False)
+                      or WarmEmbeddings(resolve_model_path(), device="cpu", normalize=False))
+        return InstrumentedEmbeddings(embeddings)
     except Exception as e:
         st.error(f"Error loading embeddings: {e}")
         return None
 
+@st.cache_resource
+def load_federated_search():
+    """Search across every preprocessed document and audio store (stores open once per process)"""
+    return FederatedSearch(load_embeddings())
+
+@st.cache_resource
+def load_fact_store(mtime):
+    """Fact table written at ingestion (reloaded when facts.json changes)"""
+    return FactStore.load(FACTS_PATH)
+
+def answer_from_facts(question):
+    """Direct answer for simple factual questions, or None"""
+    if not FACTS_PATH.exists():
+        return None
+    facts = load_fact_store(FACTS_PATH.stat().st_mtime)
+    return facts.answer(question) if facts else None
+
+@st.cache_resource
+def load_entity_index(mtime):
+    """Entity -> source index written at ingestion (reloaded when entities.json changes)"""
+    return EntityIndex.load(ENTITIES_PATH)
+
+@st.cache_resource
+def load_prompt_compressor():
+    """Extractive context compressor backed by the ingestion-time sentence cache"""
+    return load_compressor(load_embeddings())
+
+def compress_context(query, texts, ratio):
+    """Keep the sentences of texts most relevant to query (texts unchanged if compression is off or fails)"""
+    if ratio >= 1.0 or not texts:
+        return texts
+    try:
+        return load_prompt_compressor().compress_texts(query, texts, ratio)
+    except Exception as e:
+        print(f"⚠️  Context compression failed, using whole chunks: {e}")
+        return texts
+
+@st.cache_resource
+def load_reranker():
+    """Load the cross-encoder reranker (model weights load on first use)"""
+    return CrossEncoderReranker()
+
 # Check Ollama
 def check_ollama():
     """Check if Ollama is running"""
@@ -185,36 +249,149 @@ def check_ollama():
     except:
         return False
 
-# Query Mistral with Marvel context
-def query_mistral_marvel(prompt):
-    """Query Mistral with Marvel-focused responses"""
+@st.cache_resource
+def load_flights():
+    """In-flight searches and generations, shared by every session of this server"""
+    return SingleFlight()
+
+@st.cache_resource
+def load_admission():
+    """Bounded, fair queue in front of Ollama, shared by every session of this server"""
+    max_wait = os.environ.get("MARVEL_OLLAMA_MAX_WAIT")
+    # Without MARVEL_OLLAMA_MAX_WAIT the deadline follows the measured generation time
+    return AdmissionController(concurrency=int(os.environ.get("MARVEL_OLLAMA_CONCURRENCY", "1")),
+                               max_wait_s=float(max_wait) if max_wait else None)
+
+@st.cache_resource
+def load_router():
+    """Small/large model router and its per-model statistics, shared by every session"""
+    return ModelRouter(small=os.environ.get("MARVEL_SMALL_MODEL", SMALL_MODEL), large=LARGE_MODEL)
+
+def _mistral_tokens(prompt, model=LARGE_MODEL, read_timeout=25, deadline_s=120):
+    """Stream response tokens for a prompt from Ollama, giving up deadline_s after the request starts"""
+    deadline = time.monotonic() + deadline_s
+    response = requests.post(
+        "http://localhost:11434/api/generate",
+        json={
+            "model": model,
+            "prompt": prompt,
+            "stream": True,
+            "options": {
+                "temperature": 0.2,
+                "top_k": 40,
+                "top_p": 0.9,
+                "num_predict": 400,
+                "num_ctx": 2048,
+            }
+        },
+        stream=True,
+        # With stream=True requests applies the read timeout to each chunk, not the whole answer
+        timeout=(5, read_timeout)
+    )
+    with response:
+        # A model that is not pulled answers 404; raise so the caller counts it as a failed call
+        response.raise_for_status()
+        metrics.incr('llm_calls')
+        
+        # Ollama streams one JSON object per line
+        for line in response.iter_lines():
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{model} did not finish within {deadline_s}s")
+            if not line:
+                continue
+            chunk = json.loads(line)
+            yield chunk.get("response", "")
+            if chunk.get("done"):
+                break
+
+def _generate_answer(prompt, key, placeholder, model):
+    """Generate with one model: (answer, failed), where failed means rejected by the queue or an Ollama error"""
+    key = flight_key(key or flight_key('generate', prompt), model)
+    status = placeholder if placeholder is not None else st.empty()
     try:
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={
-                "model": "mistral:7b",
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.2,
-                    "top_k": 40,
-                    "top_p": 0.9,
-                    "num_predict": 400,
-                    "num_ctx": 2048,
-                }
-            },
-            timeout=25
-        )
+        # Wait for a slot on the shared Ollama, showing where this request is in the queue
+        ticket = load_admission().submit(st.session_state.session_id, estimate_tokens(prompt), key=key)
+    except Rejected as e:
+        st.warning(f"⏳ Mistral is busy: {e}. Please try again in a moment.")
+        return None, True
+    try:
+        while not ticket.wait(timeout=0.5):
+            status.info(f"⏳ Position {ticket.position()} in the queue, about {ticket.estimated_wait():.0f}s to go")
+        status.empty()
         
-        if response.status_code == 200:
-            result = response.json()
-            ai_response = result.get("response", "").strip()
-            if ai_response and len(ai_response) > 20:
-                return ai_response
-        return None
+        start = time.perf_counter()
+        parts = []
+        try:
+            with metrics.span('llm_total'):
+                for token in load_flights().stream(key, lambda: _mistral_tokens(prompt, model)):
+                    if not parts and token:
+                        metrics.observe('llm_first_token', time.perf_counter() - start)
+                    parts.append(token)
+                    if placeholder is not None:
+                        placeholder.markdown("".join(parts) + "▌")
+        except Exception:
+            load_router().record(model, time.perf_counter() - start, ok=False)
+            raise
+        load_router().record(model, time.perf_counter() - start)
+        return "".join(parts).strip(), False
+    except Rejected as e:
+        status.empty()
+        st.warning(f"⏳ Mistral is busy: {e}. Please try again in a moment.")
+        return None, True
     except Exception as e:
         st.error(f"Mistral query failed: {e}")
-        return None
+        return None, True
+    finally:
+        ticket.release()
+
+def _usable(ai_response):
+    return ai_response if ai_response and len(ai_response) > 20 else None
+
+# Query Mistral with Marvel context
+def query_mistral_marvel(prompt, key=None, placeholder=None, model=LARGE_MODEL):
+    """Query Mistral with Marvel-focused responses; identical concurrent requests share one generation"""
+    ai_response, _ = _generate_answer(prompt, key, placeholder, model)
+    return _usable(ai_response)
+
+def ask_llm(question, context, prompt, routed=True, key=None, placeholder=None):
+    """Answer with the small or the large model, escalating weak small-model answers to the large one"""
+    if not routed:
+        return query_mistral_marvel(prompt, key=key, placeholder=placeholder)
+    router = load_router()
+    queue = load_admission().snapshot()
+    decision = router.route(question, context, queue_depth=queue['queued'])
+    ai_response, failed = _generate_answer(prompt, key, placeholder, decision['model'])
+    # Only a real but weak answer is escalated; a rejected or failed request is not resubmitted to the full queue
+    if not failed and router.should_escalate(decision, ai_response):
+        model = router.escalate(decision)
+        if placeholder is not None:
+            placeholder.info(f"🔀 Asking {model} for a fuller answer...")
+        ai_response, _ = _generate_answer(prompt, key, placeholder, model)
+    return _usable(ai_response)
+
+def admitted_llm(model, session_id):
+    """Conversation rewrite/summary calls that wait for a slot in the shared Ollama queue like answers do"""
+    llm = ollama_llm(model=model)
+    admission = load_admission()
+    
+    def generate(prompt):
+        # Summaries run in a background thread, so the session is bound here rather than read from st
+        with admission.submit(session_id, estimate_tokens(prompt)):
+            return llm(prompt)
+    return generate
+
+def get_conversation(key):
+    """Bounded, summarized memory for one chat (the knowledge base, a document or an audio file)"""
+    if key not in st.session_state.conversations:
+        session_id = st.session_state.session_id
+        # Known names tell a question's subject ("Thor and his brother?") from a leading verb
+        known = load_entity_index(ENTITIES_PATH.stat().st_mtime) if ENTITIES_PATH.exists() else None
+        st.session_state.conversations[key] = ConversationMemory(
+            llm=admitted_llm(LARGE_MODEL, session_id),
+            rewrite_llm=admitted_llm(load_router().small, session_id),
+            aliases=known.aliases if known else None,
+        )
+    return st.session_state.conversations[key]
 
 # Load Marvel vector database
 def load_marvel_vector_db():
@@ -226,6 +403,10 @@ def load_marvel_vector_db():
     
     try:
         if st.session_state.embeddings:
+            # Sharded layout fans out across per-category collections
+            sharded = ShardedVectorStore.load(vectorstore_path, st.session_state.embeddings)
+            if sharded:
+                return sharded
             vectorstore = Chroma(
                 collection_name="marvel_knowledge_base",
                 embedding_function=st.session_state.embeddings,
@@ -237,6 +418,86 @@ def load_marvel_vector_db():
     
     return None
 
+def search_marvel_knowledge(query, k=3, filters=None):
+    """Search the Marvel database, narrowed to the sources of the entities the query names"""
+    filters = normalize_filters(filters)
+    entities = load_entity_index(ENTITIES_PATH.stat().st_mtime) if ENTITIES_PATH.exists() else None
+    narrowed, names = entities.narrow(query, filters) if entities else (filters, [])
+    if not names:
+        return _search_marvel_db(query, k, filters)
+    
+    metrics.incr('entity_narrowed')
+    docs = _search_marvel_db(query, k, narrowed)
+    if len(docs) < k:
+        # Too few chunks mention the entity: top up from the whole collection
+        seen = {(doc.metadata.get('source'), doc.page_content) for doc in docs}
+        docs += [doc for doc in _search_marvel_db(query, k, filters)
+                 if (doc.metadata.get('source'), doc.page_content) not in seen][:k - len(docs)]
+    return docs
+
+@st.cache_resource
+def load_metadata_index(vectorstore_path, _collection):
+    """Filter index shared by every session; it refreshes itself when the collection changes"""
+    return MetadataIndex(_collection, persist_directory=vectorstore_path)
+
+def _search_marvel_db(query, k, filters):
+    """Search the sharded store or the single collection with optional filters"""
+    db = st.session_state.marvel_vector_db
+    filters = dict(filters)
+    if isinstance(db, ShardedVectorStore):
+        categories = filters.pop('category', None)
+        return db.similarity_search(query, k=k, categories=categories, filter=build_where(filters))
+    
+    if st.session_state.marvel_retriever is None:
+        st.session_state.marvel_retriever = MarvelRetriever(
+            db, st.session_state.embeddings, load_metadata_index("marvel_vector_db/vectorstore", db._collection)
+        )
+    return st.session_state.marvel_retriever.get_relevant_documents(query, k=k, filters=filters)
+
+class LazyDocumentEntry(dict):
+    """Preprocessed document whose doc_data is only opened when first used"""
+    def __init__(self, metadata, doc_data_path):
+        super().__init__(metadata=metadata)
+        self.doc_data_path = doc_data_path
+    
+    def __contains__(self, key):
+        return key == 'doc_data' or super().__contains__(key)
+    
+    def __missing__(self, key):
+        if key != 'doc_data':
+            raise KeyError(key)
+        if self.doc_data_path.endswith(COLUMNAR_NAME):
+            # Memory-mapped; chunks are decoded only when indexed
+            doc_data = ColumnarDocument(self.doc_data_path)
+        else:
+            with open(self.doc_data_path, 'rb') as f:
+                doc_data = pickle.load(f)
+        self['doc_data'] = doc_data
+        return doc_data
+    
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+@st.cache_resource(max_entries=16)
+def load_chunk_index(doc_data_path, mtime):
+    """Build a document's chunk index once per payload file (mtime invalidates it)"""
+    doc_content = LazyDocumentEntry({}, doc_data_path)['doc_data']
+    texts = doc_content.get('texts') or doc_content.get('text_chunks') or []
+    return ChunkIndex(texts)
+
+def search_document_chunks(doc_entry, query, k=3):
+    """Chunks of one preprocessed document most relevant to the question"""
+    doc_data_path = getattr(doc_entry, 'doc_data_path', None)
+    if not doc_data_path or not os.path.exists(doc_data_path):
+        return []
+    chunk_index = load_chunk_index(doc_data_path, os.path.getmtime(doc_data_path))
+    # Dense rerank only once the background model load has finished
+    embeddings = st.session_state.embeddings
+    model = getattr(embeddings, 'embeddings', None)
+    if embeddings is None or not getattr(model, 'ready', True):
+        embeddings = None
+    return [chunk_index.text(i) for i in chunk_index.search(query, k=k, embeddings=embeddings)]
+
 # Load preprocessed content
 def load_preprocessed_content():
     """Load all pre-processed content"""
@@ -257,14 +518,12 @@ def load_preprocessed_content():
                 else:
                     metadata = {"text_count": 0, "table_count": 0, "image_count": 0}
 
-                doc_data_path = os.path.join(doc_path, "document_data.pkl")
-                if os.path.exists(doc_data_path):
-                    with open(doc_data_path, 'rb') as f:
-                        doc_data = pickle.load(f)
-                    st.session_state.preprocessed_docs[file_id] = {
-                        "metadata": metadata,
-                        "doc_data": doc_data
-                    }
+                # Prefer the columnar payload written by marvel_columnar.py convert, unless
+                # the notebook re-exported the pickle since then
+                doc_data_path = document_data_path(doc_path)
+                if doc_data_path is not None:
+                    # Opened on first use instead of at startup
+                    st.session_state.preprocessed_docs[file_id] = LazyDocumentEntry(metadata, str(doc_data_path))
             except Exception as e:
                 st.warning(f"Error loading document {file_id}: {e}")
     
@@ -285,16 +544,16 @@ def load_preprocessed_content():
 
 # Initialize
 if st.session_state.embeddings is None:
-    with st.spinner("Loading embeddings model..."):
+    with st.spinner("Loading embeddings model..."), startup.phase('embeddings'):
         st.session_state.embeddings = load_embeddings()
 
 # Load Marvel vector database
 if st.session_state.marvel_vector_db is None:
-    with st.spinner("Loading Marvel vector database..."):
+    with st.spinner("Loading Marvel vector database..."), startup.phase('vectorstore'):
         st.session_state.marvel_vector_db = load_marvel_vector_db()
 
 if not st.session_state.preprocessed_docs and not st.session_state.preprocessed_audio:
-    with st.spinner("Loading preprocessed content..."):
+    with st.spinner("Loading preprocessed content..."), startup.phase('preprocessed_content'):
         load_preprocessed_content()
 
 # Header
@@ -320,10 +579,22 @@ with st.sidebar:
     
     if ollama_status:
         st.success("✅ Ollama: Online")
+        queue = load_admission().snapshot()
+        st.caption(f"LLM queue: {queue['active']} generating, {queue['queued']} waiting")
     else:
         st.warning("⚠️ Ollama: Offline")
         st.info("To enable AI queries, start Ollama:\n```\nollama serve\nollama pull mistral:7b\n```")
     
+    st.markdown("---")
+    compress_ratio = st.slider(
+        "Context kept for the LLM", 0.2, 1.0, 0.5, 0.1,
+        help="Share of retrieved text sent to Mistral; the sentences most relevant to the question are kept"
+    )
+    route_models = st.checkbox(
+        "Route simple questions to a small model", value=True,
+        help=f"Simple questions with good context go to {load_router().small}, the rest to {LARGE_MODEL}"
+    )
+    
     st.markdown("---")
     st.markdown("### 🎯 Navigation")
     page = st.radio("Select Page", ["🦸 Marvel Knowledge", "📄 Documents", "🎵 Audio", "📊 System Status"])
@@ -338,6 +609,20 @@ if page == "🦸 Marvel Knowledge":
         # Marvel knowledge chat
         st.markdown("### 💬 Chat with Marvel Knowledge Base")
         
+        # Metadata filters pushed down into the search
+        with st.expander("🔎 Search filters"):
+            filter_col1, filter_col2 = st.columns(2)
+            with filter_col1:
+                filter_types = st.multiselect("Content type", ["document", "image"], key="marvel_filter_types")
+            with filter_col2:
+                filter_categories = st.multiselect(
+                    "Category", ["character", "team", "event", "comic", "general"], key="marvel_filter_categories"
+                )
+            rerank_enabled = st.checkbox(
+                "Rerank with cross-encoder", key="marvel_rerank",
+                help="Fetch 50 candidates and reorder them with a cross-encoder (dense order if over 500 ms)"
+            )
+        
         # Display messages
         if st.session_state.doc_messages:
             for message in st.session_state.doc_messages:
@@ -363,22 +648,48 @@ if page == "🦸 Marvel Knowledge":
         if send_button and query:
             # Add user message
             st.session_state.doc_messages.append({'type': 'user', 'content': query})
+            conversation = get_conversation('marvel')
             
             # Query Marvel vector database
             with st.spinner("Searching Marvel knowledge base..."):
                 try:
-                    # Search vector database
-                    results = st.session_state.marvel_vector_db.similarity_search(query, k=3)
+                    # Search vector database with follow-ups rewritten as standalone questions
+                    search_query = conversation.standalone_query(query)
                     
-                    # Combine context
-                    context = "\n\n".join([doc.page_content for doc in results])
+                    # Simple factual questions are answered from the fact table, without search or LLM
+                    fact = None if (filter_types or filter_categories) else answer_from_facts(search_query)
+                    if fact:
+                        metrics.incr('fact_answers')
+                        ai_response = f"{fact['answer']}\n\n*⚡ From the fact table ({fact['sources'][0]['source']})*"
+                        conversation.add(query, fact['answer'])
+                        st.session_state.doc_messages.append({'type': 'bot', 'content': ai_response})
+                        st.rerun()
+                    
+                    def retrieve():
+                        reranker = load_reranker() if rerank_enabled else None
+                        fetch_k = reranker.fetch_k if reranker else 3
+                        with metrics.span('search', k=fetch_k):
+                            results = search_marvel_knowledge(
+                                search_query, k=fetch_k, filters={'type': filter_types, 'category': filter_categories}
+                            )
+                        return reranker.rerank(search_query, results, top_n=3) if reranker else results
+                    
+                    # Users asking the same question at the same time share one search
+                    results = load_flights().do(
+                        flight_key('search', search_query, filter_types, filter_categories, rerank_enabled), retrieve
+                    )
+                    
+                    # Combine the most relevant sentences of each chunk
+                    texts = compress_context(search_query, [doc.page_content for doc in results], compress_ratio)
+                    context = "\n\n".join(text for text in texts if text)
                     
                     # Query AI with Marvel context
                     ai_response = None
                     if check_ollama() and context:
-                        prompt = f"""You are a Marvel Comics expert assistant. Answer the following question about Marvel characters, storylines, comics, or universe based on the provided context.
+                        with metrics.span('prompt_build'):
+                            prompt = f"""You are a Marvel Comics expert assistant. Answer the following question about Marvel characters, storylines, comics, or universe based on the provided context.
 
-Context from Marvel knowledge base:
+{conversation.prompt_section()}Context from Marvel knowledge base:
 {context[:2000]}
 
 Question: {query}
@@ -393,7 +704,14 @@ Use markdown formatting for better readability (headers, lists, bold text).
 
 Detailed Answer:"""
                         
-                        ai_response = query_mistral_marvel(prompt)
+                        # Same question, context and history: one generation streamed to every asker
+                        ai_response = ask_llm(
+                            search_query, context, prompt, routed=route_models,
+                            key=flight_key('answer', query, context, conversation.prompt_section()),
+                            placeholder=st.empty()
+                        )
+                        if ai_response:
+                            conversation.add(query, ai_response)
                     
                     if not ai_response:
                         ai_response = f"**Marvel Knowledge Base Response**\n\n**Question:** {query}\n\n**Relevant Context Found:**\n\n{context[:1000]}\n\n*AI analysis temporarily unavailable. Please ensure Ollama is running.*"
@@ -409,6 +727,7 @@ Detailed Answer:"""
         # Clear chat button
         if st.button("Clear Chat", key="clear_marvel_chat"):
             st.session_state.doc_messages = []
+            get_conversation('marvel').clear()
             st.rerun()
     
     else:
@@ -432,6 +751,29 @@ Detailed Answer:"""
 elif page == "📄 Documents":
     st.markdown("## 📄 Marvel Document Chat")
     
+    # Corpus-wide search: which documents or audio files mention something
+    with st.expander("🔎 Search all documents and audio"):
+        federated_query = st.text_input("Find files that mention:", key="federated_query_input",
+                                        placeholder="Thanos")
+        if st.button("Search files", key="federated_search") and federated_query:
+            if st.session_state.embeddings is None:
+                st.warning("Embeddings model not loaded.")
+            else:
+                with st.spinner("Searching all files..."):
+                    federated = load_federated_search()
+                    fresh, direct = federated.plan()
+                    files = federated.search_files(federated_query, k=10, plan=(fresh, direct))
+                if not files:
+                    st.info("No matching files found.")
+                for entry in files:
+                    icon = "🎵" if entry['kind'] == 'audio' else "📄"
+                    st.markdown(f"{icon} **{entry['file_id']}** ({entry['hits']} matching chunks)")
+                    st.caption(entry['snippet'][:200])
+                if direct:
+                    st.caption(f"{len(direct)} files are not consolidated yet; run "
+                               "`python marvel_vector_db/scripts/marvel_federated.py consolidate` "
+                               "to answer with a single search.")
+    
     # Document selection
     if st.session_state.preprocessed_docs:
         doc_options = list(st.session_state.preprocessed_docs.keys())
@@ -461,6 +803,7 @@ elif page == "📄 Documents":
         with col_header2:
             if st.button("Clear Chat", key="clear_doc_chat"):
                 st.session_state.doc_messages = []
+                get_conversation(f"doc:{selected_doc}").clear()
                 st.rerun()
         
         # Display messages
@@ -483,27 +826,16 @@ elif page == "📄 Documents":
         if send_button and query and selected_doc:
             # Add user message
             st.session_state.doc_messages.append({'type': 'user', 'content': query})
+            conversation = get_conversation(f"doc:{selected_doc}")
             
             # Query document
             with st.spinner("Thinking..."):
                 doc_data = st.session_state.preprocessed_docs[selected_doc]
+                search_query = conversation.standalone_query(query)
                 
-                # Extract content
-                content_parts = []
-                if 'doc_data' in doc_data:
-                    doc_content = doc_data['doc_data']
-                    if 'texts' in doc_content:
-                        texts = doc_content['texts']
-                        for text in texts[:5]:
-                            text_str = str(text)
-                            if len(text_str.strip()) > 20:
-                                content_parts.append(text_str[:800])
-                    elif 'text_chunks' in doc_content:
-                        texts = doc_content['text_chunks']
-                        for text in texts[:5]:
-                            text_str = str(text)
-                            if len(text_str.strip()) > 20:
-                                content_parts.append(text_str[:800])
+                # Retrieve the chunks relevant to the question
+                with metrics.span('search', k=3):
+                    content_parts = [chunk[:800] for chunk in search_document_chunks(doc_data, search_query, k=3)]
                 
                 combined_content = " ".join(content_parts)
                 
@@ -517,19 +849,22 @@ elif page == "📄 Documents":
                                 embedding_function=st.session_state.embeddings
                             )
                             if query:
-                                results = vectorstore.similarity_search(query, k=3)
+                                results = vectorstore.similarity_search(search_query, k=3)
                                 for result in results:
                                     content_parts.append(result.page_content[:800])
                                 combined_content = " ".join(content_parts)
                         except Exception as e:
                             st.warning(f"Could not load from vectorstore: {e}")
                 
+                if content_parts:
+                    combined_content = " ".join(compress_context(search_query, content_parts, compress_ratio))
+                
                 # Query AI with Marvel context
                 ai_response = None
                 if check_ollama() and combined_content:
                     prompt = f"""You are a Marvel Comics expert assistant. Analyze the following document content and provide a comprehensive, detailed answer to the user's question.
 
-Document Name: {selected_doc}
+{conversation.prompt_section()}Document Name: {selected_doc}
 Document Content: {combined_content[:2000]}
 
 User Question: {query}
@@ -547,7 +882,9 @@ Format your response using markdown:
 
 Detailed Answer:"""
                     
-                    ai_response = query_mistral_marvel(prompt)
+                    ai_response = ask_llm(search_query, combined_content, prompt, routed=route_models)
+                    if ai_response:
+                        conversation.add(query, ai_response)
                 
                 if not ai_response:
                     ai_response = f"**Marvel Document Analysis**\n\nDocument: {selected_doc}\n\nQuestion: {query}\n\n*AI analysis temporarily unavailable. Please ensure Ollama is running.*"
@@ -586,6 +923,7 @@ elif page == "🎵 Audio":
         with col_header2:
             if st.button("Clear Chat", key="clear_audio_chat"):
                 st.session_state.audio_messages = []
+                get_conversation(f"audio:{selected_audio}").clear()
                 st.rerun()
         
         # Display messages
@@ -608,10 +946,12 @@ elif page == "🎵 Audio":
         if send_button and query and selected_audio:
             # Add user message
             st.session_state.audio_messages.append({'type': 'user', 'content': query})
+            conversation = get_conversation(f"audio:{selected_audio}")
             
             # Query audio
             with st.spinner("Thinking..."):
                 audio_data = st.session_state.preprocessed_audio[selected_audio]
+                search_query = conversation.standalone_query(query)
                 transcript = audio_data.get('transcript', '')
                 
                 # Try vectorstore
@@ -624,10 +964,12 @@ elif page == "🎵 Audio":
                             embedding_function=st.session_state.embeddings
                         )
                         if query:
-                            results = vectorstore.similarity_search(query, k=3)
+                            results = vectorstore.similarity_search(search_query, k=3)
                             relevant_chunks = [result.page_content for result in results]
                             if relevant_chunks:
-                                relevant_content = " ".join(relevant_chunks[:3])
+                                relevant_content = " ".join(
+                                    compress_context(search_query, relevant_chunks[:3], compress_ratio)
+                                )
                     except Exception as e:
                         relevant_content = transcript[:2000]
                 else:
@@ -638,7 +980,7 @@ elif page == "🎵 Audio":
                 if check_ollama() and relevant_content:
                     prompt = f"""You are a Marvel Comics expert assistant. Analyze the following audio transcript and provide a comprehensive, detailed answer to the user's question.
 
-Audio File: {selected_audio}
+{conversation.prompt_section()}Audio File: {selected_audio}
 Transcript Content: {relevant_content[:2000]}
 
 User Question: {query}
@@ -651,7 +993,9 @@ Please provide a thorough, well-structured response that:
 
 Detailed Analysis:"""
                     
-                    ai_response = query_mistral_marvel(prompt)
+                    ai_response = ask_llm(search_query, relevant_content, prompt, routed=route_models)
+                    if ai_response:
+                        conversation.add(query, ai_response)
                 
                 if not ai_response:
                     ai_response = f"**Marvel Audio Analysis**\n\nAudio: {selected_audio}\n\nQuestion: {query}\n\n*AI analysis temporarily unavailable. Please ensure Ollama is running.*"
@@ -683,8 +1027,12 @@ else:  # System Status
     if st.session_state.marvel_vector_db:
         st.success("✅ Marvel vector database is loaded")
         try:
-            count = st.session_state.marvel_vector_db._collection.count()
-            st.metric("Documents in DB", count)
+            db = st.session_state.marvel_vector_db
+            if isinstance(db, ShardedVectorStore):
+                st.metric("Documents in DB", db.count())
+                st.write("**Shards:** " + ", ".join(f"{shard}={count}" for shard, count in db.shard_counts().items()))
+            else:
+                st.metric("Documents in DB", db._collection.count())
         except:
             st.info("Could not retrieve document count")
     else:
@@ -693,6 +1041,49 @@ else:  # System Status
     
     st.markdown("---")
     
+    # Per-stage latency percentiles
+    st.markdown("### ⏱️ Performance Metrics")
+    # The registry is shared by every session of this server, so it is set at startup, not per user
+    st.caption(f"Tracing is {'on' if metrics.enabled else 'off'} for this server (MARVEL_METRICS at startup)")
+    
+    snapshot = metrics.snapshot()
+    if snapshot['stages']:
+        rows = []
+        for stage, stats in snapshot['stages'].items():
+            rows.append({
+                "Stage": stage,
+                "Count": stats['count'],
+                "p50 (ms)": round(stats['p50'] * 1000, 1),
+                "p95 (ms)": round(stats['p95'] * 1000, 1),
+                "p99 (ms)": round(stats['p99'] * 1000, 1),
+                "Total (s)": round(stats['total_seconds'], 2),
+            })
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+        if snapshot['counters']:
+            st.write("**Counters:** " + ", ".join(f"{name}={value}" for name, value in sorted(snapshot['counters'].items())))
+    elif metrics.enabled:
+        st.info("No stages recorded yet. Ask a question to collect timings.")
+    else:
+        st.info("Tracing is off. Start the app with MARVEL_METRICS=1 to collect timings.")
+    
+    # Which model answered, and how fast
+    router_stats = load_router().stats()
+    if router_stats:
+        st.markdown("#### 🔀 Model Routing")
+        st.dataframe([{"Model": model, "Calls": stats['calls'], "Share": stats['share'],
+                       "Escalated": stats['escalations'], "Errors": stats['errors'],
+                       "p50 (ms)": stats['p50_ms'], "p95 (ms)": stats['p95_ms']}
+                      for model, stats in router_stats.items()], use_container_width=True, hide_index=True)
+    
+    startup_phases = startup.as_dict()['phases']
+    if startup_phases:
+        model_ready = getattr(st.session_state.embeddings, 'embeddings', None)
+        model_ready = getattr(model_ready, 'ready', True)
+        st.write("**Startup (s):** " + ", ".join(f"{name}={seconds}" for name, seconds in startup_phases.items())
+                 + ("" if model_ready else " · embedding model still warming up"))
+    
+    st.markdown("---")
+    
     # Documents list
     st.markdown("### 📄 Available Documents")
     if st.session_state.preprocessed_docs:
@@ -0,0 +1,173 @@
+"""
+Benchmark admission control under simulated multi-user load
+
+Runs a fake, slow Ollama that degrades once more requests run than it has
+capacity for, the way a CPU-bound local model does. Simulated users then
+send a mix of short and long prompts. One user is greedy and sends bursts
+with no think time. The same load runs twice:
+- direct: every request goes straight to Ollama with a client timeout
+  (like query_mistral_marvel before admission control)
+- admission: requests go through AdmissionController with fair queueing,
+  short-prompt priority, a bounded queue and deadline-aware rejection
+
+For each mode it reports the outcomes (answered, timed out, rejected,
+expired), throughput, latency percentiles of answered requests (short and
+long), and Jain's fairness index of the answered share per user.
+
+Usage: python benchmarks/bench_admission.py [--users 8] [--requests 4] [--latency 0.2]
+"""
+import random
+import argparse
+import threading
+import time
+
+import requests
+
+from bench_utils import summarize, print_table, save_results
+from marvel_admission import AdmissionController, Rejected
+from marvel_fake_ollama import start_fake_ollama
+
+SHORT_TOKENS = 300
+LONG_TOKENS = 1500
+
+def make_load(users, requests_per_user, greedy_factor=3, short_share=0.6, seed=7):
+    """[(user, start_offset_s, prompt_tokens)]; user 0 sends greedy_factor times more, back to back"""
+    rng = random.Random(seed)
+    load = []
+    for user in range(users):
+        count = requests_per_user * (greedy_factor if user == 0 else 1)
+        offset = rng.uniform(0, 0.2)
+        for _ in range(count):
+            tokens = SHORT_TOKENS if rng.random() < short_share else LONG_TOKENS
+            load.append((user, offset, tokens))
+            offset += 0.0 if user == 0 else rng.uniform(0.2, 1.0)
+    return load
+
+def jain(values):
+    """Jain's fairness index: 1.0 when all values are equal, 1/n when one user gets everything"""
+    if not values or not any(values):
+        return 0.0
+    return round(sum(values) ** 2 / (len(values) * sum(v * v for v in values)), 3)
+
+def generate(url, tokens, timeout):
+    response = requests.post(f"{url}/api/generate", timeout=timeout, json={
+        'model': "mistral:7b", 'prompt': "x" * (tokens * 4), 'stream': False,
+    })
+    response.raise_for_status()
+    return response.json()['response']
+
+def run(load, url, timeout, controller=None):
+    """Replay the load; returns one record per request"""
+    records = []
+    lock = threading.Lock()
+    by_user = {}
+    for user, offset, tokens in load:
+        by_user.setdefault(user, []).append((offset, tokens))
+    start = time.perf_counter()
+
+    def user_loop(user, requests_):
+        for offset, tokens in requests_:
+            # Users wait for their previous answer, then for their next scheduled time
+            time.sleep(max(0.0, start + offset - time.perf_counter()))
+            submitted = time.perf_counter()
+            record = {'user': user, 'tokens': tokens, 'outcome': 'answered', 'queue_s': 0.0}
+            try:
+                if controller is None:
+                    generate(url, tokens, timeout)
+                else:
+                    ticket = controller.submit(f"user-{user}", tokens)
+                    try:
+                        ticket.wait()
+                        record['queue_s'] = time.perf_counter() - submitted
+                        generate(url, tokens, timeout)
+                    finally:
+                        ticket.release()
+            except Rejected as e:
+                record['outcome'] = 'expired' if e.reason == 'expired' else 'rejected'
+            except requests.exceptions.Timeout:
+                record['outcome'] = 'timed_out'
+            except Exception:
+                record['outcome'] = 'error'
+            record['latency_ms'] = (time.perf_counter() - submitted) * 1000
+            with lock:
+                records.append(record)
+
+    threads = [threading.Thread(target=user_loop, args=(user, reqs)) for user, reqs in by_user.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return records, elapsed
+
+def report(mode, records, elapsed, users):
+    answered = [r for r in records if r['outcome'] == 'answered']
+    counts = {outcome: sum(r['outcome'] == outcome for r in records)
+              for outcome in ('answered', 'timed_out', 'rejected', 'expired', 'error')}
+    share = []
+    for user in range(users):
+        sent = [r for r in records if r['user'] == user]
+        share.append(sum(r['outcome'] == 'answered' for r in sent) / len(sent) if sent else 0.0)
+    latency = summarize([r['latency_ms'] for r in answered])
+    short = summarize([r['latency_ms'] for r in answered if r['tokens'] == SHORT_TOKENS])
+    long_ = summarize([r['latency_ms'] for r in answered if r['tokens'] == LONG_TOKENS])
+    # Time spent failing: how long users waited for a request that gave them nothing
+    failed = summarize([r['latency_ms'] for r in records if r['outcome'] != 'answered'])
+    return {
+        'mode': mode, 'requests': len(records), **counts,
+        'throughput_rps': round(len(answered) / elapsed, 3),
+        'p50_ms': latency['p50_ms'], 'p95_ms': latency['p95_ms'], 'p99_ms': latency['p99_ms'],
+        'short_p95_ms': short['p95_ms'], 'long_p95_ms': long_['p95_ms'],
+        'failed_p50_ms': failed['p50_ms'], 'fairness': jain(share),
+    }
+
+def main(users=8, requests_per_user=4, latency=0.2, prefill=0.4, capacity=1, timeout=4.0, max_queue=8,
+         max_wait_s=3.0, seed=7):
+    print("🦸 Admission control benchmark")
+    server, state, url = start_fake_ollama(latency=latency, capacity=capacity, prefill=prefill)
+    load = make_load(users, requests_per_user, seed=seed)
+    print(f"   {len(load)} requests from {users} users against a fake Ollama "
+          f"({latency}s + {prefill}s per 1k prompt tokens, capacity {capacity}, client timeout {timeout}s)")
+
+    rows = []
+    records, elapsed = run(load, url, timeout)
+    rows.append(report('direct', records, elapsed, users))
+    print(f"   ✅ direct: {rows[-1]['answered']} answered in {elapsed:.1f}s (peak {state.peak_active} concurrent)")
+
+    # Timed-out requests keep the fake model busy, as with Ollama; let it drain first
+    while state.active:
+        time.sleep(0.1)
+    state.peak_active = 0
+    # Expected service time seeded with the idle latency of a mid-size prompt
+    controller = AdmissionController(concurrency=capacity, max_queue=max_queue, max_wait_s=max_wait_s,
+                                     expected_service_s=latency + prefill * (SHORT_TOKENS + LONG_TOKENS) / 2000)
+    records, elapsed = run(load, url, timeout, controller)
+    rows.append(report('admission', records, elapsed, users))
+    print(f"   ✅ admission: {rows[-1]['answered']} answered in {elapsed:.1f}s (peak {state.peak_active} concurrent)")
+    server.shutdown()
+
+    print()
+    print_table(rows, ['mode', 'requests', 'answered', 'timed_out', 'rejected', 'expired', 'throughput_rps'])
+    print()
+    print_table(rows, ['mode', 'p50_ms', 'p95_ms', 'p99_ms', 'short_p95_ms', 'long_p95_ms', 'failed_p50_ms',
+                       'fairness'])
+    save_results("admission", {
+        'users': users, 'requests_per_user': requests_per_user, 'latency': latency, 'prefill': prefill,
+        'capacity': capacity, 'timeout': timeout, 'max_queue': max_queue, 'max_wait_s': max_wait_s, 'rows': rows,
+    })
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark admission control with a fake Ollama")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=4, help="requests per user (the greedy user sends 3x)")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake Ollama seconds per idle generation")
+    parser.add_argument("--prefill", type=float, default=0.4, help="fake Ollama seconds per 1000 prompt tokens")
+    parser.add_argument("--capacity", type=int, default=1, help="concurrent generations before slowing down")
+    parser.add_argument("--timeout", type=float, default=4.0, help="client timeout per request")
+    parser.add_argument("--max-queue", type=int, default=8)
+    parser.add_argument("--max-wait", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    main(users=args.users, requests_per_user=args.requests, latency=args.latency, prefill=args.prefill,
+         capacity=args.capacity, timeout=args.timeout, max_queue=args.max_queue, max_wait_s=args.max_wait,
+         seed=args.seed)
@@ -0,0 +1,141 @@
+"""
+Benchmark extractive prompt compression: prompt size, latency and answer quality
+
+For every labeled question the top-k chunks are retrieved once, then
+compressed at several ratios (1.0 = whole chunks). Each question also
+lists the key facts a good answer contains. For every ratio it reports:
+- context tokens and the reduction versus whole chunks
+- fact recall of the context: share of key facts still in the prompt
+- compression time with the sentence cache (the only new embedding is the question)
+
+With --llm every prompt is also sent to Ollama. That adds the prompt tokens
+and prefill time reported by Ollama, the end-to-end generation latency, and
+the fact recall of the answers.
+
+Usage: python benchmarks/bench_compression.py [--ratios 1.0 0.7 0.5 0.3] [--llm]
+"""
+import time
+import argparse
+
+import requests
+
+from bench_utils import (LABELED_QUERIES, load_embeddings, load_vectorstore, time_calls, summarize,
+                         print_table, save_results)
+from marvel_compression import PromptCompressor, SentenceCache
+from marvel_conversation import estimate_tokens
+
+# Facts a correct answer to each labeled question mentions (matched case-insensitively)
+KEY_FACTS = {
+    "What are Spider-Man's powers?": ["spider-sense", "cling", "strength"],
+    "Tell me about the Infinity Gauntlet event": ["Thanos", "Infinity Gems", "Starlin"],
+    "Who are the founding members of the Avengers?": ["Iron Man", "Thor", "Hulk", "Ant-Man", "Wasp"],
+    "Describe the Civil War storyline": ["Registration", "Iron Man", "Captain America"],
+    "Who created Wolverine and when did he first appear?": ["Len Wein", "Romita", "Hulk #180"],
+    "What weapons does Black Widow use?": ["Widow's Bite", "marksman"],
+    "What is Doctor Strange's role as Sorcerer Supreme?": ["mystic arts", "Agamotto"],
+    "Who are the founding members of the X-Men?": ["Cyclops", "Beast", "Iceman", "Angel", "Jean Grey"],
+    "How does Thor control lightning?": ["Mjolnir", "lightning"],
+    "What is the Dark Phoenix Saga?": ["Phoenix", "Jean Grey"],
+}
+
+PROMPT = """You are a Marvel Comics expert assistant. Answer the following question about Marvel characters, storylines, comics, or universe based on the provided context.
+
+Context from Marvel knowledge base:
+{context}
+
+Question: {question}
+
+Answer:"""
+
+def fact_recall(text, facts):
+    text = text.lower()
+    return sum(fact.lower() in text for fact in facts) / len(facts)
+
+def ollama_generate(url, model, prompt, num_predict):
+    """Non-streaming generation; returns (answer, prompt tokens, prefill ms, end-to-end ms)"""
+    start = time.perf_counter()
+    response = requests.post(f"{url.rstrip('/')}/api/generate", timeout=600, json={
+        'model': model, 'prompt': prompt, 'stream': False,
+        'options': {'temperature': 0.0, 'num_predict': num_predict},
+    })
+    response.raise_for_status()
+    data = response.json()
+    return (data.get('response', ''), data.get('prompt_eval_count', estimate_tokens(prompt)),
+            data.get('prompt_eval_duration', 0) / 1e6, (time.perf_counter() - start) * 1000)
+
+def mean(values):
+    return round(sum(values) / len(values), 3) if values else 0.0
+
+def main(ratios=(1.0, 0.7, 0.5, 0.3), k=5, repeat=3, llm=False, ollama_url="http://localhost:11434",
+         model="mistral:7b", num_predict=200):
+    print("🦸 Prompt compression benchmark")
+    embeddings = load_embeddings()
+    vectorstore = load_vectorstore(embeddings)
+    cache = SentenceCache()
+    if not len(cache):
+        print("   ⚠️  Sentence cache is empty, sentences are embedded on first use "
+              "(run: python scripts/marvel_compression.py build)")
+    compressor = PromptCompressor(embeddings, cache)
+
+    questions = [question for question, _ in LABELED_QUERIES]
+    chunks = {q: [doc.page_content for doc in vectorstore.similarity_search(q, k=k)] for q in questions}
+    # Warm the cache for any chunk sentence missing from it, so timings measure cache hits
+    for question in questions:
+        compressor.compress_texts(question, chunks[question], ratio=0.5)
+
+    rows = []
+    full_tokens = mean([estimate_tokens("\n\n".join(chunks[q])) for q in questions])
+    for ratio in ratios:
+        def compressed(question, ratio=ratio):
+            if ratio >= 1.0:
+                # What the prompt gets without compression
+                return "\n\n".join(chunks[question])
+            texts = compressor.compress_texts(question, chunks[question], ratio=ratio)
+            return "\n\n".join(text for text in texts if text)
+
+        contexts = {question: compressed(question) for question in questions}
+        tokens = mean([estimate_tokens(contexts[q]) for q in questions])
+        row = {
+            'ratio': ratio,
+            'context_tokens': tokens,
+            'reduction': f"{(1 - tokens / full_tokens) * 100:.0f}%" if full_tokens else "0%",
+            'context_recall': mean([fact_recall(contexts[q], KEY_FACTS[q]) for q in questions]),
+            **{f"compress_{key}": value for key, value in summarize(time_calls(compressed, questions, repeat)).items()
+               if key in ('p50_ms', 'p95_ms')},
+        }
+
+        if llm:
+            prompt_tokens, prefill, total, recall = [], [], [], []
+            for question in questions:
+                answer, n_prompt, prefill_ms, total_ms = ollama_generate(
+                    ollama_url, model, PROMPT.format(context=contexts[question], question=question), num_predict
+                )
+                prompt_tokens.append(n_prompt)
+                prefill.append(prefill_ms)
+                total.append(total_ms)
+                recall.append(fact_recall(answer, KEY_FACTS[question]))
+            row.update({'prompt_tokens': mean(prompt_tokens), 'prefill_ms': mean(prefill),
+                        'total_p50_ms': summarize(total)['p50_ms'], 'answer_recall': mean(recall)})
+        rows.append(row)
+        print(f"   ✅ ratio {ratio}: {row['context_tokens']} context tokens, recall {row['context_recall']}")
+
+    columns = ['ratio', 'context_tokens', 'reduction', 'context_recall', 'compress_p50_ms', 'compress_p95_ms']
+    if llm:
+        columns += ['prompt_tokens', 'prefill_ms', 'total_p50_ms', 'answer_recall']
+    print()
+    print_table(rows, columns)
+    save_results("compression", {'k': k, 'llm': model if llm else None, 'cached_sentences': len(cache),
+                                 'rows': rows})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark extractive prompt compression")
+    parser.add_argument("--ratios", type=float, nargs="+", default=[1.0, 0.7, 0.5, 0.3])
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--llm", action="store_true", help="also generate answers with Ollama")
+    parser.add_argument("--ollama-url", default="http://localhost:11434")
+    parser.add_argument("--model", default="mistral:7b")
+    parser.add_argument("--num-predict", type=int, default=200)
+    args = parser.parse_args()
+    main(ratios=args.ratios, k=args.k, repeat=args.repeat, llm=args.llm, ollama_url=args.ollama_url,
+         model=args.model, num_predict=args.num_predict)
@@ -0,0 +1,397 @@
+"""
+Load test the query layer with simulated concurrent chat users
+
+Drives MarvelRAGQuery end to end (follow-up rewriting, fact table, entity
+narrowing, search, compression, model routing and generation) the way
+the Streamlit chat does: one shared query object, one conversation per
+user. Two kinds of load, each run for --duration seconds per step:
+- closed loop (--users 1 2 4 8): every user asks a question, waits for
+  the answer, thinks for --think seconds on average and asks again,
+  with --follow-ups of the questions being follow-ups
+- open loop (--rate 0.5 1 2): questions arrive at a Poisson rate
+  whatever the latency, served by up to --max-inflight workers. The
+  latency includes the time spent waiting for a worker
+
+Ollama and the embedder can be replaced by local fakes. --fake-ollama
+starts marvel_fake_ollama with a fast small model and a slower large one.
+--fake-embedder uses FakeEmbeddings and ingests raw_data/documents into a
+temporary collection. Both run in this process, so CPU and memory figures
+include them.
+
+For every step it reports throughput, error and degraded (context
+without an LLM answer) rates, end-to-end p50/p95/p99, p50/p95/p99 per
+stage from marvel_metrics, and CPU, RSS and thread counts. The last
+step within --slo-ms p95 and 1% errors or degraded answers is the
+capacity. --save-baseline
+stores the run under benchmarks/baselines/ with the git commit, and
+--compare checks a later run against it (exit code 1 on a regression).
+
+Usage:
+  python benchmarks/bench_load.py --fake-ollama --fake-embedder --users 1 2 4 8 16 --duration 20
+  python benchmarks/bench_load.py --rate 0.2 0.5 1 --duration 60        # real Ollama and bge-large
+  python benchmarks/bench_load.py --fake-ollama --fake-embedder --save-baseline main
+  python benchmarks/bench_load.py --fake-ollama --fake-embedder --compare main
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_utils import BENCH_DIR, BASE_DIR, SAMPLE_QUERIES, summarize, print_table, save_results
+from marvel_metrics import metrics
+from marvel_profiling import current_rss_mb, peak_rss_mb
+from marvel_pipeline import load_script_module
+from marvel_conversation import ConversationMemory, ollama_llm
+from marvel_facts import build_facts
+from marvel_entities import build_entity_index
+from marvel_compression import cache_chunk_sentences
+from marvel_router import SMALL_MODEL, LARGE_MODEL
+from marvel_fake_ollama import start_fake_ollama
+from marvel_fake_embeddings import FakeEmbeddings
+
+FOLLOW_UPS = [
+    "What about his enemies?",
+    "Who created him?",
+    "Which team is he part of?",
+    "Tell me more about that",
+]
+BASELINE_DIR = BENCH_DIR / "baselines"
+# (metric, direction that is better) compared against a baseline
+COMPARED = [('throughput_rps', 'higher'), ('p50_ms', 'lower'), ('p95_ms', 'lower'), ('p99_ms', 'lower'),
+            ('error_rate', 'lower'), ('degraded_rate', 'lower'), ('rss_mb_max', 'lower')]
+
+class ResourceSampler(threading.Thread):
+    """Samples process CPU %, RSS and thread count while a step runs"""
+    def __init__(self, interval=0.5):
+        super().__init__(name="resource-sampler", daemon=True)
+        self.interval = interval
+        self.samples = []
+        self.done = threading.Event()
+
+    def run(self):
+        last_cpu, last_time = sum(os.times()[:2]), time.perf_counter()
+        while not self.done.wait(self.interval):
+            cpu, now = sum(os.times()[:2]), time.perf_counter()
+            self.samples.append({
+                'cpu_pct': 100 * (cpu - last_cpu) / (now - last_time),
+                'rss_mb': current_rss_mb(),
+                'threads': threading.active_count(),
+            })
+            last_cpu, last_time = cpu, now
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        cpu = [s['cpu_pct'] for s in self.samples] or [0.0]
+        rss = [s['rss_mb'] for s in self.samples if s['rss_mb'] is not None]
+        return {
+            'cpu_pct_mean': round(sum(cpu) / len(cpu), 1),
+            'cpu_pct_max': round(max(cpu), 1),
+            'rss_mb_max': max(rss) if rss else peak_rss_mb(),
+            'threads_max': max((s['threads'] for s in self.samples), default=threading.active_count()),
+        }
+
+def build_store(raw_data_dir, work_dir, embeddings, chunk_size=1000, overlap=200):
+    """Ingest raw_data/documents into a temporary collection, fact table and entity index"""
+    from langchain_chroma import Chroma
+    documents_dir = raw_data_dir / "documents"
+    texts, metadatas = [], []
+    for path in sorted(documents_dir.glob("*.txt")):
+        text = path.read_text(encoding='utf-8')
+        category = next((c for c in ('character', 'team', 'event', 'comic') if c in path.name.lower()), 'general')
+        # Same overlapping chunks as 4_process_marvel_content.py
+        for chunk_id, start in enumerate(range(0, len(text), chunk_size - overlap)):
+            texts.append(text[start:start + chunk_size])
+            metadatas.append({'source': path.name, 'chunk_id': chunk_id, 'type': 'document', 'category': category})
+    if not texts:
+        raise FileNotFoundError(f"No documents in {documents_dir}")
+
+    vectorstore = Chroma(collection_name="marvel_knowledge_base", embedding_function=embeddings,
+                         persist_directory=str(work_dir / "vectorstore"))
+    vectorstore.add_texts(texts, metadatas=metadatas)
+    processed_dir = work_dir / "processed_data"
+    processed_dir.mkdir(parents=True, exist_ok=True)
+    build_facts(documents_dir, processed_dir / "facts.json")
+    build_entity_index(raw_data_dir, processed_dir / "entities.json")
+    cache_chunk_sentences(texts, embeddings, processed_dir / "sentence_cache")
+    return work_dir / "vectorstore", len(texts)
+
+def classify(result):
+    if result is None:
+        return 'error'
+    if result.get('fast_path'):
+        return 'fact'
+    # Context without an answer: the LLM failed or is not available
+    if 'context' in result:
+        return 'degraded'
+    return 'answered'
+
+def ask(rag, question, memory, k, started=None):
+    started = started or time.perf_counter()
+    try:
+        outcome = classify(rag.query(question, k=k, memory=memory))
+    except Exception:
+        outcome = 'error'
+    return {'question': question, 'outcome': outcome, 'latency_ms': (time.perf_counter() - started) * 1000}
+
+def new_memory(rag, ollama_url):
+    return ConversationMemory(llm=ollama_llm(base_url=ollama_url),
+                              rewrite_llm=ollama_llm(model=SMALL_MODEL, base_url=ollama_url),
+                              aliases=rag.memory.aliases)
+
+def run_closed(rag, users, duration, think, follow_ups, k, ollama_url, seed):
+    """`users` threads asking, waiting for the answer and thinking, until the duration is up"""
+    records = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def user_loop(user):
+        rng = random.Random(seed * 1000 + user)
+        memory = new_memory(rag, ollama_url)
+        asked = False
+        while time.perf_counter() < deadline:
+            follow_up = asked and rng.random() < follow_ups
+            record = ask(rag, rng.choice(FOLLOW_UPS if follow_up else SAMPLE_QUERIES), memory, k)
+            with lock:
+                records.append(record)
+            asked = True
+            if think:
+                time.sleep(min(rng.expovariate(1.0 / think), max(0.0, deadline - time.perf_counter())))
+
+    threads = [threading.Thread(target=user_loop, args=(user,), name=f"user-{user}") for user in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records
+
+def run_open(rag, rate, duration, max_inflight, k, ollama_url, seed):
+    """Poisson arrivals at `rate` per second, each a new conversation, on up to max_inflight workers"""
+    rng = random.Random(seed)
+    arrivals = []
+    offset = rng.expovariate(rate)
+    while offset < duration:
+        arrivals.append((offset, rng.choice(SAMPLE_QUERIES)))
+        offset += rng.expovariate(rate)
+
+    start = time.perf_counter()
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="arrival") as pool:
+        for offset, question in arrivals:
+            time.sleep(max(0.0, start + offset - time.perf_counter()))
+            futures.append(pool.submit(ask, rag, question, new_memory(rag, ollama_url), k, start + offset))
+    return [future.result() for future in futures]
+
+def report(step, records, elapsed, snapshot, resources):
+    """One row of the step table and its per-stage percentiles"""
+    counts = {outcome: sum(r['outcome'] == outcome for r in records)
+              for outcome in ('answered', 'fact', 'degraded', 'error')}
+    total = len(records) or 1
+    latency = summarize([r['latency_ms'] for r in records if r['outcome'] != 'error'])
+    row = {
+        'step': step, 'requests': len(records), **counts,
+        'throughput_rps': round((counts['answered'] + counts['fact']) / elapsed, 3),
+        'error_rate': round(counts['error'] / total, 3),
+        'degraded_rate': round(counts['degraded'] / total, 3),
+        'p50_ms': latency['p50_ms'], 'p95_ms': latency['p95_ms'], 'p99_ms': latency['p99_ms'],
+        **resources,
+    }
+    stages = {name: {'count': stats['count'], 'p50_ms': round(stats['p50'] * 1000, 1),
+                     'p95_ms': round(stats['p95'] * 1000, 1), 'p99_ms': round(stats['p99'] * 1000, 1)}
+              for name, stats in snapshot['stages'].items()}
+    return row, stages
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                capture_output=True, text=True, timeout=5)
+        return result.stdout.strip() or None
+    except Exception:
+        return None
+
+def save_baseline(name, run):
+    BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+    path = BASELINE_DIR / f"{name}.json"
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(run, f, indent=2)
+    print(f"📌 Baseline saved to {path}")
+    return path
+
+def compare_baseline(name, run, tolerance):
+    """Print current vs baseline per step and metric; returns the number of regressions"""
+    path = BASELINE_DIR / f"{name}.json"
+    if not path.exists():
+        print(f"❌ No baseline {path}")
+        return 1
+    with open(path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\n📊 Compared with baseline '{name}' (commit {baseline.get('commit')}, {baseline.get('date')})")
+    if baseline['config'] != run['config']:
+        changed = sorted(key for key in set(baseline['config']) | set(run['config'])
+                         if baseline['config'].get(key) != run['config'].get(key))
+        print(f"   ⚠️  Configuration differs from the baseline: {', '.join(changed)}")
+
+    base_rows = {row['step']: row for row in baseline['rows']}
+    rows, regressions = [], 0
+    for row in run['rows']:
+        base = base_rows.get(row['step'])
+        if base is None:
+            continue
+        for metric, better in COMPARED:
+            old, new = base.get(metric), row.get(metric)
+            if old is None or new is None:
+                continue
+            if metric in ('error_rate', 'degraded_rate'):
+                # Rates near zero: compare absolute points
+                worse = new - old > 0.01
+                change = f"{(new - old) * 100:+.1f} pts"
+            else:
+                relative = (new - old) / old if old else 0.0
+                worse = relative < -tolerance if better == 'higher' else relative > tolerance
+                change = f"{relative:+.0%}"
+            regressions += worse
+            rows.append({'step': row['step'], 'metric': metric, 'baseline': old, 'current': new,
+                         'change': change, 'status': "⚠️ worse" if worse else "ok"})
+    print_table(rows, ['step', 'metric', 'baseline', 'current', 'change', 'status'])
+    print(f"\n   {'❌' if regressions else '✅'} {regressions} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+def main(users=(1, 2, 4, 8), rates=None, duration=20.0, think=2.0, follow_ups=0.2, max_inflight=32, k=5,
+         fake_ollama=False, llm_latency=0.5, small_latency=0.15, llm_capacity=2, fail_rate=0.0,
+         fake_embedder=False, embed_latency=0.02, raw_data_dir=None, router=True, facts=True, slo_ms=5000,
+         baseline=None, compare=None, tolerance=0.15, verbose=False, seed=7):
+    print("🦸 Load test")
+    config = {
+        'mode': 'open' if rates else 'closed', 'steps': list(rates or users), 'duration': duration,
+        'think': think, 'follow_ups': follow_ups, 'max_inflight': max_inflight, 'k': k,
+        'fake_ollama': fake_ollama, 'llm_latency': llm_latency, 'small_latency': small_latency,
+        'llm_capacity': llm_capacity, 'fail_rate': fail_rate, 'fake_embedder': fake_embedder,
+        'embed_latency': embed_latency, 'router': router, 'facts': facts, 'seed': seed,
+    }
+
+    server = None
+    ollama_url = "http://localhost:11434"
+    if fake_ollama:
+        server, _state, ollama_url = start_fake_ollama(
+            latency=llm_latency, capacity=llm_capacity, fail_rate=fail_rate,
+            model_latency={SMALL_MODEL: small_latency, LARGE_MODEL: llm_latency}
+        )
+        print(f"   🧪 Fake Ollama at {ollama_url} ({LARGE_MODEL} {llm_latency}s, {SMALL_MODEL} {small_latency}s, "
+              f"capacity {llm_capacity})")
+
+    embeddings = None
+    vectorstore_dir = BASE_DIR / "vectorstore"
+    work_dir = None
+    if fake_embedder:
+        embeddings = FakeEmbeddings(latency=embed_latency)
+        work_dir = tempfile.mkdtemp(prefix="marvel_load_")
+        vectorstore_dir, chunks = build_store(raw_data_dir or BASE_DIR / "raw_data", Path(work_dir), embeddings)
+        print(f"   🧪 Fake embedder ({embed_latency}s per call), {chunks} chunks ingested into {work_dir}")
+
+    query_module = load_script_module(BASE_DIR / "scripts" / "5_marvel_rag_query.py")
+    rag = query_module.MarvelRAGQuery(vectorstore_dir=vectorstore_dir, embeddings=embeddings,
+                                      ollama_url=ollama_url, small_model=SMALL_MODEL if router else None,
+                                      use_facts=facts)
+    metrics.enable()
+    # Warm up lazy pieces (compressor, LLM clients) outside the measured steps
+    ask(rag, "Describe the Civil War storyline", new_memory(rag, ollama_url), k)
+
+    rows, stages = [], {}
+    quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    for level in (rates or users):
+        step = f"{level} rps" if rates else f"{level} users"
+        print(f"   ▶️  {step} for {duration:.0f}s...")
+        metrics.reset()
+        sampler = ResourceSampler()
+        sampler.start()
+        start = time.perf_counter()
+        with quiet:
+            if rates:
+                records = run_open(rag, level, duration, max_inflight, k, ollama_url, seed)
+            else:
+                records = run_closed(rag, level, duration, think, follow_ups, k, ollama_url, seed)
+        # Open-loop steps can finish early when the last arrival comes before the end
+        elapsed = max(time.perf_counter() - start, duration)
+        row, stages[step] = report(step, records, elapsed, metrics.snapshot(), sampler.stop())
+        rows.append(row)
+        print(f"      {row['requests']} requests, {row['throughput_rps']} rps, p95 {row['p95_ms']:.0f} ms, "
+              f"{row['error_rate']:.1%} errors")
+
+    print()
+    print_table(rows, ['step', 'requests', 'answered', 'fact', 'degraded', 'error', 'throughput_rps',
+                       'p50_ms', 'p95_ms', 'p99_ms'])
+    print()
+    print_table(rows, ['step', 'error_rate', 'degraded_rate', 'cpu_pct_mean', 'cpu_pct_max', 'rss_mb_max',
+                       'threads_max'])
+    for step, step_stages in stages.items():
+        print(f"\n   Stages at {step}:")
+        print_table([{'stage': name, **values} for name, values in step_stages.items()],
+                    ['stage', 'count', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+    # Capacity: the last step answering fast enough, with at most 1% errors or answers without the LLM
+    within = [row['step'] for row in rows
+              if row['p95_ms'] <= slo_ms and row['error_rate'] + row['degraded_rate'] <= 0.01]
+    if within:
+        print(f"\n   ✅ Within the SLO (p95 <= {slo_ms:.0f} ms, <= 1% failed) up to {within[-1]}")
+    else:
+        print(f"\n   ⚠️  No step met the SLO (p95 <= {slo_ms:.0f} ms, <= 1% failed)")
+
+    run = {'commit': git_commit(), 'date': datetime.now().isoformat(timespec='seconds'), 'config': config,
+           'rows': rows, 'stages': stages}
+    save_results("load", run)
+    if baseline:
+        save_baseline(baseline, run)
+    regressions = compare_baseline(compare, run, tolerance) if compare else 0
+    if server:
+        server.shutdown()
+    if work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the Marvel query layer with concurrent users")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8], help="closed-loop user counts")
+    load.add_argument("--rate", type=float, nargs="+", default=None, help="open-loop arrival rates (questions/s)")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per step")
+    parser.add_argument("--think", type=float, default=2.0, help="mean think time between a user's questions")
+    parser.add_argument("--follow-ups", type=float, default=0.2, help="share of follow-up questions")
+    parser.add_argument("--max-inflight", type=int, default=32, help="open-loop workers")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--fake-ollama", action="store_true", help="run against an in-process fake Ollama")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help=f"fake {LARGE_MODEL} seconds per answer")
+    parser.add_argument("--small-latency", type=float, default=0.15, help=f"fake {SMALL_MODEL} seconds per answer")
+    parser.add_argument("--llm-capacity", type=int, default=2, help="fake Ollama generations before slowing down")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of fake Ollama requests failing")
+    parser.add_argument("--fake-embedder", action="store_true",
+                        help="hashing embedder and a temporary collection instead of bge-large")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="fake embedder seconds per call")
+    parser.add_argument("--raw-data-dir", type=Path, default=None, help="documents for the fake-embedder collection")
+    parser.add_argument("--no-router", action="store_true", help=f"send every question to {LARGE_MODEL}")
+    parser.add_argument("--no-facts", action="store_true", help="skip the fact-table fast path")
+    parser.add_argument("--slo-ms", type=float, default=5000, help="p95 latency target for the capacity estimate")
+    parser.add_argument("--save-baseline", default=None, metavar="NAME", help="save this run as a baseline")
+    parser.add_argument("--compare", default=None, metavar="NAME", help="compare this run with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change counted as a regression")
+    parser.add_argument("--verbose", action="store_true", help="keep the query layer's output")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    regressions = main(
+        users=args.users, rates=args.rate, duration=args.duration, think=args.think, follow_ups=args.follow_ups,
+        max_inflight=args.max_inflight, k=args.k, fake_ollama=args.fake_ollama, llm_latency=args.llm_latency,
+        small_latency=args.small_latency, llm_capacity=args.llm_capacity, fail_rate=args.fail_rate,
+        fake_embedder=args.fake_embedder, embed_latency=args.embed_latency, raw_data_dir=args.raw_data_dir,
+        router=not args.no_router, facts=not args.no_facts, slo_ms=args.slo_ms, baseline=args.save_baseline,
+        compare=args.compare, tolerance=args.tolerance, verbose=args.verbose, seed=args.seed,
+    )
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,56 @@
+"""
+Benchmark filtered versus unfiltered retrieval latency
+
+Compares, for each filter:
+- unfiltered similarity search over the whole collection
+- filters pushed down as a Chroma where clause
+- filters resolved by the in-memory MetadataIndex first (exact scoring of
+  small candidate sets, pushdown otherwise)
+
+Usage: python benchmarks/bench_metadata_filters.py [--repeat 3]
+"""
+import argparse
+
+from bench_utils import (SAMPLE_QUERIES, load_embeddings, load_vectorstore, time_calls,
+                         summarize, print_table, save_results)
+from marvel_retrieval import MarvelRetriever, MetadataIndex
+
+FILTER_CASES = [
+    ("type=document", {'type': 'document'}),
+    ("type=image", {'type': 'image'}),
+    ("category=event", {'category': 'event'}),
+    ("category=character", {'category': 'character'}),
+    ("category=team|event", {'category': ['team', 'event']}),
+    ("document+character", {'type': 'document', 'category': 'character'}),
+]
+
+def main(repeat=3, k=5):
+    print("🦸 Metadata filter benchmark")
+    embeddings = load_embeddings()
+    vectorstore = load_vectorstore(embeddings)
+    index = MetadataIndex(vectorstore._collection)
+    print(f"   Collection size: {index.size} chunks")
+
+    pushdown = MarvelRetriever(vectorstore, embeddings)
+    indexed = MarvelRetriever(vectorstore, embeddings, index)
+
+    rows = []
+    baseline = summarize(time_calls(lambda q: pushdown.search(q, k=k), SAMPLE_QUERIES, repeat))
+    rows.append({'filter': 'none', 'mode': 'unfiltered', 'candidates': index.size, **baseline})
+
+    for label, filters in FILTER_CASES:
+        candidates = index.candidates(filters)
+        for mode, retriever in (('pushdown', pushdown), ('metadata_index', indexed)):
+            stats = summarize(time_calls(lambda q: retriever.search(q, k=k, filters=filters), SAMPLE_QUERIES, repeat))
+            rows.append({'filter': label, 'mode': mode, 'candidates': len(candidates), **stats})
+
+    print()
+    print_table(rows, ['filter', 'mode', 'candidates', 'p50_ms', 'p95_ms', 'mean_ms'])
+    save_results("metadata_filters", {'collection_size': index.size, 'k': k, 'rows': rows})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark filtered vs unfiltered retrieval")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+    main(repeat=args.repeat, k=args.k)
@@ -0,0 +1,90 @@
+"""
+Benchmark memory of N embedding clients with and without the shared model host
+
+Starts N client processes at once, the way several Streamlit servers or
+ingestion workers would run on one machine. Each client embeds the sample
+questions and reports its resident memory:
+- local: every client loads its own bge-large (the behavior without a host)
+- host: every client talks to one model host; the host's RSS is added once
+
+For each client count it reports the total RSS, RSS per client and the
+mean time to embed the questions. With a host the total should stay about
+flat as clients are added.
+
+Usage: python benchmarks/bench_model_host.py [--clients 1 2 4] [--modes local host]
+"""
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+from bench_utils import SAMPLE_QUERIES, load_embeddings, print_table, save_results
+from marvel_model_host import RemoteEmbeddings, start_model_host, wait_for_host
+from marvel_profiling import current_rss_mb
+
+def run_client(mode, address):
+    """Child process: embed the sample questions and print RSS and timing as JSON"""
+    embeddings = RemoteEmbeddings(address) if mode == 'host' else load_embeddings()
+    start = time.perf_counter()
+    embeddings.embed_documents(SAMPLE_QUERIES)
+    for question in SAMPLE_QUERIES:
+        embeddings.embed_query(question)
+    print(json.dumps({'rss_mb': current_rss_mb(), 'embed_s': time.perf_counter() - start}))
+
+def run(mode, clients, address):
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--client", mode, "--address", address]
+    procs = [subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True) for _ in range(clients)]
+    reports = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(f"{mode} client exited with code {proc.returncode}")
+        reports.append(json.loads(out.strip().splitlines()[-1]))
+    clients_mb = sum(report['rss_mb'] for report in reports)
+    host_mb = RemoteEmbeddings(address).status()['rss_mb'] if mode == 'host' else 0.0
+    return {
+        'mode': mode, 'clients': clients,
+        'client_rss_mb': round(clients_mb, 1),
+        'host_rss_mb': round(host_mb, 1),
+        'total_rss_mb': round(clients_mb + host_mb, 1),
+        'per_client_mb': round((clients_mb + host_mb) / clients, 1),
+        'embed_mean_ms': round(sum(report['embed_s'] for report in reports) / clients * 1000, 1),
+    }
+
+def main(client_counts=(1, 2, 4), modes=('local', 'host'), address=None):
+    print("🦸 Shared model host benchmark")
+    address = address or str(Path(__file__).parent / "results" / "model_host.sock")
+    if 'host' in modes:
+        Path(address).parent.mkdir(parents=True, exist_ok=True)
+        status = wait_for_host(address, timeout=1) or start_model_host(address)
+        if status is None:
+            print("❌ Model host did not start (see warm_start/model_host.log)")
+            return
+        print(f"   Model host pid {status['pid']} at {address}, {status['rss_mb']} MB")
+
+    rows = []
+    for mode in modes:
+        for clients in client_counts:
+            print(f"   {mode}: {clients} clients...")
+            rows.append(run(mode, clients, address))
+
+    print()
+    print_table(rows, ['mode', 'clients', 'client_rss_mb', 'host_rss_mb', 'total_rss_mb', 'per_client_mb',
+                       'embed_mean_ms'])
+    save_results("model_host", {'rows': rows})
+    if 'host' in modes:
+        print(f"\n   The model host keeps running; stop it with: kill {status['pid']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare RSS of embedding clients with and without the model host")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4], help="client process counts")
+    parser.add_argument("--modes", nargs="+", choices=['local', 'host'], default=['local', 'host'])
+    parser.add_argument("--address", default=None, help="model host socket (default benchmarks/results/model_host.sock)")
+    parser.add_argument("--client", choices=['local', 'host'], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.client:
+        run_client(args.client, args.address)
+    else:
+        main(client_counts=args.clients, modes=args.modes, address=args.address)
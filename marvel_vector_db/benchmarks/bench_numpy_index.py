@@ -0,0 +1,98 @@
+"""
+Benchmark the exact NumPy index against Chroma's HNSW search
+
+Reports, for the sample questions:
+- recall@k of Chroma HNSW measured against the exact NumPy top-k
+- single-query latency for Chroma and NumPy (float32 and float16)
+- batched throughput of NumPy batch_search (one matrix product per batch)
+
+Query embedding time is excluded from the search latencies: every engine
+is fed the same precomputed query vectors.
+
+Usage: python benchmarks/bench_numpy_index.py [--repeat 3] [-k 5]
+"""
+import time
+import argparse
+
+from bench_utils import (BASE_DIR, SAMPLE_QUERIES, load_embeddings, load_vectorstore, time_calls,
+                         summarize, print_table, save_results)
+from marvel_numpy_index import NumpyVectorIndex
+
+def main(repeat=3, k=5, batch_repeat=20):
+    print("🦸 Exact NumPy index benchmark")
+    embeddings = load_embeddings()
+    vectorstore = load_vectorstore(embeddings)
+    persist_dir = BASE_DIR / "vectorstore"
+
+    indexes = {}
+    for dtype in ('float32', 'float16'):
+        index_dir = persist_dir / "numpy_index" if dtype == 'float32' else persist_dir / f"numpy_index_{dtype}"
+        indexes[dtype] = NumpyVectorIndex.open_or_build(vectorstore, persist_dir, index_dir, dtype=dtype)
+    size = len(indexes['float32'].records)
+    print(f"   Collection size: {size} chunks")
+
+    query_vectors = dict(zip(SAMPLE_QUERIES, embeddings.embed_documents(SAMPLE_QUERIES)))
+
+    def chroma_search(query):
+        return vectorstore.similarity_search_by_vector_with_relevance_scores(query_vectors[query], k=k)
+
+    # Recall of HNSW against the exact answer
+    exact_ids = {}
+    recalls = []
+    for query in SAMPLE_QUERIES:
+        hits = indexes['float32'].search_vectors([query_vectors[query]], k=k)[0]
+        exact_ids[query] = {indexes['float32'].records[row]['id'] for row, _ in hits}
+        approx = chroma_search(query)
+        approx_texts = {doc.page_content for doc, _ in approx}
+        exact_texts = {indexes['float32'].records[row]['text'] for row, _ in hits}
+        recalls.append(len(approx_texts & exact_texts) / max(1, len(exact_texts)))
+    hnsw_recall = sum(recalls) / len(recalls)
+
+    rows = []
+    stats = summarize(time_calls(chroma_search, SAMPLE_QUERIES, repeat))
+    rows.append({'engine': 'chroma_hnsw', 'recall': round(hnsw_recall, 3), **stats})
+    for dtype, index in indexes.items():
+        stats = summarize(time_calls(lambda q: index.search_vectors([query_vectors[q]], k=k), SAMPLE_QUERIES, repeat))
+        dtype_recall = sum(
+            len({index.records[row]['id'] for row, _ in index.search_vectors([query_vectors[q]], k=k)[0]}
+                & exact_ids[q]) / max(1, len(exact_ids[q]))
+            for q in SAMPLE_QUERIES
+        ) / len(SAMPLE_QUERIES)
+        rows.append({'engine': f'numpy_{dtype}', 'recall': round(dtype_recall, 3), **stats})
+
+    # Batched throughput: all sample questions in one matrix product
+    batch = [query_vectors[q] for q in SAMPLE_QUERIES]
+    throughput = []
+    for dtype, index in indexes.items():
+        start = time.perf_counter()
+        for _ in range(batch_repeat):
+            index.search_vectors(batch, k=k)
+        elapsed = time.perf_counter() - start
+        throughput.append({
+            'engine': f'numpy_{dtype}',
+            'batch_size': len(batch),
+            'queries_per_s': round(len(batch) * batch_repeat / elapsed, 1),
+        })
+    start = time.perf_counter()
+    for _ in range(max(1, batch_repeat // 4)):
+        for query in SAMPLE_QUERIES:
+            chroma_search(query)
+    elapsed = time.perf_counter() - start
+    throughput.append({
+        'engine': 'chroma_hnsw',
+        'batch_size': 1,
+        'queries_per_s': round(len(SAMPLE_QUERIES) * max(1, batch_repeat // 4) / elapsed, 1),
+    })
+
+    print()
+    print_table(rows, ['engine', 'recall', 'p50_ms', 'p95_ms', 'mean_ms'])
+    print()
+    print_table(throughput, ['engine', 'batch_size', 'queries_per_s'])
+    save_results("numpy_index", {'collection_size': size, 'k': k, 'latency': rows, 'throughput': throughput})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the exact NumPy index against Chroma")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+    main(repeat=args.repeat, k=args.k)
@@ -0,0 +1,75 @@
+"""
+Benchmark compressed indexes against the uncompressed NumPy index
+
+For the exact float32 index and the int8 and pq compressed indexes reports:
+- resident memory of the vectors or codes, of the records (texts and
+  metadata, kept by every engine) and the total
+- build time
+- recall@k against the exact top-k
+- single-query search latency (query embeddings precomputed)
+
+Usage: python benchmarks/bench_quantized_index.py [--repeat 3] [-k 5] [--rerank-factor 10]
+"""
+import argparse
+
+from bench_utils import (BASE_DIR, SAMPLE_QUERIES, load_embeddings, load_vectorstore, time_calls,
+                         summarize, print_table, save_results)
+from marvel_numpy_index import NumpyVectorIndex
+from marvel_quantized_index import QuantizedVectorIndex
+
+def main(repeat=3, k=5, rerank_factor=10, num_subspaces=64):
+    print("🦸 Compressed index benchmark")
+    embeddings = load_embeddings()
+    vectorstore = load_vectorstore(embeddings)
+    persist_dir = BASE_DIR / "vectorstore"
+
+    exact = NumpyVectorIndex.open_or_build(vectorstore, persist_dir)
+    size = len(exact.records)
+    print(f"   Collection size: {size} chunks")
+    query_vectors = dict(zip(SAMPLE_QUERIES, embeddings.embed_documents(SAMPLE_QUERIES)))
+    exact_rows = {
+        q: {row for row, _ in exact.search_vectors([query_vectors[q]], k=k)[0]}
+        for q in SAMPLE_QUERIES
+    }
+
+    float32_mb = round(exact.vectors.nbytes / 1024 ** 2, 2)
+    records_mb = round(exact.records_bytes() / 1024 ** 2, 2)
+    rows = []
+    stats = summarize(time_calls(lambda q: exact.search_vectors([query_vectors[q]], k=k), SAMPLE_QUERIES, repeat))
+    rows.append({'index': 'float32', 'memory_mb': float32_mb, 'records_mb': records_mb,
+                 'resident_mb': round(float32_mb + records_mb, 2), 'build_s': exact.meta.get('build_seconds'),
+                 'recall': 1.0, **stats})
+
+    for mode in ('int8', 'pq'):
+        # Always rebuild so the build time is measured on this machine
+        index = QuantizedVectorIndex.build(exact, persist_dir / f"quantized_{mode}", mode=mode,
+                                           num_subspaces=num_subspaces)
+        report = index.memory_report()
+
+        def search(q):
+            return index.search_vectors([query_vectors[q]], k=k, rerank_factor=rerank_factor)
+
+        recall = sum(
+            len({row for row, _ in search(q)[0]} & exact_rows[q]) / max(1, len(exact_rows[q]))
+            for q in SAMPLE_QUERIES
+        ) / len(SAMPLE_QUERIES)
+        stats = summarize(time_calls(search, SAMPLE_QUERIES, repeat))
+        rows.append({'index': mode, 'memory_mb': report['code_mb'], 'records_mb': report['records_mb'],
+                     'resident_mb': report['resident_mb'], 'build_s': report['build_seconds'],
+                     'recall': round(recall, 3), **stats})
+
+    print()
+    print_table(rows, ['index', 'memory_mb', 'records_mb', 'resident_mb', 'build_s', 'recall', 'p50_ms', 'p95_ms'])
+    save_results("quantized_index", {
+        'collection_size': size, 'k': k, 'rerank_factor': rerank_factor,
+        'num_subspaces': num_subspaces, 'rows': rows,
+    })
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark int8/pq compressed indexes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--rerank-factor", type=int, default=10)
+    parser.add_argument("--num-subspaces", type=int, default=64)
+    args = parser.parse_args()
+    main(repeat=args.repeat, k=args.k, rerank_factor=args.rerank_factor, num_subspaces=args.num_subspaces)
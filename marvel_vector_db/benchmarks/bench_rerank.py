@@ -0,0 +1,78 @@
+"""
+Benchmark cross-encoder reranking: quality gain versus latency cost
+
+Each question is paired with the source file it should be answered from.
+For plain dense retrieval and for dense over-fetch + cross-encoder rerank
+it reports:
+- hit@k: share of questions whose expected source is in the top-k
+- MRR: mean reciprocal rank of the first chunk from the expected source
+- latency with a cold rerank cache and with a warm one
+
+Usage: python benchmarks/bench_rerank.py [--repeat 2] [-k 5]
+"""
+import argparse
+
+from bench_utils import (LABELED_QUERIES, load_embeddings, load_vectorstore, time_calls, summarize,
+                         print_table, save_results)
+from marvel_rerank import CrossEncoderReranker
+
+def first_relevant_rank(docs, expected):
+    for rank, doc in enumerate(docs, 1):
+        source = str(doc.metadata.get('source', '')).lower().replace(' ', '_')
+        if expected in source:
+            return rank
+    return None
+
+def quality(search, k):
+    """hit@k and MRR over the labeled questions"""
+    hits = 0
+    reciprocal = 0.0
+    for question, expected in LABELED_QUERIES:
+        rank = first_relevant_rank(search(question)[:k], expected)
+        if rank:
+            hits += 1
+            reciprocal += 1.0 / rank
+    return round(hits / len(LABELED_QUERIES), 3), round(reciprocal / len(LABELED_QUERIES), 3)
+
+def main(repeat=2, k=5, fetch_sizes=(20, 50), budget_ms=500):
+    print("🦸 Cross-encoder rerank benchmark")
+    embeddings = load_embeddings()
+    vectorstore = load_vectorstore(embeddings)
+    reranker = CrossEncoderReranker()
+    questions = [q for q, _ in LABELED_QUERIES]
+
+    rows = []
+    dense = lambda q: vectorstore.similarity_search(q, k=k)
+    hit, mrr = quality(dense, k)
+    rows.append({'mode': 'dense', 'fetch_k': k, 'hit@k': hit, 'mrr': mrr,
+                 **summarize(time_calls(dense, questions, repeat))})
+
+    for fetch_k in fetch_sizes:
+        candidates = {q: vectorstore.similarity_search(q, k=fetch_k) for q in questions}
+
+        def reranked(q, budget=0):
+            return reranker.rerank(q, vectorstore.similarity_search(q, k=fetch_k), top_n=k, budget_ms=budget)
+
+        # Quality without a budget, so the fallback doesn't hide the gain
+        hit, mrr = quality(lambda q: reranker.rerank(q, candidates[q], top_n=k, budget_ms=0), k)
+
+        def cold(q):
+            reranker.clear_cache()
+            return reranked(q, budget_ms)
+
+        cold_stats = summarize(time_calls(cold, questions, repeat))
+        warm_stats = summarize(time_calls(lambda q: reranked(q, budget_ms), questions, repeat))
+        rows.append({'mode': 'rerank_cold', 'fetch_k': fetch_k, 'hit@k': hit, 'mrr': mrr, **cold_stats})
+        rows.append({'mode': 'rerank_cached', 'fetch_k': fetch_k, 'hit@k': hit, 'mrr': mrr, **warm_stats})
+
+    print()
+    print_table(rows, ['mode', 'fetch_k', 'hit@k', 'mrr', 'p50_ms', 'p95_ms'])
+    save_results("rerank", {'k': k, 'budget_ms': budget_ms, 'model': reranker.model_name, 'rows': rows})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cross-encoder reranking")
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--budget-ms", type=int, default=500)
+    args = parser.parse_args()
+    main(repeat=args.repeat, k=args.k, budget_ms=args.budget_ms)
@@ -0,0 +1,135 @@
+"""
+Benchmark small/large model routing against fake model endpoints
+
+Starts a fake Ollama where the small model answers faster than the large
+one, and where the small model gives up ("I don't know") on a share of
+prompts. The labeled questions, plus harder comparison questions, are
+answered with the text of their source document as context (from
+raw_data/documents, or a short synthetic context when it is missing), in
+three modes:
+- large: every question goes to the large model (the current behavior)
+- routed: ModelRouter picks the model and escalates weak answers
+- routed-busy: the same, with a queue depth that counts as busy
+
+For each mode it reports the latency percentiles, the share of questions
+answered by each model and the escalation rate, plus the per-model
+statistics collected by the router.
+
+Usage: python benchmarks/bench_router.py [--small-latency 0.05] [--large-latency 0.3] [--unsure 0.2]
+"""
+import time
+import argparse
+from pathlib import Path
+
+import requests
+
+from bench_utils import BASE_DIR, LABELED_QUERIES, summarize, print_table, save_results
+from marvel_router import ModelRouter
+from marvel_fake_ollama import start_fake_ollama
+
+SMALL = "llama3.2:3b"
+LARGE = "mistral:7b"
+
+# Questions that need reasoning over several entities
+HARD_QUERIES = [
+    ("Why did Iron Man and Captain America fight in Civil War?", "civil_war"),
+    ("Compare Thor and Hulk: who is stronger?", "thor"),
+    ("Explain how the X-Men and the Avengers differ in their missions", "x-men"),
+    ("How does Wolverine's healing factor compare to Spider-Man's abilities?", "wolverine"),
+]
+
+PROMPT = """Answer the question about Marvel Comics from the context.
+
+Context:
+{context}
+
+Question: {question}
+
+Answer:"""
+
+def load_contexts(queries, docs_dir):
+    """Source document text per question, or the question itself when the document is missing"""
+    files = list(docs_dir.glob("*.txt")) if docs_dir.exists() else []
+    contexts = {}
+    for question, source in queries:
+        matches = [f for f in files if source in f.stem.lower()]
+        contexts[question] = matches[0].read_text(encoding='utf-8')[:2000] if matches else question
+    return contexts
+
+def generate(url, model, prompt):
+    response = requests.post(f"{url}/api/generate", timeout=30, json={
+        'model': model, 'prompt': prompt, 'stream': False,
+    })
+    response.raise_for_status()
+    return response.json()['response']
+
+def run(mode, queries, contexts, url, router, repeats, queue_depth=0):
+    latencies = []
+    models = {}
+    escalated = 0
+    for _ in range(repeats):
+        for question, _source in queries:
+            prompt = PROMPT.format(context=contexts[question], question=question)
+            start = time.perf_counter()
+            if mode == 'large':
+                generate(url, LARGE, prompt)
+                model = LARGE
+            else:
+                _, decision = router.generate(question, contexts[question], prompt,
+                                              lambda m, p: generate(url, m, p), queue_depth=queue_depth)
+                model = decision['model']
+                escalated += 'escalated_from' in decision
+            latencies.append((time.perf_counter() - start) * 1000)
+            models[model] = models.get(model, 0) + 1
+    total = len(latencies)
+    return {
+        'mode': mode, 'questions': total, **summarize(latencies),
+        'small_share': round(models.get(SMALL, 0) / total, 3),
+        'large_share': round(models.get(LARGE, 0) / total, 3),
+        'escalated': round(escalated / total, 3),
+    }
+
+def main(small_latency=0.05, large_latency=0.3, unsure=0.2, repeats=3, docs_dir=None):
+    print("🦸 Model routing benchmark")
+    server, state, url = start_fake_ollama(model_latency={SMALL: small_latency, LARGE: large_latency},
+                                           unsure_rate={SMALL: unsure}, capacity=4)
+    queries = LABELED_QUERIES + HARD_QUERIES
+    contexts = load_contexts(queries, docs_dir or BASE_DIR / "raw_data" / "documents")
+    found = sum(contexts[q] != q for q, _ in queries)
+    print(f"   {len(queries)} questions ({found} with source documents) x {repeats}, "
+          f"fake {SMALL} {small_latency}s / {LARGE} {large_latency}s, {SMALL} unsure on {unsure:.0%}")
+
+    rows = [run('large', queries, contexts, url, None, repeats)]
+    router = ModelRouter(small=SMALL, large=LARGE, base_url=url)
+    rows.append(run('routed', queries, contexts, url, router, repeats))
+    busy_router = ModelRouter(small=SMALL, large=LARGE, base_url=url)
+    rows.append(run('routed-busy', queries, contexts, url, busy_router, repeats,
+                    queue_depth=busy_router.busy_depth))
+    server.shutdown()
+
+    print()
+    print_table(rows, ['mode', 'questions', 'mean_ms', 'p50_ms', 'p95_ms', 'small_share', 'large_share',
+                       'escalated'])
+    print()
+    model_rows = [{'model': model, **stats} for model, stats in router.stats().items()]
+    print_table(model_rows, ['model', 'calls', 'share', 'escalations', 'errors', 'p50_ms', 'p95_ms', 'ewma_ms'])
+    print("\n   Per-question routing:")
+    for question, _source in queries:
+        decision = router.route(question, contexts[question])
+        print(f"   {decision['model']:<12} {decision['reason']:<18} c={decision['complexity']:<4} "
+              f"conf={decision['confidence']:<4} {question}")
+    save_results("router", {
+        'small_latency': small_latency, 'large_latency': large_latency, 'unsure': unsure, 'repeats': repeats,
+        'rows': rows, 'models': model_rows,
+    })
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark small/large model routing with a fake Ollama")
+    parser.add_argument("--small-latency", type=float, default=0.05, help="fake small model seconds per answer")
+    parser.add_argument("--large-latency", type=float, default=0.3, help="fake large model seconds per answer")
+    parser.add_argument("--unsure", type=float, default=0.2, help="share of prompts the small model gives up on")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--docs-dir", type=Path, default=None, help="source documents (default raw_data/documents)")
+    args = parser.parse_args()
+    main(small_latency=args.small_latency, large_latency=args.large_latency, unsure=args.unsure,
+         repeats=args.repeats, docs_dir=args.docs_dir)
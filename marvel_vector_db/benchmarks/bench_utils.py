@@ -0,0 +1,109 @@
+"""
+Shared helpers for the Marvel retrieval benchmarks
+"""
+import sys
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).parent
+BASE_DIR = BENCH_DIR.parent
+sys.path.append(str(BASE_DIR / "scripts"))
+
+# Questions mirroring the examples shown in the CLI and Streamlit app
+SAMPLE_QUERIES = [
+    "What are Spider-Man's powers?",
+    "Tell me about the Infinity Gauntlet event",
+    "Who are the founding members of the Avengers?",
+    "Describe the Civil War storyline",
+    "Who created Wolverine and when did he first appear?",
+    "What weapons does Black Widow use?",
+    "Which storylines involve the death of a hero?",
+    "What is Doctor Strange's role as Sorcerer Supreme?",
+    "Who are the founding members of the X-Men?",
+    "How does Thor control lightning?",
+    "What happened in Demon in a Bottle?",
+    "What is the Dark Phoenix Saga?",
+]
+
+# (question, substring expected in the source filename of a relevant chunk)
+LABELED_QUERIES = [
+    ("What are Spider-Man's powers?", "spider-man"),
+    ("Tell me about the Infinity Gauntlet event", "infinity_gauntlet"),
+    ("Who are the founding members of the Avengers?", "avengers"),
+    ("Describe the Civil War storyline", "civil_war"),
+    ("Who created Wolverine and when did he first appear?", "wolverine"),
+    ("What weapons does Black Widow use?", "black_widow"),
+    ("What is Doctor Strange's role as Sorcerer Supreme?", "doctor_strange"),
+    ("Who are the founding members of the X-Men?", "x-men"),
+    ("How does Thor control lightning?", "thor"),
+    ("What is the Dark Phoenix Saga?", "phoenix"),
+]
+
+def load_embeddings():
+    """Load the same normalized bge-large embeddings used at ingestion"""
+    import torch
+    from langchain_huggingface import HuggingFaceEmbeddings
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    return HuggingFaceEmbeddings(
+        model_name="BAAI/bge-large-en-v1.5",
+        model_kwargs={"device": device},
+        encode_kwargs={"normalize_embeddings": True}
+    )
+
+def load_vectorstore(embeddings, vectorstore_dir=None):
+    """Open the persisted marvel_knowledge_base collection"""
+    from langchain_chroma import Chroma
+    return Chroma(
+        collection_name="marvel_knowledge_base",
+        embedding_function=embeddings,
+        persist_directory=str(vectorstore_dir or BASE_DIR / "vectorstore")
+    )
+
+def time_calls(fn, items, repeat=3, warmup=1):
+    """Call fn(item) for every item, returning latencies in milliseconds"""
+    for item in items[:warmup]:
+        fn(item)
+    latencies = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter()
+            fn(item)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def summarize(latencies):
+    """p50/p95/p99/mean of a list of millisecond latencies"""
+    if not latencies:
+        return {'n': 0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'mean_ms': 0.0}
+    ordered = sorted(latencies)
+
+    def pct(q):
+        return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))], 3)
+
+    return {
+        'n': len(ordered),
+        'p50_ms': pct(0.5),
+        'p95_ms': pct(0.95),
+        'p99_ms': pct(0.99),
+        'mean_ms': round(sum(ordered) / len(ordered), 3),
+    }
+
+def print_table(rows, columns):
+    """Print a list of dicts as an aligned text table"""
+    widths = {col: max(len(col), *(len(str(row.get(col, ''))) for row in rows)) for col in columns}
+    print("   " + "  ".join(col.ljust(widths[col]) for col in columns))
+    print("   " + "  ".join("-" * widths[col] for col in columns))
+    for row in rows:
+        print("   " + "  ".join(str(row.get(col, '')).ljust(widths[col]) for col in columns))
+
+def save_results(name, results, output_dir=None):
+    """Write benchmark results to benchmarks/results/<name>_<timestamp>.json"""
+    output_dir = Path(output_dir) if output_dir else BENCH_DIR / "results"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    path = output_dir / f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n📄 Results saved to {path}")
+    return path
@@ -1,50 +1,82 @@
 """
 Main pipeline script to build Marvel vector database
 Run this script to execute the complete pipeline
+
+Stages run as a dependency graph: the three fetch steps are independent
+and run concurrently, processing waits for all of them, and any stage
+whose inputs are unchanged since its last successful run is skipped.
+A stage's inputs include the helper modules it imports, and a stage runs
+again when the files it writes have been removed.
 """
 import os
 import sys
+import argparse
 from pathlib import Path
 
-def run_script(script_name, description):
-    """Run a script and handle errors"""
-    print(f"\n{'='*60}")
-    print(f"📋 {description}")
-    print(f"{'='*60}")
-    
-    script_path = Path(__file__).parent / script_name
-    
-    if not script_path.exists():
-        print(f"❌ Script not found: {script_path}")
-        return False
-    
-    try:
-        # Change to script directory
-        os.chdir(script_path.parent)
-        
-        # Import and run script
-        if script_name.endswith('.py'):
-            module_name = script_name[:-3]
-            module = __import__(f'scripts.{module_name}', fromlist=[module_name])
-            
-            if hasattr(module, 'main'):
-                module.main()
-                return True
-            else:
-                print(f"❌ Script {script_name} doesn't have a main() function")
-                return False
-        else:
-            print(f"❌ Invalid script: {script_name}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ Error running {script_name}: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from marvel_profiling import PipelineProfiler, set_active_profiler
+from marvel_pipeline import Stage, PipelineRunner
 
-def main():
+SCRIPT_DIR = Path(__file__).parent
+BASE_DIR = SCRIPT_DIR.parent
+
+def build_stages():
+    """Declare the pipeline stages and their dependencies"""
+    return [
+        Stage(
+            name="fetch_documents",
+            script="1_fetch_marvel_documents.py",
+            description="Fetching Marvel Documents",
+            outputs=["raw_data/documents/metadata.json"],
+        ),
+        Stage(
+            name="fetch_images",
+            script="2_fetch_marvel_images.py",
+            description="Setting up Image Fetching",
+            outputs=["raw_data/images/image_metadata.json"],
+        ),
+        Stage(
+            name="fetch_audio",
+            script="3_fetch_marvel_audio.py",
+            description="Setting up Audio Fetching",
+            outputs=["raw_data/audio/audio_metadata.json"],
+        ),
+        Stage(
+            name="process_content",
+            script="4_process_marvel_content.py",
+            description="Processing Content and Creating Vector Database",
+            deps=["fetch_documents", "fetch_images", "fetch_audio"],
+            inputs=[
+                "raw_data/documents/*.txt",
+                "raw_data/images/*",
+                "raw_data/audio/*",
+                "scripts/marvel_*.py",
+            ],
+            outputs=[
+                "vectorstore/chroma.sqlite3",
+                "processed_data/facts.json",
+                "processed_data/entities.json",
+            ],
+            confirm="Make sure you've downloaded images and audio files. Continue with processing?",
+        ),
+        Stage(
+            name="process_pdfs",
+            script="marvel_pdf_ingest.py",
+            description="Partitioning PDFs into the Vector Database",
+            deps=["process_content"],
+            # Loads 4_process_marvel_content.py and writes through its _add_documents
+            inputs=["raw_data/pdfs/*.pdf", "scripts/4_process_marvel_content.py", "scripts/marvel_*.py"],
+            outputs=["vectorstore/chroma.sqlite3"],
+        ),
+    ]
+
+def main(profile=False, profile_dir=None, assume_yes=False, jobs=3, force=None, only=None):
     """Main pipeline execution"""
+    profiler = None
+    if profile:
+        profiler = PipelineProfiler(profile_dir).start()
+        set_active_profiler(profiler)
+
     print("🦸 Marvel Vector Database Pipeline")
     print("=" * 60)
     print("\nThis pipeline will:")
@@ -53,49 +85,79 @@ def main():
     print("3. Process all content into vector embeddings")
     print("4. Create vector database")
     print("\nLet's begin!\n")
-    
-    # Step 1: Fetch documents
-    print("\n" + "="*60)
-    print("STEP 1: Fetching Marvel Documents")
-    print("="*60)
-    run_script("1_fetch_marvel_documents.py", "Fetching Marvel Documents")
-    
-    # Step 2: Set up image fetching
-    print("\n" + "="*60)
-    print("STEP 2: Setting up Image Fetching")
-    print("="*60)
-    run_script("2_fetch_marvel_images.py", "Setting up Image Fetching")
-    
-    # Step 3: Set up audio fetching
-    print("\n" + "="*60)
-    print("STEP 3: Setting up Audio Fetching")
-    print("="*60)
-    run_script("3_fetch_marvel_audio.py", "Setting up Audio Fetching")
-    
-    # Step 4: Process content
-    print("\n" + "="*60)
-    print("STEP 4: Processing Content and Creating Vector Database")
-    print("="*60)
-    print("\n⚠️  Note: Make sure you've downloaded images and audio files")
-    print("   before running the processing step.")
-    
-    response = input("\n   Continue with processing? (y/n): ")
-    if response.lower() == 'y':
-        run_script("4_process_marvel_content.py", "Processing Content")
-    
+
+    stages = build_stages()
+    if only:
+        # Keep the requested stages plus everything they depend on
+        by_name = {stage.name: stage for stage in stages}
+        unknown = [name for name in only if name not in by_name]
+        if unknown:
+            print(f"❌ Unknown stage(s): {', '.join(unknown)}")
+            return False
+        wanted = set()
+        todo = list(only)
+        while todo:
+            name = todo.pop()
+            if name not in wanted:
+                wanted.add(name)
+                todo.extend(by_name[name].deps)
+        stages = [stage for stage in stages if stage.name in wanted]
+
+    runner = PipelineRunner(
+        stages,
+        base_dir=BASE_DIR,
+        script_dir=SCRIPT_DIR,
+        jobs=jobs,
+        force=force,
+        assume_yes=assume_yes,
+    )
+
+    try:
+        ok = runner.run()
+    finally:
+        if profiler:
+            profiler.finish()
+            set_active_profiler(None)
+
+    runner.print_summary()
+
     print("\n" + "="*60)
-    print("✅ Pipeline Complete!")
+    print("✅ Pipeline Complete!" if ok else "❌ Pipeline finished with errors")
     print("="*60)
     print("\nNext steps:")
     print("1. Download images and audio files (see instructions in raw_data folders)")
-    print("2. Run processing again: python 4_process_marvel_content.py")
+    print("2. Run processing again: python 0_main_pipeline.py --yes")
     print("3. Query the database: python 5_marvel_rag_query.py")
     print("\n" + "="*60)
+    return ok
 
 if __name__ == "__main__":
-    # Change to scripts directory
-    script_dir = Path(__file__).parent
-    os.chdir(script_dir.parent)
-    
-    main()
+    parser = argparse.ArgumentParser(description="Build the Marvel vector database")
+    parser.add_argument("-y", "--yes", action="store_true",
+                        help="run non-interactively, answering yes to every confirmation")
+    parser.add_argument("-j", "--jobs", type=int, default=3,
+                        help="maximum number of stages to run concurrently (default: 3)")
+    parser.add_argument("--force", nargs="*", metavar="STAGE",
+                        help="re-run the given stages (or all stages) even if inputs are unchanged")
+    parser.add_argument("--only", nargs="+", metavar="STAGE",
+                        help="run only these stages and their dependencies")
+    parser.add_argument("--profile", action="store_true",
+                        help="capture per-stage cProfile, tracemalloc and flamegraph output")
+    parser.add_argument("--profile-dir", default=None,
+                        help="directory for profile output (default: marvel_vector_db/profiles)")
+    args = parser.parse_args()
+
+    # --force with no stage names forces everything
+    force = None
+    if args.force is not None:
+        force = set(args.force) if args.force else 'all'
 
+    ok = main(
+        profile=args.profile,
+        profile_dir=args.profile_dir,
+        assume_yes=args.yes,
+        jobs=args.jobs,
+        force=force,
+        only=args.only,
+    )
+    sys.exit(0 if ok else 1)
@@ -6,11 +6,16 @@ import sys
 import json
 import pickle
 import base64
+import time
+import uuid
+import argparse
+import subprocess
 from pathlib import Path
 from datetime import datetime
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from langchain.schema.document import Document
 from langchain.storage import InMemoryStore
@@ -23,11 +28,35 @@ from unstructured.partition.pdf import partition_pdf
 from PIL import Image
 import io
 
+from marvel_metrics import metrics
+from marvel_profiling import PipelineProfiler, get_active_profiler, set_active_profiler, profile_stage
+from marvel_work_queue import WorkQueue, LeaseKeeper, default_worker_id
+from marvel_shards import ShardedVectorStore
+from marvel_facts import build_facts
+from marvel_entities import build_entity_index
+from marvel_compression import cache_chunk_sentences
+from marvel_model_host import RemoteEmbeddings, connect_model_host, start_model_host, stop_model_host
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
+
+def find_image_files(images_dir):
+    """Find image files in a directory by extension"""
+    image_files = []
+    for ext in IMAGE_EXTENSIONS:
+        image_files.extend(list(images_dir.glob(f"*{ext}")))
+        image_files.extend(list(images_dir.glob(f"*{ext.upper()}")))
+    return image_files
+
 class MarvelContentProcessor:
     def __init__(self, 
                  raw_data_dir=None,
                  processed_data_dir=None,
-                 vectorstore_dir=None):
+                 vectorstore_dir=None,
+                 load_models=True,
+                 open_vectorstore=True,
+                 shard_by=None,
+                 num_shards=4,
+                 only_shard=None):
         script_dir = Path(__file__).parent.parent
         self.raw_data_dir = Path(raw_data_dir) if raw_data_dir else script_dir / "raw_data"
         self.processed_data_dir = Path(processed_data_dir) if processed_data_dir else script_dir / "processed_data"
@@ -37,31 +66,52 @@ class MarvelContentProcessor:
         self.processed_data_dir.mkdir(parents=True, exist_ok=True)
         self.vectorstore_dir.mkdir(parents=True, exist_ok=True)
         
-        # Initialize models
-        print("🔧 Initializing models...")
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"   Using device: {device}")
+        # Queue writers only upsert precomputed vectors and skip the models
+        self.embeddings = None
+        self.llm = None
+        if load_models:
+            # Initialize models
+            print("🔧 Initializing models...")
+            self.embeddings = self._load_embeddings()
+            
+            # Initialize LLM for summarization
+            try:
+                self.llm = OllamaLLM(model="mistral:7b", temperature=0.1)
+                print("   ✅ LLM initialized")
+            except Exception as e:
+                print(f"   ⚠️  LLM not available: {e}")
+                self.llm = None
         
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="BAAI/bge-large-en-v1.5",
-            model_kwargs={"device": device},
-            encode_kwargs={"normalize_embeddings": True}
-        )
+        # Initialize vectorstore (queue workers never touch it)
+        self.vectorstore = None
+        self.sharded_store = None
+        self.only_shard = only_shard
+        if open_vectorstore and not shard_by:
+            # Keep writing to an existing sharded layout
+            self.sharded_store = ShardedVectorStore.load(self.vectorstore_dir, self.embeddings)
+            if self.sharded_store:
+                print(f"   Using existing {self.sharded_store.router.mode} shards")
+        elif open_vectorstore:
+            self.sharded_store = ShardedVectorStore(
+                self.vectorstore_dir,
+                self.embeddings,
+                mode=shard_by,
+                num_shards=num_shards
+            )
+            self.sharded_store.write_manifest()
         
-        # Initialize LLM for summarization
-        try:
-            self.llm = OllamaLLM(model="mistral:7b", temperature=0.1)
-            print("   ✅ LLM initialized")
-        except Exception as e:
-            print(f"   ⚠️  LLM not available: {e}")
-            self.llm = None
-        
-        # Initialize vectorstore
-        self.vectorstore = Chroma(
-            collection_name="marvel_knowledge_base",
-            embedding_function=self.embeddings,
-            persist_directory=str(self.vectorstore_dir)
-        )
+        if self.sharded_store and only_shard:
+            if only_shard not in self.sharded_store.stores:
+                raise ValueError(f"Unknown shard '{only_shard}', expected one of {self.sharded_store.router.shards}")
+            print(f"   ♻️  Rebuilding shard '{only_shard}'")
+            self.sharded_store.rebuild_shard(only_shard)
+        
+        if open_vectorstore and not self.sharded_store:
+            self.vectorstore = Chroma(
+                collection_name="marvel_knowledge_base",
+                embedding_function=self.embeddings,
+                persist_directory=str(self.vectorstore_dir)
+            )
         
         self.doc_store = InMemoryStore()
         self.processed_count = {
@@ -70,6 +120,35 @@ class MarvelContentProcessor:
             'audio': 0
         }
     
+    def _load_embeddings(self):
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        print(f"   Using device: {device}")
+        # Workers on one machine share the model host's copy instead of loading one each
+        return connect_model_host(normalize=True) or HuggingFaceEmbeddings(
+            model_name="BAAI/bge-large-en-v1.5",
+            model_kwargs={"device": device},
+            encode_kwargs={"normalize_embeddings": True}
+        )
+    
+    def build_query_artifacts(self, chunk_texts):
+        """Sentence cache, fact table and entity index read at query time; run after either ingestion path"""
+        if chunk_texts:
+            if self.embeddings is None:
+                # Queue writers skip the models while upserting; the sentence cache needs the embedder
+                self.embeddings = self._load_embeddings()
+            # Sentence embeddings for query-time context compression; cached sentences are skipped
+            with metrics.span('sentence_cache', items=len(chunk_texts)):
+                cache, added = cache_chunk_sentences(chunk_texts, self.embeddings,
+                                                     self.processed_data_dir / "sentence_cache")
+            print(f"   ✅ {added} new sentence embeddings cached ({len(cache)} total)")
+        
+        # Structured facts for the LLM-free fast path in the query interfaces
+        fact_store, facts_path = build_facts(self.raw_data_dir / "documents", self.processed_data_dir / "facts.json")
+        print(f"   ✅ {len(fact_store)} entities saved to {facts_path.name}")
+        # Entity -> source files, used to narrow retrieval for questions naming an entity
+        entity_index, entities_path = build_entity_index(self.raw_data_dir, self.processed_data_dir / "entities.json")
+        print(f"   ✅ {len(entity_index)} entities, {entity_index.num_patterns} aliases saved to {entities_path.name}")
+    
     def process_documents(self):
         """Process Marvel documents"""
         print("\n📄 Processing documents...")
@@ -85,29 +164,16 @@ class MarvelContentProcessor:
         all_documents = []
         
         for text_file in text_files:
+            if not self._in_scope(text_file.name):
+                continue
             try:
                 print(f"   Processing {text_file.name}...")
                 
-                with open(text_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                
-                # Split into chunks
-                chunks = self._split_text_into_chunks(content, chunk_size=1000)
-                
-                for i, chunk in enumerate(chunks):
-                    doc = Document(
-                        page_content=chunk,
-                        metadata={
-                            'source': str(text_file.name),
-                            'chunk_id': i,
-                            'type': 'document',
-                            'category': self._extract_category(text_file.name)
-                        }
-                    )
-                    all_documents.append(doc)
+                chunk_docs = self._document_chunks(text_file)
+                all_documents.extend(chunk_docs)
                 
                 self.processed_count['documents'] += 1
-                print(f"      ✅ Processed into {len(chunks)} chunks")
+                print(f"      ✅ Processed into {len(chunk_docs)} chunks")
                 
             except Exception as e:
                 print(f"      ❌ Error processing {text_file.name}: {e}")
@@ -115,8 +181,10 @@ class MarvelContentProcessor:
         # Add to vectorstore
         if all_documents:
             print(f"   📤 Adding {len(all_documents)} document chunks to vectorstore...")
-            self.vectorstore.add_documents(all_documents)
+            self._add_documents(all_documents)
             print(f"   ✅ Documents added to vectorstore")
+        
+        self.build_query_artifacts([doc.page_content for doc in all_documents])
     
     def process_images(self):
         """Process Marvel images"""
@@ -128,11 +196,7 @@ class MarvelContentProcessor:
             return
         
         # Get image files
-        image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
-        image_files = []
-        for ext in image_extensions:
-            image_files.extend(list(images_dir.glob(f"*{ext}")))
-            image_files.extend(list(images_dir.glob(f"*{ext.upper()}")))
+        image_files = find_image_files(images_dir)
         
         print(f"   Found {len(image_files)} image files")
         
@@ -143,29 +207,12 @@ class MarvelContentProcessor:
         all_image_docs = []
         
         for image_file in image_files:
+            if not self._in_scope(image_file.name):
+                continue
             try:
                 print(f"   Processing {image_file.name}...")
                 
-                # Load image
-                with open(image_file, 'rb') as f:
-                    image_data = f.read()
-                
-                # Convert to base64
-                image_b64 = base64.b64encode(image_data).decode('utf-8')
-                
-                # Create description (if LLM available, could generate description)
-                description = self._generate_image_description(image_file.name)
-                
-                doc = Document(
-                    page_content=description,
-                    metadata={
-                        'source': str(image_file.name),
-                        'type': 'image',
-                        'image_b64': image_b64,
-                        'category': self._extract_category(image_file.name)
-                    }
-                )
-                all_image_docs.append(doc)
+                all_image_docs.append(self._image_document(image_file))
                 
                 self.processed_count['images'] += 1
                 print(f"      ✅ Processed")
@@ -176,7 +223,7 @@ class MarvelContentProcessor:
         # Add to vectorstore
         if all_image_docs:
             print(f"   📤 Adding {len(all_image_docs)} images to vectorstore...")
-            self.vectorstore.add_documents(all_image_docs)
+            self._add_documents(all_image_docs)
             print(f"   ✅ Images added to vectorstore")
     
     def process_audio(self):
@@ -206,6 +253,89 @@ class MarvelContentProcessor:
         print("   ⚠️  Audio transcription not implemented in this script.")
         print("   💡 Use the multimodal_rag_final_marvel.ipynb notebook for audio processing.")
     
+    def _document_chunks(self, text_file):
+        """Read a text file and split it into chunk Documents"""
+        text_file = Path(text_file)
+        with metrics.span('file_read', file=text_file.name):
+            with open(text_file, 'r', encoding='utf-8') as f:
+                content = f.read()
+        
+        # Split into chunks
+        with metrics.span('chunk', file=text_file.name):
+            chunks = self._split_text_into_chunks(content, chunk_size=1000)
+        metrics.incr('document_chunks', len(chunks))
+        
+        return [
+            Document(
+                page_content=chunk,
+                metadata={
+                    'source': str(text_file.name),
+                    'chunk_id': i,
+                    'type': 'document',
+                    'category': self._extract_category(text_file.name)
+                }
+            )
+            for i, chunk in enumerate(chunks)
+        ]
+    
+    def _image_document(self, image_file):
+        """Load an image into a Document with its description and base64 payload"""
+        image_file = Path(image_file)
+        # Load image
+        with metrics.span('file_read', file=image_file.name):
+            with open(image_file, 'rb') as f:
+                image_data = f.read()
+        
+        # Convert to base64
+        image_b64 = base64.b64encode(image_data).decode('utf-8')
+        
+        # Create description (if LLM available, could generate description)
+        description = self._generate_image_description(image_file.name)
+        
+        return Document(
+            page_content=description,
+            metadata={
+                'source': str(image_file.name),
+                'type': 'image',
+                'image_b64': image_b64,
+                'category': self._extract_category(image_file.name)
+            }
+        )
+    
+    def _embed_documents(self, documents):
+        """Embed the page content of a list of Documents"""
+        texts = [doc.page_content for doc in documents]
+        with metrics.span('embed', items=len(texts)):
+            return self.embeddings.embed_documents(texts)
+    
+    def _upsert(self, ids, vectors, metadatas, texts):
+        """Write precomputed vectors to the collection"""
+        with metrics.span('upsert', items=len(texts)):
+            if self.sharded_store:
+                self.sharded_store.upsert(ids, vectors, metadatas, texts)
+            else:
+                self.vectorstore._collection.upsert(
+                    ids=ids,
+                    embeddings=vectors,
+                    metadatas=metadatas,
+                    documents=texts
+                )
+        metrics.incr('vectors_upserted', len(texts))
+    
+    def _add_documents(self, documents, ids=None):
+        """Embed documents and upsert them, timing each stage separately"""
+        if ids is None:
+            # Same ids as the queue path, so re-running the stage overwrites instead of duplicating
+            ids = [_stable_chunk_id(doc.metadata) for doc in documents]
+        vectors = self._embed_documents(documents)
+        self._upsert(
+            ids,
+            vectors,
+            [doc.metadata for doc in documents],
+            [doc.page_content for doc in documents]
+        )
+        return ids
+    
     def _split_text_into_chunks(self, text, chunk_size=1000, overlap=200):
         """Split text into overlapping chunks"""
         chunks = []
@@ -219,6 +349,13 @@ class MarvelContentProcessor:
         
         return chunks
     
+    def _in_scope(self, filename):
+        """When rebuilding a single shard, only files routed to it are processed"""
+        if not self.only_shard:
+            return True
+        metadata = {'source': filename, 'category': self._extract_category(filename)}
+        return self.sharded_store.router.shard_for(metadata) == self.only_shard
+    
     def _extract_category(self, filename):
         """Extract category from filename"""
         filename_lower = filename.lower()
@@ -242,6 +379,8 @@ class MarvelContentProcessor:
     
     def create_retriever(self):
         """Create retriever from vectorstore"""
+        if self.vectorstore is None:
+            return None
         retriever = MultiVectorRetriever(
             vectorstore=self.vectorstore,
             docstore=self.doc_store,
@@ -257,6 +396,11 @@ class MarvelContentProcessor:
             'vectorstore_path': str(self.vectorstore_dir),
             'total_documents': self.vectorstore._collection.count() if hasattr(self.vectorstore, '_collection') else 0
         }
+        if self.sharded_store:
+            metadata['shards'] = self.sharded_store.shard_counts()
+            metadata['total_documents'] = sum(metadata['shards'].values())
+        if metrics.enabled:
+            metadata['metrics'] = metrics.snapshot()
         
         metadata_path = self.processed_data_dir / 'processing_metadata.json'
         with open(metadata_path, 'w', encoding='utf-8') as f:
@@ -265,23 +409,186 @@ class MarvelContentProcessor:
         print(f"\n📄 Metadata saved to {metadata_path}")
         return metadata
 
-def main():
-    """Main processing function"""
-    print("🦸 Marvel Content Processing Pipeline")
-    print("=" * 50)
+def _stable_chunk_id(metadata):
+    """Deterministic id so a retried or re-processed file overwrites rather than duplicates its chunks"""
+    key = f"{metadata.get('type')}:{metadata.get('source')}:{metadata.get('chunk_id', 0)}"
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, key))
+
+def enqueue_raw_data(queue, raw_data_dir=None):
+    """Queue every document and image under raw_data"""
+    raw_data_dir = Path(raw_data_dir) if raw_data_dir else Path(__file__).parent.parent / "raw_data"
+    text_files = sorted((raw_data_dir / "documents").glob("*.txt"))
+    images_dir = raw_data_dir / "images"
+    image_files = find_image_files(images_dir) if images_dir.exists() else []
+    added = queue.enqueue(text_files, 'document') + queue.enqueue(sorted(set(image_files)), 'image')
+    print(f"📥 Queued {added} new or changed files ({len(text_files)} documents, {len(image_files)} images found)")
+    return added
+
+def run_queue_worker(queue, worker_id=None, poll_interval=2.0):
+    """Claim files from the queue, chunk and embed them until no work remains"""
+    worker_id = worker_id or default_worker_id()
+    print(f"👷 Worker {worker_id} starting")
+    processor = MarvelContentProcessor(open_vectorstore=False)
+    handled = 0
+    
+    while True:
+        task = queue.claim(worker_id)
+        if task is None:
+            stats = queue.stats()
+            # Leased tasks may still come back if their worker crashes
+            if not stats.get('pending') and not stats.get('leased'):
+                break
+            time.sleep(poll_interval)
+            continue
+        
+        path = Path(task['path'])
+        print(f"   [{worker_id}] {path.name} (attempt {task['attempt']})")
+        try:
+            with LeaseKeeper(queue, task['id'], worker_id) as lease:
+                if task['kind'] == 'image':
+                    documents = [processor._image_document(path)]
+                else:
+                    documents = processor._document_chunks(path)
+                vectors = processor._embed_documents(documents) if documents else []
+            if lease.lost:
+                print(f"   ⚠️  Lease on {path.name} expired, dropping result")
+                continue
+            payload = [
+                {
+                    'id': _stable_chunk_id(doc.metadata),
+                    'text': doc.page_content,
+                    'metadata': doc.metadata
+                }
+                for doc in documents
+            ]
+            if queue.complete(task['id'], worker_id, payload, vectors):
+                handled += 1
+        except Exception as e:
+            print(f"   ❌ [{worker_id}] {path.name}: {e}")
+            queue.fail(task['id'], worker_id, e)
+    
+    print(f"👷 Worker {worker_id} finished, {handled} files processed")
+    return handled
+
+def run_queue_writer(queue, workers=(), follow=False, poll_interval=1.0, batch_size=64):
+    """Upsert finished results into Chroma until the queue is drained"""
+    processor = MarvelContentProcessor(load_models=False)
+    print("✍️  Writer started")
+    
+    chunk_texts = []
+    while True:
+        written = []
+        for result_id, documents, vectors in queue.pending_results(batch_size):
+            if documents:
+                processor._upsert(
+                    [doc['id'] for doc in documents],
+                    vectors,
+                    [doc['metadata'] for doc in documents],
+                    [doc['text'] for doc in documents]
+                )
+                kind = 'images' if documents[0]['metadata'].get('type') == 'image' else 'documents'
+                processor.processed_count[kind] += 1
+                if kind == 'documents':
+                    chunk_texts.extend(doc['text'] for doc in documents)
+            written.append(result_id)
+        if written:
+            queue.mark_written(written)
+            continue
+        
+        if not follow and queue.is_drained():
+            break
+        if workers and all(worker.poll() is not None for worker in workers) and not queue.stats()['unwritten_results']:
+            print("   ⚠️  All workers exited before the queue drained")
+            break
+        time.sleep(poll_interval)
+    
+    for path, attempts, error in queue.failures():
+        print(f"   ❌ Failed after {attempts} attempts: {path}: {error}")
+    
+    # Same query-time artifacts as the single-process path
+    print("\n🧩 Building the sentence cache, fact table and entity index...")
+    processor.build_query_artifacts(chunk_texts)
+    return processor
+
+def main_queue(queue_path, workers=0, enqueue=False, worker=False, writer=False,
+               worker_id=None, lease_seconds=300, follow=False):
+    """Distributed ingestion through a shared SQLite work queue"""
+    queue = WorkQueue(queue_path, lease_seconds=lease_seconds)
     
-    processor = MarvelContentProcessor()
+    if enqueue or workers:
+        enqueue_raw_data(queue)
     
-    # Process all content types
-    processor.process_documents()
-    processor.process_images()
-    processor.process_audio()
+    if worker:
+        run_queue_worker(queue, worker_id)
+        return
     
-    # Create retriever
-    retriever = processor.create_retriever()
+    if not (writer or workers):
+        print(f"📊 Queue status: {queue.stats()}")
+        return
+    
+    # Spawn local workers; more can join from other shells with --worker.
+    # With several workers, start the model host first so they share one copy of bge-large
+    started_host = False
+    if workers > 1 and RemoteEmbeddings().status() is None:
+        print("🧠 Starting the shared model host for the workers...")
+        start_model_host()
+        started_host = True
+    procs = []
+    for i in range(workers):
+        cmd = [sys.executable, os.path.abspath(__file__), "--queue", str(queue_path),
+               "--worker", "--lease-seconds", str(lease_seconds)]
+        procs.append(subprocess.Popen(cmd))
+    print(f"🚀 Started {len(procs)} local workers")
+    
+    try:
+        processor = run_queue_writer(queue, procs, follow=follow)
+    finally:
+        for proc in procs:
+            proc.wait()
+        # A host this run started would otherwise keep the model resident after ingestion
+        if started_host:
+            stop_model_host()
     
-    # Save metadata
     metadata = processor.save_metadata()
+    print(f"\n📊 Queue status: {queue.stats()}")
+    print(f"📈 Total documents in vectorstore: {metadata.get('total_documents', 0)}")
+
+def main(profile=False, profile_dir=None, shard_by=None, num_shards=4, rebuild_shard=None):
+    """Main processing function"""
+    print("🦸 Marvel Content Processing Pipeline")
+    print("=" * 50)
+    
+    # Start a profiler unless the pipeline runner already did
+    own_profiler = None
+    if profile and get_active_profiler() is None:
+        own_profiler = PipelineProfiler(profile_dir).start()
+        set_active_profiler(own_profiler)
+    
+    try:
+        with profile_stage('init_models'):
+            processor = MarvelContentProcessor(
+                shard_by=shard_by,
+                num_shards=num_shards,
+                only_shard=rebuild_shard
+            )
+        
+        # Process all content types
+        with profile_stage('process_documents'):
+            processor.process_documents()
+        with profile_stage('process_images'):
+            processor.process_images()
+        with profile_stage('process_audio'):
+            processor.process_audio()
+        
+        # Create retriever
+        retriever = processor.create_retriever()
+        
+        # Save metadata
+        metadata = processor.save_metadata()
+    finally:
+        if own_profiler:
+            own_profiler.finish()
+            set_active_profiler(None)
     
     print("\n" + "=" * 50)
     print("✅ Processing complete!")
@@ -293,5 +600,51 @@ def main():
     print(f"📈 Total documents in vectorstore: {metadata.get('total_documents', 0)}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Process Marvel content into the vector database")
+    parser.add_argument("--profile", action="store_true",
+                        help="capture per-stage cProfile, tracemalloc and flamegraph output")
+    parser.add_argument("--profile-dir", default=None,
+                        help="directory for profile output (default: marvel_vector_db/profiles)")
+    parser.add_argument("--shard-by", choices=["category", "hash"], default=None,
+                        help="split the index into one collection per category or per source hash")
+    parser.add_argument("--num-shards", type=int, default=4,
+                        help="number of shards for --shard-by hash")
+    parser.add_argument("--rebuild-shard", default=None, metavar="SHARD",
+                        help="drop and re-ingest a single shard (e.g. event, h2)")
+    parser.add_argument("--queue", default=None, metavar="DB",
+                        help="SQLite work queue for parallel ingestion (local disk, one host)")
+    parser.add_argument("--enqueue", action="store_true",
+                        help="add raw_data files to the queue")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="spawn N local workers and run the single Chroma writer")
+    parser.add_argument("--worker", action="store_true",
+                        help="run one worker that claims, chunks and embeds queued files")
+    parser.add_argument("--writer", action="store_true",
+                        help="run only the writer that upserts finished results into Chroma")
+    parser.add_argument("--worker-id", default=None,
+                        help="worker name in leases (default: host:pid)")
+    parser.add_argument("--lease-seconds", type=int, default=300,
+                        help="lease duration before a silent worker's file is retried")
+    parser.add_argument("--follow", action="store_true",
+                        help="keep the writer running and waiting for new results")
+    args = parser.parse_args()
+    if args.queue:
+        main_queue(
+            args.queue,
+            workers=args.workers,
+            enqueue=args.enqueue,
+            worker=args.worker,
+            writer=args.writer,
+            worker_id=args.worker_id,
+            lease_seconds=args.lease_seconds,
+            follow=args.follow,
+        )
+    else:
+        main(
+            profile=args.profile,
+            profile_dir=args.profile_dir,
+            shard_by=args.shard_by,
+            num_shards=args.num_shards,
+            rebuild_shard=args.rebuild_shard,
+        )
 
@@ -4,21 +4,37 @@ Query the Marvel vector database using RAG
 """
 import os
 import sys
+import time
+import argparse
 from pathlib import Path
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from langchain.storage import InMemoryStore
-from langchain.retrievers.multi_vector import MultiVectorRetriever
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaLLM
-import torch
 import requests
 
+# Heavy modules (torch, langchain, chromadb) are imported where they are
+# used, so --fast-start can answer before they finish loading. numpy is
+# imported up front: the memory-mapped index needs it for the first query
+from marvel_warm_start import startup, WarmEmbeddings, resolve_model_path, run_in_background
+from marvel_model_host import connect_model_host
+from marvel_metrics import metrics, InstrumentedEmbeddings
+from marvel_retrieval import MarvelRetriever, MetadataIndex, build_where, normalize_filters
+from marvel_numpy_index import NumpyVectorIndex
+from marvel_quantized_index import QuantizedVectorIndex
+from marvel_rerank import CrossEncoderReranker
+from marvel_conversation import ConversationMemory, ollama_llm
+from marvel_facts import FactStore
+from marvel_entities import EntityIndex
+from marvel_compression import load_compressor
+from marvel_router import ModelRouter, SMALL_MODEL, LARGE_MODEL
+
 class MarvelRAGQuery:
-    def __init__(self, vectorstore_dir=None):
+    def __init__(self, vectorstore_dir=None, engine="chroma", index_dtype="float32",
+                 rerank=False, rerank_budget_ms=500, fast_start=False, use_facts=True,
+                 use_entities=True, compress_ratio=0.5, small_model=SMALL_MODEL, embeddings=None,
+                 ollama_url="http://localhost:11434"):
         if vectorstore_dir is None:
             script_dir = Path(__file__).parent.parent
             vectorstore_dir = script_dir / "vectorstore"
@@ -26,29 +42,115 @@ class MarvelRAGQuery:
         
         print("🔧 Initializing Marvel RAG Query System...")
         
-        # Initialize embeddings
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="BAAI/bge-large-en-v1.5",
-            model_kwargs={"device": device},
-            encode_kwargs={"normalize_embeddings": True}
-        )
+        self.engine = engine
+        self.index_dtype = index_dtype
+        self.numpy_index = None
+        self._numpy_checked_at = 0.0
+        self.vectorstore = None
+        self.sharded_store = None
+        self.llm = None
+        self.ollama_url = ollama_url
+        self._llms = {}
+        self._warm_thread = None
+        
+        # Simple questions go to the small model, hard ones and weak answers to mistral:7b
+        self.router = ModelRouter(small=small_model, large=LARGE_MODEL, base_url=ollama_url) if small_model else None
+        
+        # Optional cross-encoder rerank over an over-fetched candidate set
+        self.reranker = CrossEncoderReranker(budget_ms=rerank_budget_ms) if rerank else None
+        
+        # Extractive context compression, created once embeddings are loaded
+        self.compress_ratio = compress_ratio
+        self.compressor = None
+        
+        # Fact table written at ingestion; factual lookups skip search and the LLM
+        self.facts = FactStore.load(self.vectorstore_dir.parent / "processed_data" / "facts.json") if use_facts else None
+        if self.facts:
+            print(f"   ✅ Fact table loaded ({len(self.facts)} entities)")
+        
+        # Entity -> source index; questions naming an entity only search its sources
+        entities_path = self.vectorstore_dir.parent / "processed_data" / "entities.json"
+        self.entities = EntityIndex.load(entities_path) if use_entities else None
+        if self.entities:
+            print(f"   ✅ Entity index loaded ({len(self.entities)} entities)")
+        
+        # Bounded history for follow-up questions, summarized in the background;
+        # follow-ups that entity substitution cannot resolve are rewritten by the small model
+        known = self.entities or self.facts
+        self.memory = ConversationMemory(llm=ollama_llm(base_url=ollama_url),
+                                         rewrite_llm=ollama_llm(model=small_model or LARGE_MODEL, base_url=ollama_url),
+                                         aliases=known.aliases if known else None)
+        
+        if embeddings is None and fast_start and self._fast_start():
+            return
+        
+        # Initialize embeddings (a caller-supplied model, e.g. the load test's fake, skips bge-large)
+        with startup.phase('embeddings'):
+            if embeddings is None:
+                # A running model host already holds bge-large; share it instead of loading a copy
+                embeddings = connect_model_host(normalize=True)
+            if embeddings is None:
+                import torch
+                from langchain_huggingface import HuggingFaceEmbeddings
+                device = "cuda" if torch.cuda.is_available() else "cpu"
+                embeddings = HuggingFaceEmbeddings(
+                    model_name=resolve_model_path(),
+                    model_kwargs={"device": device},
+                    encode_kwargs={"normalize_embeddings": True}
+                )
+            self.embeddings = InstrumentedEmbeddings(embeddings)
+        self._open_backends()
+    
+    def _fast_start(self):
+        """Serve from the memory-mapped index while the model and Chroma warm up in the background"""
+        index_dir = self.vectorstore_dir / "numpy_index"
+        if self.engine in ("chroma", "numpy") and self.index_dtype == "float32":
+            with startup.phase('index_snapshot'):
+                self.numpy_index = NumpyVectorIndex.load(index_dir)
+        if self.numpy_index is None or (self.vectorstore_dir / "shards.json").exists():
+            print("   ⚠️  No usable index snapshot, falling back to a standard start")
+            self.numpy_index = None
+            return False
+        
+        with startup.phase('embeddings'):
+            self.embeddings = InstrumentedEmbeddings(connect_model_host() or WarmEmbeddings(resolve_model_path()))
+        self.numpy_index.embeddings = self.embeddings
+        self.engine = "numpy"
+        print(f"   ✅ Index snapshot mapped ({len(self.numpy_index.records)} vectors), warming up in the background")
+        
+        # The first query only needs the model; Chroma and the LLM are
+        # opened behind it and the snapshot is re-checked against Chroma
+        self._numpy_checked_at = time.time()
+        self._warm_thread = run_in_background(self._open_backends, "warm-backends")
+        if self.reranker:
+            run_in_background(lambda: self.reranker.model, "warm-reranker")
+        return True
+    
+    def _open_backends(self):
+        """Open Chroma, the LLM, shards and the optional NumPy engines"""
+        from langchain.storage import InMemoryStore
+        from langchain.retrievers.multi_vector import MultiVectorRetriever
+        from langchain_chroma import Chroma
+        from langchain_ollama import OllamaLLM
+        from marvel_shards import ShardedVectorStore
         
         # Load vectorstore
-        try:
-            self.vectorstore = Chroma(
-                collection_name="marvel_knowledge_base",
-                embedding_function=self.embeddings,
-                persist_directory=str(self.vectorstore_dir)
-            )
-            print("   ✅ Vectorstore loaded")
-        except Exception as e:
-            print(f"   ❌ Error loading vectorstore: {e}")
-            raise
+        with startup.phase('vectorstore'):
+            try:
+                vectorstore = Chroma(
+                    collection_name="marvel_knowledge_base",
+                    embedding_function=self.embeddings,
+                    persist_directory=str(self.vectorstore_dir)
+                )
+                print("   ✅ Vectorstore loaded")
+            except Exception as e:
+                print(f"   ❌ Error loading vectorstore: {e}")
+                raise
         
         # Initialize LLM
         try:
-            self.llm = OllamaLLM(model="mistral:7b", temperature=0.1)
+            self.llm = OllamaLLM(model=LARGE_MODEL, temperature=0.1, base_url=self.ollama_url)
+            self._llms[LARGE_MODEL] = self.llm
             print("   ✅ LLM initialized")
         except Exception as e:
             print(f"   ⚠️  LLM not available: {e}")
@@ -57,48 +159,137 @@ class MarvelRAGQuery:
         # Create retriever
         self.doc_store = InMemoryStore()
         self.retriever = MultiVectorRetriever(
-            vectorstore=self.vectorstore,
+            vectorstore=vectorstore,
             docstore=self.doc_store,
             id_key="doc_id"
         )
+        
+        # Sharded layout written by 4_process_marvel_content.py --shard-by
+        self.sharded_store = ShardedVectorStore.load(self.vectorstore_dir, self.embeddings)
+        if self.sharded_store:
+            print(f"   ✅ Using {len(self.sharded_store.stores)} {self.sharded_store.router.mode} shards")
+        
+        # Filtered search over the collection; the MultiVectorRetriever above
+        # resolves parents from an empty docstore, so search goes through here
+        self.metadata_index = None
+        if not self.sharded_store:
+            with startup.phase('metadata_index'):
+                self.metadata_index = MetadataIndex(vectorstore._collection, persist_directory=self.vectorstore_dir)
+        self.search_retriever = MarvelRetriever(vectorstore, self.embeddings, self.metadata_index)
+        self.vectorstore = vectorstore
+        
+        # Optional NumPy engines (exact, int8 or pq), kept in sync via the collection version stamp
+        if self.numpy_index is not None:
+            # Fast start: make the next query check the snapshot against Chroma
+            self._numpy_checked_at = 0.0
+            self.numpy_index.collection = vectorstore._collection
+        elif self.engine != "chroma" and not self.sharded_store:
+            with startup.phase('numpy_index'):
+                self.numpy_index = self._open_numpy_index()
+            self._numpy_checked_at = time.time()
+            print(f"   ✅ {self.engine} index loaded ({len(self.numpy_index.records)} vectors)")
+    
+    def _open_numpy_index(self):
+        if self.engine in ("int8", "pq"):
+            return QuantizedVectorIndex.open_or_build(self.vectorstore, self.vectorstore_dir, mode=self.engine)
+        return NumpyVectorIndex.open_or_build(self.vectorstore, self.vectorstore_dir, dtype=self.index_dtype)
+    
+    def _fresh_numpy_index(self, check_interval=30.0):
+        """Rebuild the NumPy index if Chroma changed (checked at most every check_interval s)"""
+        now = time.time()
+        if self.vectorstore is not None and now - self._numpy_checked_at >= check_interval:
+            self._numpy_checked_at = now
+            if self.numpy_index.is_stale(self.vectorstore._collection, self.vectorstore_dir):
+                self.numpy_index = self._open_numpy_index()
+        return self.numpy_index
+    
+    def _retrieve(self, question, k, filters=None):
+        """Retrieve documents, narrowed to the sources of the entities the question names"""
+        filters = normalize_filters(filters)
+        narrowed, entities = self.entities.narrow(question, filters) if self.entities else (filters, [])
+        if not entities:
+            return self._search(question, k, filters)
+        
+        metrics.incr('entity_narrowed')
+        print(f"   🎯 Narrowed to {len(narrowed['source'])} sources for {', '.join(entities)}")
+        docs = self._search(question, k, narrowed)
+        if len(docs) < k:
+            # Too few chunks mention the entity: top up from the whole collection
+            seen = {(doc.metadata.get('source'), doc.page_content) for doc in docs}
+            for doc in self._search(question, k, filters):
+                if len(docs) >= k:
+                    break
+                if (doc.metadata.get('source'), doc.page_content) not in seen:
+                    docs.append(doc)
+        return docs
     
-    def query(self, question, k=5):
-        """Query the Marvel knowledge base"""
+    def _search(self, question, k, filters):
+        """Search the sharded store, the numpy index or the single collection"""
+        filters = dict(filters)
+        if self.sharded_store:
+            # Category filters select shards, the rest is pushed down per shard
+            categories = filters.pop('category', None)
+            return self.sharded_store.similarity_search(
+                question, k=k, categories=categories, filter=build_where(filters)
+            )
+        if self.numpy_index:
+            return self._fresh_numpy_index().similarity_search(question, k=k, filters=filters)
+        return self.search_retriever.get_relevant_documents(question, k=k, filters=filters)
+    
+    def query(self, question, k=5, filters=None, memory=None):
+        """Query the Marvel knowledge base; memory overrides the conversation (one per concurrent user)"""
+        memory = memory if memory is not None else self.memory
         print(f"\n🔍 Querying: {question}")
+        
+        # Follow-ups ("what about his enemies?") are searched as standalone questions
+        search_query = memory.standalone_query(question)
+        if search_query != question:
+            print(f"   Searching for: {search_query}")
+        
+        # Fast path: answer simple factual questions straight from the fact table
+        fact = self.facts.answer(search_query) if self.facts and not normalize_filters(filters) else None
+        if fact:
+            metrics.incr('fact_answers')
+            print(f"   ⚡ Answered from the fact table ({fact['entity']})")
+            memory.add(question, fact['answer'])
+            return {
+                'question': question,
+                'search_query': search_query,
+                'answer': fact['answer'],
+                'sources': fact['sources'],
+                'num_sources': len(fact['sources']),
+                'fast_path': True
+            }
+        
         print(f"   Retrieving top {k} relevant documents...")
         
         # Retrieve relevant documents
         try:
-            docs = self.retriever.get_relevant_documents(question, k=k)
+            fetch_k = max(k, self.reranker.fetch_k) if self.reranker else k
+            with metrics.span('search', k=fetch_k):
+                docs = self._retrieve(search_query, fetch_k, filters)
+            if self.reranker:
+                docs = self.reranker.rerank(search_query, docs, top_n=k)
             print(f"   ✅ Found {len(docs)} relevant documents")
         except Exception as e:
             print(f"   ❌ Error retrieving documents: {e}")
             return None
         
-        # Combine context
-        context = "\n\n".join([doc.page_content for doc in docs])
+        # A fast-start process opens the LLM in the background
+        if self._warm_thread is not None:
+            self._warm_thread.join()
         
         # Generate response using LLM
         if self.llm:
-            prompt = f"""You are a Marvel Comics expert assistant. Answer the following question about Marvel characters, storylines, comics, or universe based on the provided context.
-
-Context from Marvel knowledge base:
-{context[:2000]}
-
-Question: {question}
-
-Please provide a comprehensive answer focusing on:
-- Specific character names, powers, and storylines
-- Marvel universe details and events
-- Comic book history and notable storylines
-- Team affiliations and relationships
-
-Answer:"""
+            with metrics.span('prompt_build'):
+                prompt = self._build_prompt(question, docs, search_query, memory)
             
             try:
-                response = self.llm.invoke(prompt)
+                response = self._answer(search_query, docs, prompt)
+                memory.add(question, response)
                 return {
                     'question': question,
+                    'search_query': search_query,
                     'answer': response,
                     'sources': [doc.metadata for doc in docs],
                     'num_sources': len(docs)
@@ -110,37 +301,118 @@ Answer:"""
                     'answer': "I found relevant information but couldn't generate a response. Please check if Ollama is running.",
                     'sources': [doc.metadata for doc in docs],
                     'num_sources': len(docs),
-                    'context': context[:1000]
+                    'context': self._combine_context(docs)[:1000]
                 }
         else:
             # Return context without LLM processing
             return {
                 'question': question,
                 'answer': "LLM not available. Here's the relevant context:",
-                'context': context[:2000],
+                'context': self._combine_context(docs)[:2000],
                 'sources': [doc.metadata for doc in docs],
                 'num_sources': len(docs)
             }
     
-    def interactive_query(self):
+    def _combine_context(self, docs):
+        """Join retrieved chunks into a single context string"""
+        return "\n\n".join([doc.page_content for doc in docs])
+    
+    def _compressed_context(self, query, docs):
+        """Most query-relevant sentences of the chunks, or the whole chunks when compression is off"""
+        if self.compress_ratio >= 1.0:
+            return self._combine_context(docs)
+        if self.compressor is None:
+            self.compressor = load_compressor(self.embeddings, self.compress_ratio,
+                                              self.vectorstore_dir.parent / "processed_data" / "sentence_cache")
+        try:
+            return self.compressor.compress(query, docs)
+        except Exception as e:
+            print(f"   ⚠️  Context compression failed, using whole chunks: {e}")
+            return self._combine_context(docs)
+    
+    def _build_prompt(self, question, docs, search_query=None, memory=None):
+        """Build the Marvel expert prompt from retrieved documents"""
+        memory = memory if memory is not None else self.memory
+        context = self._compressed_context(search_query or question, docs)
+        return f"""You are a Marvel Comics expert assistant. Answer the following question about Marvel characters, storylines, comics, or universe based on the provided context.
+
+{memory.prompt_section()}Context from Marvel knowledge base:
+{context[:2000]}
+
+Question: {question}
+
+Please provide a comprehensive answer focusing on:
+- Specific character names, powers, and storylines
+- Marvel universe details and events
+- Comic book history and notable storylines
+- Team affiliations and relationships
+
+Answer:"""
+    
+    def _llm_for(self, model):
+        """OllamaLLM client for a model, created on first use"""
+        if model not in self._llms:
+            from langchain_ollama import OllamaLLM
+            self._llms[model] = OllamaLLM(model=model, temperature=0.1, base_url=self.ollama_url)
+        return self._llms[model]
+    
+    def _answer(self, search_query, docs, prompt):
+        """Generate with the routed model, escalating weak small-model answers"""
+        if self.router is None:
+            return self._generate(prompt)
+        response, decision = self.router.generate(
+            search_query, self._combine_context(docs), prompt,
+            lambda model, text: self._generate(text, self._llm_for(model))
+        )
+        escalated = f", escalated from {decision['escalated_from']}" if 'escalated_from' in decision else ""
+        print(f"   🔀 {decision['model']} ({decision['reason']}{escalated})")
+        return response
+    
+    def _generate(self, prompt, llm=None):
+        """Stream the LLM response, recording first-token and total latency"""
+        llm = llm or self.llm
+        if not metrics.enabled:
+            return llm.invoke(prompt)
+        
+        start = time.perf_counter()
+        parts = []
+        with metrics.span('llm_total'):
+            for token in llm.stream(prompt):
+                if not parts:
+                    metrics.observe('llm_first_token', time.perf_counter() - start)
+                parts.append(token)
+        metrics.incr('llm_calls')
+        return "".join(parts)
+    
+    def interactive_query(self, filters=None):
         """Interactive query interface"""
         print("\n" + "=" * 60)
         print("🦸 Marvel RAG Query Interface")
         print("=" * 60)
         print("\nAsk questions about Marvel characters, storylines, comics, or universe.")
-        print("Type 'quit' or 'exit' to stop.\n")
+        print("Type 'clear' to start a new conversation, 'quit' or 'exit' to stop.\n")
         
         while True:
             question = input("❓ Your question: ").strip()
             
             if question.lower() in ['quit', 'exit', 'q']:
+                if self.router and self.router.stats():
+                    print("\n🔀 Model usage:")
+                    for model, stats in self.router.stats().items():
+                        print(f"   {model}: {stats['calls']} calls, {stats['escalations']} escalated, "
+                              f"p50 {stats['p50_ms']:.0f} ms, p95 {stats['p95_ms']:.0f} ms")
                 print("\n👋 Goodbye!")
                 break
             
             if not question:
                 continue
             
-            result = self.query(question)
+            if question.lower() == 'clear':
+                self.memory.clear()
+                print("🧹 Conversation cleared\n")
+                continue
+            
+            result = self.query(question, filters=filters)
             
             if result:
                 print("\n" + "-" * 60)
@@ -163,7 +435,18 @@ def check_ollama():
     except:
         return False
 
-def main():
+def startup_report(engine="chroma", index_dtype="float32", fast_start=False):
+    """Boot, answer one retrieval and print where the startup time went"""
+    with startup.phase('init'):
+        rag = MarvelRAGQuery(engine=engine, index_dtype=index_dtype, fast_start=fast_start)
+    with startup.phase('first_retrieval'):
+        docs = rag._retrieve("What are Spider-Man's powers?", 5)
+    startup.mark('first_query_answered')
+    print(f"   ✅ First retrieval returned {len(docs)} documents")
+    startup.print_report()
+
+def main(filters=None, engine="chroma", index_dtype="float32", rerank=False, rerank_budget_ms=500,
+         fast_start=False, use_facts=True, use_entities=True, compress_ratio=0.5, small_model=SMALL_MODEL):
     """Main function"""
     # Check Ollama
     if not check_ollama():
@@ -179,7 +462,10 @@ def main():
     
     # Initialize RAG system
     try:
-        rag = MarvelRAGQuery()
+        rag = MarvelRAGQuery(engine=engine, index_dtype=index_dtype,
+                             rerank=rerank, rerank_budget_ms=rerank_budget_ms, fast_start=fast_start,
+                             use_facts=use_facts, use_entities=use_entities,
+                             compress_ratio=compress_ratio, small_model=small_model)
     except Exception as e:
         print(f"\n❌ Error initializing RAG system: {e}")
         print("   Make sure you've run the processing script first:")
@@ -187,8 +473,54 @@ def main():
         return
     
     # Start interactive query
-    rag.interactive_query()
+    rag.interactive_query(filters=filters)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Query the Marvel knowledge base")
+    parser.add_argument("--type", action="append", default=None, choices=["document", "image"],
+                        help="only retrieve chunks of this type (repeatable)")
+    parser.add_argument("--category", action="append", default=None,
+                        choices=["character", "team", "event", "comic", "general"],
+                        help="only retrieve chunks in this category (repeatable)")
+    parser.add_argument("--source", action="append", default=None,
+                        help="only retrieve chunks from this source file (repeatable)")
+    parser.add_argument("--engine", choices=["chroma", "numpy", "int8", "pq"], default="chroma",
+                        help="retrieval engine; numpy is an exact memory-mapped index, "
+                             "int8/pq search compressed codes and rerank exactly")
+    parser.add_argument("--index-dtype", choices=["float32", "float16"], default="float32",
+                        help="storage type for the numpy engine")
+    parser.add_argument("--rerank", action="store_true",
+                        help="over-fetch 50 hits and rerank them with a cross-encoder")
+    parser.add_argument("--rerank-budget-ms", type=int, default=500,
+                        help="keep the dense order if reranking takes longer than this")
+    parser.add_argument("--fast-start", action="store_true",
+                        help="serve from the warm-start snapshot while models load in the background")
+    parser.add_argument("--no-facts", action="store_true",
+                        help="always use full RAG, even for questions the fact table can answer")
+    parser.add_argument("--no-entities", action="store_true",
+                        help="search the whole collection even when the question names an entity")
+    parser.add_argument("--compress-ratio", type=float, default=0.5,
+                        help="share of context tokens kept by extractive compression (1.0 disables it)")
+    parser.add_argument("--small-model", default=SMALL_MODEL,
+                        help="Ollama model for simple questions (pull it with: ollama pull llama3.2:3b)")
+    parser.add_argument("--no-router", action="store_true",
+                        help=f"send every question to {LARGE_MODEL}")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="time startup until the first retrieval, then exit")
+    args = parser.parse_args()
+    if args.startup_report:
+        startup_report(engine=args.engine, index_dtype=args.index_dtype, fast_start=args.fast_start)
+        sys.exit(0)
+    main(
+        filters={'type': args.type, 'category': args.category, 'source': args.source},
+        engine=args.engine,
+        index_dtype=args.index_dtype,
+        rerank=args.rerank,
+        rerank_budget_ms=args.rerank_budget_ms,
+        fast_start=args.fast_start,
+        use_facts=not args.no_facts,
+        use_entities=not args.no_entities,
+        compress_ratio=args.compress_ratio,
+        small_model=None if args.no_router else args.small_model,
+    )
 
@@ -0,0 +1,240 @@
+"""
+Admission control and fair queueing in front of the Ollama backend
+
+One local Ollama can only run a few generations at once. Sending it more
+makes every request slow until they all time out. AdmissionController lets
+at most ``concurrency`` generations through and queues the rest:
+
+- Fairness: start-time fair queueing. Every session has a virtual finish
+  tag, and a request's tag is its session's tag plus its cost. The lowest
+  tag goes next, so a session sending many requests cannot push the
+  others back, and sessions take turns.
+- Short prompts cost ``short_weight`` (0.5) of their tokens. A quick
+  factual question overtakes a long document analysis submitted at the
+  same time.
+- Bounded queue and deadlines: a request is rejected up front when the
+  queue is full, or when its estimated wait is already longer than the
+  deadline. The deadline is ``max_wait_s`` when given, else
+  ``max_wait_services`` times the measured service time (at least
+  ``min_wait_s``), so slow CPU generations do not turn away a second user
+  waiting behind one active request. A queued request that still waits at
+  its deadline expires. Either way the user hears back right away instead
+  of after the HTTP timeout.
+- Identical requests (same key) share one ticket and one slot, to go with
+  single-flight generation.
+
+Tickets report their queue position and estimated wait for the UI. The
+wait comes from a moving average of how long generations hold a slot.
+"""
+import time
+import threading
+import itertools
+
+from marvel_metrics import metrics
+
+class Rejected(Exception):
+    def __init__(self, reason, estimated_wait=None):
+        self.reason = reason
+        self.estimated_wait = estimated_wait
+        message = {'queue_full': "the queue is full", 'deadline': "the wait would exceed the deadline",
+                   'expired': "the request waited past its deadline"}.get(reason, reason)
+        if estimated_wait is not None:
+            message += f" (estimated wait {estimated_wait:.0f}s)"
+        super().__init__(message)
+
+class Ticket:
+    def __init__(self, controller, session, cost, tag, deadline, key):
+        self.controller = controller
+        self.session = session
+        self.cost = cost
+        self.tag = tag
+        self.deadline = deadline
+        self.key = key
+        self.submitted_at = time.monotonic()
+        self.granted_at = None
+        self.state = 'queued'
+        self.holders = 1
+        self.order = next(controller._sequence)
+
+    @property
+    def granted(self):
+        return self.state == 'active'
+
+    def position(self):
+        """1-based place in the queue, 0 once granted"""
+        return self.controller._position(self)
+
+    def estimated_wait(self):
+        """Seconds until this ticket is expected to get a slot"""
+        return self.controller._estimated_wait(self)
+
+    def wait(self, timeout=None):
+        """Block until granted (True), until timeout (False); raises Rejected if the ticket expires"""
+        return self.controller._wait(self, timeout)
+
+    def release(self):
+        """Give the slot back (or leave the queue); shared tickets free it when the last holder releases"""
+        self.controller._release(self)
+
+    def __enter__(self):
+        self.wait()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+class AdmissionController:
+    def __init__(self, concurrency=1, max_queue=16, max_wait_s=None, max_wait_services=3.0, min_wait_s=20.0,
+                 short_prompt_tokens=400, short_weight=0.5, expected_service_s=8.0, alpha=0.2):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self.max_wait_services = max_wait_services
+        self.min_wait_s = min_wait_s
+        self.short_prompt_tokens = short_prompt_tokens
+        self.short_weight = short_weight
+        self.expected_service_s = expected_service_s
+        self.alpha = alpha
+        self._cond = threading.Condition()
+        self._queue = []
+        self._active = []
+        self._by_key = {}
+        # Start-time fair queueing: system virtual time and each session's last finish tag
+        self._virtual_time = 0.0
+        self._finish_tags = {}
+        self._sequence = itertools.count()
+
+    def deadline_s(self):
+        """Longest acceptable wait: max_wait_s if set, else a few measured service times"""
+        if self.max_wait_s is not None:
+            return self.max_wait_s
+        return max(self.min_wait_s, self.max_wait_services * self.expected_service_s)
+
+    def cost(self, prompt_tokens):
+        weight = self.short_weight if prompt_tokens <= self.short_prompt_tokens else 1.0
+        return max(1.0, prompt_tokens * weight)
+
+    def submit(self, session, prompt_tokens, key=None, max_wait_s=None):
+        """Queue a request and return its Ticket; raises Rejected when it cannot be served in time"""
+        with self._cond:
+            shared = self._by_key.get(key) if key is not None else None
+            if shared is not None:
+                shared.holders += 1
+                metrics.incr('admission_shared')
+                return shared
+
+            if len(self._queue) >= self.max_queue:
+                metrics.incr('admission_rejected_queue_full')
+                raise Rejected('queue_full', self._wait_for_rank(len(self._queue)))
+            cost = self.cost(prompt_tokens)
+            start = max(self._virtual_time, self._finish_tags.get(session, 0.0))
+            tag = start + cost
+            max_wait_s = self.deadline_s() if max_wait_s is None else max_wait_s
+            ticket = Ticket(self, session, cost, tag, time.monotonic() + max_wait_s, key)
+            estimated = self._wait_for_rank(sum(1 for t in self._queue if self._ahead(t, ticket)))
+            if estimated > max_wait_s:
+                metrics.incr('admission_rejected_deadline')
+                raise Rejected('deadline', estimated)
+
+            self._finish_tags[session] = tag
+            if len(self._finish_tags) > 1000:
+                # Sessions whose tags virtual time has passed start from virtual time anyway
+                self._finish_tags = {s: f for s, f in self._finish_tags.items() if f > self._virtual_time}
+            self._queue.append(ticket)
+            if key is not None:
+                self._by_key[key] = ticket
+            metrics.incr('admission_submitted')
+            self._dispatch()
+            return ticket
+
+    @staticmethod
+    def _ahead(other, ticket):
+        return (other.tag, other.order) < (ticket.tag, ticket.order)
+
+    def _dispatch(self):
+        """Grant free slots to the lowest tags, expiring tickets past their deadline (lock held)"""
+        now = time.monotonic()
+        for ticket in [t for t in self._queue if t.deadline < now]:
+            self._queue.remove(ticket)
+            self._forget(ticket)
+            ticket.state = 'expired'
+            metrics.incr('admission_expired')
+        while self._queue and len(self._active) < self.concurrency:
+            ticket = min(self._queue, key=lambda t: (t.tag, t.order))
+            self._queue.remove(ticket)
+            ticket.state = 'active'
+            ticket.granted_at = now
+            # Virtual time moves to the start tag of the request entering service
+            self._virtual_time = max(self._virtual_time, ticket.tag - ticket.cost)
+            self._active.append(ticket)
+            metrics.observe('admission_wait', now - ticket.submitted_at)
+        self._cond.notify_all()
+
+    def _forget(self, ticket):
+        if ticket.key is not None and self._by_key.get(ticket.key) is ticket:
+            del self._by_key[ticket.key]
+
+    def _wait(self, ticket, timeout):
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if ticket.state == 'active':
+                    return True
+                if ticket.state == 'expired' or time.monotonic() > ticket.deadline:
+                    if ticket.state == 'queued':
+                        self._dispatch()
+                    raise Rejected('expired')
+                if ticket.state == 'released':
+                    return False
+                now = time.monotonic()
+                if end is not None and now >= end:
+                    return False
+                self._cond.wait(min(ticket.deadline, end if end is not None else ticket.deadline) - now + 0.01)
+
+    def _release(self, ticket):
+        with self._cond:
+            if ticket.state in ('released', 'expired'):
+                return
+            ticket.holders -= 1
+            if ticket.holders > 0:
+                return
+            if ticket.state == 'active':
+                self._active.remove(ticket)
+                held = time.monotonic() - ticket.granted_at
+                self.expected_service_s += self.alpha * (held - self.expected_service_s)
+                metrics.observe('admission_service', held)
+            else:
+                self._queue.remove(ticket)
+            ticket.state = 'released'
+            self._forget(ticket)
+            self._dispatch()
+
+    def _position(self, ticket):
+        with self._cond:
+            if ticket.state != 'queued':
+                return 0
+            return 1 + sum(1 for t in self._queue if self._ahead(t, ticket))
+
+    def _wait_for_rank(self, ahead):
+        """Estimated seconds until a request with `ahead` queued requests before it starts (lock held)"""
+        now = time.monotonic()
+        remaining = sorted(max(0.0, self.expected_service_s - (now - t.granted_at)) for t in self._active)
+        if len(self._active) < self.concurrency and ahead == 0:
+            return 0.0
+        # Slots free up as active requests finish, then every `concurrency` queued requests take one service time
+        first_free = remaining[0] if len(remaining) >= self.concurrency else 0.0
+        return first_free + (ahead // self.concurrency) * self.expected_service_s
+
+    def _estimated_wait(self, ticket):
+        with self._cond:
+            if ticket.state != 'queued':
+                return 0.0
+            return self._wait_for_rank(sum(1 for t in self._queue if self._ahead(t, ticket)))
+
+    def snapshot(self):
+        """Queue length, active generations and the current service time estimate"""
+        with self._cond:
+            return {'queued': len(self._queue), 'active': len(self._active),
+                    'expected_service_s': round(self.expected_service_s, 3),
+                    'deadline_s': round(self.deadline_s(), 1),
+                    'sessions': len({t.session for t in self._queue})}
@@ -0,0 +1,101 @@
+"""
+Query-aware chunk retrieval inside a single preprocessed document
+
+ChunkIndex builds a BM25 index over a document's text chunks once, then
+answers each question by scoring only the postings of its terms. When an
+embeddings model is available, the lexical shortlist is reranked by
+cosine similarity (chunk vectors are computed on demand and cached) and
+the two rankings are merged with reciprocal-rank fusion.
+"""
+import re
+import math
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'did', 'do', 'does', 'for', 'from', 'has', 'have',
+    'how', 'in', 'is', 'it', 'its', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'were',
+    'what', 'when', 'where', 'which', 'who', 'why', 'with', 'about', 'tell', 'me', 'document',
+}
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+class ChunkIndex:
+    def __init__(self, texts, min_length=20, k1=1.5, b=0.75):
+        self.texts = texts
+        self.k1 = k1
+        self.b = b
+        self.rows = []
+        self.lengths = []
+        self.postings = {}
+        for i, text in enumerate(texts):
+            text = str(text)
+            if len(text.strip()) <= min_length:
+                continue
+            row = len(self.rows)
+            self.rows.append(i)
+            tokens = tokenize(text)
+            self.lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                self.postings.setdefault(token, []).append((row, count))
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self._vectors = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def text(self, chunk_index):
+        return str(self.texts[chunk_index])
+
+    def lexical_search(self, query, k=20):
+        """BM25 top-k as [(chunk_index, score)]"""
+        scores = {}
+        total = len(self.rows)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for row, count in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[row] / (self.avg_length or 1.0))
+                scores[row] = scores.get(row, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+        ranked = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        return [(self.rows[row], score) for row, score in ranked]
+
+    def _chunk_vectors(self, chunk_indexes, embeddings):
+        """Embed only the chunks not embedded before"""
+        missing = [i for i in chunk_indexes if i not in self._vectors]
+        if missing:
+            vectors = embeddings.embed_documents([self.text(i) for i in missing])
+            for i, vector in zip(missing, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                self._vectors[i] = vector / (np.linalg.norm(vector) or 1.0)
+        return np.stack([self._vectors[i] for i in chunk_indexes])
+
+    def search(self, query, k=3, embeddings=None, shortlist=20, rrf_k=60):
+        """Chunk indexes most relevant to the query, best first"""
+        lexical = self.lexical_search(query, shortlist)
+        if not lexical:
+            # No term overlap: fall back to the dense ranking of the opening chunks
+            if embeddings is None or not self.rows:
+                return []
+            lexical = [(i, 0.0) for i in self.rows[:shortlist]]
+        candidates = [i for i, _ in lexical]
+        if embeddings is None:
+            return candidates[:k]
+
+        query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        similarities = self._chunk_vectors(candidates, embeddings) @ query_vector
+        dense_order = [candidates[i] for i in np.argsort(-similarities)]
+
+        fused = {}
+        for ranking in (candidates, dense_order):
+            for rank, chunk_index in enumerate(ranking):
+                fused[chunk_index] = fused.get(chunk_index, 0.0) + 1.0 / (rrf_k + rank + 1)
+        return sorted(fused, key=lambda i: -fused[i])[:k]
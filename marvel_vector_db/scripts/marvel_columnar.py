@@ -0,0 +1,239 @@
+"""
+Columnar, memory-mapped format for preprocessed document payloads
+
+Replaces ``document_data.pkl`` with ``document_data.mcol``: every list of
+strings (texts, tables, images, summaries) is stored as a uint64 offsets
+array followed by one UTF-8 blob, and everything else (e.g. metrics) goes
+into a small JSON header. Readers mmap the file and decode only the
+chunks they index, so opening a document costs the header parse alone.
+
+File layout:
+    MAGIC (8 bytes) | header length (uint64 LE) | header JSON
+    per column: offsets[count + 1] (uint64 LE) | blob
+
+Usage:
+    python marvel_vector_db/scripts/marvel_columnar.py convert preprocessed_documents
+    python marvel_vector_db/scripts/marvel_columnar.py compare preprocessed_documents
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import pickle
+import argparse
+import tracemalloc
+from array import array
+from pathlib import Path
+
+MAGIC = b"MCOL\x00\x01\x00\x00"
+COLUMNAR_NAME = "document_data.mcol"
+PICKLE_NAME = "document_data.pkl"
+
+def _offsets_bytes(offsets):
+    packed = array('Q', offsets)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+def write_columnar(path, data):
+    """Write a dict of string lists (plus JSON-serializable extras) to path"""
+    columns = {}
+    extra = {}
+    for name, value in data.items():
+        if isinstance(value, (list, tuple)):
+            columns[name] = [item if isinstance(item, str) else str(item) for item in value]
+        else:
+            extra[name] = value
+
+    # Encode every column first so the header can record absolute positions
+    encoded = {}
+    for name, items in columns.items():
+        parts = [item.encode('utf-8') for item in items]
+        offsets = [0]
+        for part in parts:
+            offsets.append(offsets[-1] + len(part))
+        encoded[name] = (_offsets_bytes(offsets), b"".join(parts), len(parts))
+
+    def header_for(base):
+        layout = {}
+        position = base
+        for name, (offsets, blob, count) in encoded.items():
+            layout[name] = {'count': count, 'offsets_start': position, 'data_start': position + len(offsets)}
+            position += len(offsets) + len(blob)
+        return json.dumps({'columns': layout, 'extra': extra}).encode('utf-8')
+
+    # The header's own length shifts the column positions, so settle it first
+    header = header_for(0)
+    while True:
+        base = len(MAGIC) + 8 + len(header)
+        candidate = header_for(base)
+        if len(candidate) == len(header):
+            header = candidate
+            break
+        header = candidate
+
+    tmp_path = Path(str(path) + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for offsets, blob, _ in encoded.values():
+            f.write(offsets)
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return Path(path)
+
+class ColumnView:
+    """Read-only sequence over one column; items are decoded on access"""
+    def __init__(self, buffer, count, offsets_start, data_start):
+        self._buffer = buffer
+        self._count = count
+        self._offsets_start = offsets_start
+        self._data_start = data_start
+
+    def __len__(self):
+        return self._count
+
+    def _offset(self, i):
+        start = self._offsets_start + 8 * i
+        return struct.unpack_from('<Q', self._buffer, start)[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("column index out of range")
+        begin = self._data_start + self._offset(index)
+        end = self._data_start + self._offset(index + 1)
+        return self._buffer[begin:end].decode('utf-8')
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def byte_length(self, index):
+        """Encoded size of one item without decoding it"""
+        return self._offset(index + 1) - self._offset(index)
+
+class ColumnarDocument:
+    """Memory-mapped document payload with dict-style access to its columns"""
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buffer[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{self.path} is not a columnar document file")
+        header_length = struct.unpack_from('<Q', self._buffer, len(MAGIC))[0]
+        header_start = len(MAGIC) + 8
+        header = json.loads(self._buffer[header_start:header_start + header_length].decode('utf-8'))
+        self.extra = header.get('extra', {})
+        self._columns = {
+            name: ColumnView(self._buffer, info['count'], info['offsets_start'], info['data_start'])
+            for name, info in header['columns'].items()
+        }
+
+    def keys(self):
+        return list(self._columns) + list(self.extra)
+
+    def __contains__(self, name):
+        return name in self._columns or name in self.extra
+
+    def __getitem__(self, name):
+        if name in self._columns:
+            return self._columns[name]
+        return self.extra[name]
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def count(self, name):
+        return len(self._columns[name]) if name in self._columns else 0
+
+    def close(self):
+        self._buffer.close()
+        self._file.close()
+
+def convert_pickle(pickle_path, remove_pickle=False):
+    """Convert one document_data.pkl (trusted, locally produced) to the columnar format"""
+    pickle_path = Path(pickle_path)
+    with open(pickle_path, 'rb') as f:
+        data = pickle.load(f)
+    output = write_columnar(pickle_path.with_name(COLUMNAR_NAME), data)
+    if remove_pickle:
+        pickle_path.unlink()
+    return output
+
+def document_data_path(folder):
+    """The columnar file unless the pickle was re-exported after it, else the pickle; None if neither exists"""
+    columnar_path = Path(folder) / COLUMNAR_NAME
+    pickle_path = Path(folder) / PICKLE_NAME
+    if columnar_path.exists() and (not pickle_path.exists()
+                                   or columnar_path.stat().st_mtime >= pickle_path.stat().st_mtime):
+        return columnar_path
+    return pickle_path if pickle_path.exists() else None
+
+def convert_tree(root, remove_pickle=False):
+    """Convert every <root>/<doc>/document_data.pkl that has no columnar file yet"""
+    converted = 0
+    for pickle_path in sorted(Path(root).glob(f"*/{PICKLE_NAME}")):
+        target = pickle_path.with_name(COLUMNAR_NAME)
+        if target.exists() and target.stat().st_mtime >= pickle_path.stat().st_mtime:
+            continue
+        try:
+            convert_pickle(pickle_path, remove_pickle)
+            converted += 1
+            print(f"   ✅ {pickle_path.parent.name}")
+        except Exception as e:
+            print(f"   ❌ {pickle_path.parent.name}: {e}")
+    return converted
+
+def _measure(load):
+    """Seconds and peak Python allocations of load()"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    load()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+def compare(root):
+    """Load time and memory of pickle vs columnar for the Documents page access pattern"""
+    print(f"{'document':<40} {'pickle s':>9} {'pickle MB':>10} {'mcol s':>9} {'mcol MB':>9}")
+    for folder in sorted(p for p in Path(root).iterdir() if p.is_dir()):
+        pickle_path = folder / PICKLE_NAME
+        columnar_path = folder / COLUMNAR_NAME
+        if not (pickle_path.exists() and columnar_path.exists()):
+            continue
+
+        def load_pickle():
+            with open(pickle_path, 'rb') as f:
+                return pickle.load(f)['texts'][:5]
+
+        def load_columnar():
+            document = ColumnarDocument(columnar_path)
+            texts = document['texts'][:5]
+            document.close()
+            return texts
+
+        pickle_seconds, pickle_peak = _measure(load_pickle)
+        columnar_seconds, columnar_peak = _measure(load_columnar)
+        print(f"{folder.name[:40]:<40} {pickle_seconds:9.4f} {pickle_peak / 1024 ** 2:10.2f} "
+              f"{columnar_seconds:9.4f} {columnar_peak / 1024 ** 2:9.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert preprocessed document pickles to the columnar format")
+    parser.add_argument("command", choices=["convert", "compare"])
+    parser.add_argument("root", nargs="?", default="preprocessed_documents")
+    parser.add_argument("--remove-pickle", action="store_true", help="delete each pickle after converting it")
+    args = parser.parse_args()
+    if args.command == "convert":
+        print(f"🔄 Converting document payloads under {args.root}")
+        print(f"✅ Converted {convert_tree(args.root, args.remove_pickle)} documents")
+    else:
+        compare(args.root)
@@ -0,0 +1,236 @@
+"""
+Query-focused extractive compression of retrieved context
+
+Retrieved chunks are split into sentences, and a "Heading:" line with its
+"- item" list counts as one sentence so lists are kept or dropped whole.
+Header boilerplate such as ``Title:`` / ``Category:`` / ``Source:``
+lines is dropped. Each sentence is scored by cosine similarity to the
+question. The best sentences are kept, in their original order, until
+they fill ``ratio`` of the original token count. The LLM then prefills a
+much shorter prompt.
+
+Sentence embeddings are computed once at ingestion and stored in
+``processed_data/sentence_cache`` (float16 vectors keyed by a hash of the
+sentence text). At query time the only new embedding is the question's.
+Sentences that are not in the cache, e.g. from the per-file stores, are
+embedded in one batch and kept in a bounded in-memory cache.
+
+Usage:
+    python scripts/marvel_compression.py build
+    python scripts/marvel_compression.py stats
+"""
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from marvel_metrics import metrics
+from marvel_conversation import estimate_tokens
+
+BASE_DIR = Path(__file__).parent.parent
+SENTENCE_CACHE_DIR = BASE_DIR / "processed_data" / "sentence_cache"
+VECTORS_FILE = "vectors.npy"
+KEYS_FILE = "keys.json"
+
+BOILERPLATE_RE = re.compile(r"^\s*(?:(?:Title|Category|Source|Revision|URL):.*|[=\-_*#]{3,})\s*$", re.MULTILINE)
+# Sentence ends followed by a capital, digit, quote or list marker; every line break also ends a sentence
+SENTENCE_RE = re.compile(r"[^\n]+?(?:[.!?](?=\s+[A-Z0-9\"'(\-])|$)", re.MULTILINE)
+WRAPPED_LINE_RE = re.compile(r"(?<=[^.!?:\n])\n(?=[a-z])")
+
+def sentence_key(sentence):
+    return hashlib.sha1(sentence.encode('utf-8')).hexdigest()[:20]
+
+def split_sentences(text):
+    """Sentences of a chunk as [(sentence, separator)], boilerplate lines removed"""
+    text = BOILERPLATE_RE.sub("", text)
+    # Hard-wrapped sentences: a line continuing in lowercase belongs to the line before
+    text = WRAPPED_LINE_RE.sub(" ", text)
+    sentences, in_list = [], False
+    for match in SENTENCE_RE.finditer(text):
+        sentence = match.group(0).strip()
+        if not sentence:
+            continue
+        # Keep line structure for "- item" lists, spaces inside paragraphs
+        separator = "\n" if text[match.end():match.end() + 1] in ("\n", "") else " "
+        if sentence.startswith("- ") and sentences and (in_list or sentences[-1][0].endswith(":")):
+            # A list item joins its heading and the items before it
+            sentences[-1] = (sentences[-1][0] + "\n" + sentence, separator)
+            in_list = True
+            continue
+        sentences.append((sentence, separator))
+        in_list = sentence.startswith("- ")
+    return sentences
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class SentenceCache:
+    """Normalized sentence embeddings keyed by sentence hash, persisted as float16"""
+    def __init__(self, cache_dir=None, max_memory_entries=20000):
+        self.cache_dir = Path(cache_dir or SENTENCE_CACHE_DIR)
+        self.max_memory_entries = max_memory_entries
+        self.vectors = None
+        self.rows = {}
+        # Sentences embedded since load: persisted by save(), evicted LRU when not persisted
+        self._memory = OrderedDict()
+        # One cache serves every Streamlit session; guards _memory's LRU order and save()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        keys_path = self.cache_dir / KEYS_FILE
+        vectors_path = self.cache_dir / VECTORS_FILE
+        if keys_path.exists() and vectors_path.exists():
+            with open(keys_path, 'r', encoding='utf-8') as f:
+                keys = json.load(f)
+            self.vectors = np.load(vectors_path, mmap_mode='r')
+            self.rows = {key: row for row, key in enumerate(keys)}
+
+    def __len__(self):
+        return len(self.rows) + len(self._memory)
+
+    def __contains__(self, sentence):
+        key = sentence_key(sentence)
+        return key in self.rows or key in self._memory
+
+    def _get(self, key):
+        """Cached vector or None; the caller holds the lock"""
+        row = self.rows.get(key)
+        if row is not None:
+            return np.asarray(self.vectors[row], dtype=np.float32)
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+        return vector
+
+    def embed(self, sentences, embeddings, persist=False):
+        """Vectors for sentences (float32, normalized); only sentences not cached are embedded"""
+        keys = [sentence_key(sentence) for sentence in sentences]
+        with self._lock:
+            found = {key: self._get(key) for key in set(keys)}
+        missing = list(dict.fromkeys(s for s, key in zip(sentences, keys) if found[key] is None))
+        metrics.incr('sentence_cache_hits', len(sentences) - len(missing))
+        if missing:
+            metrics.incr('sentence_cache_misses', len(missing))
+            with metrics.span('sentence_embed', items=len(missing)):
+                vectors = _normalize(embeddings.embed_documents(missing))
+            with self._lock:
+                for sentence, vector in zip(missing, vectors):
+                    found[sentence_key(sentence)] = vector
+                    self._memory[sentence_key(sentence)] = vector
+                if not persist:
+                    while len(self._memory) > self.max_memory_entries:
+                        self._memory.popitem(last=False)
+        if not keys:
+            return np.zeros((0, 1), dtype=np.float32)
+        return np.stack([found[key] for key in keys])
+
+    def save(self):
+        """Merge in-memory sentences into the float16 file on disk"""
+        with self._lock:
+            if not self._memory:
+                return self.cache_dir
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            keys = sorted(self.rows, key=self.rows.get) + list(self._memory)
+            new = np.stack(list(self._memory.values())).astype(np.float16)
+            vectors = np.concatenate([np.asarray(self.vectors), new]) if self.vectors is not None and len(self.rows) else new
+            tmp_vectors = self.cache_dir / (VECTORS_FILE + ".tmp.npy")
+            tmp_keys = self.cache_dir / (KEYS_FILE + ".tmp")
+            np.save(tmp_vectors, vectors)
+            with open(tmp_keys, 'w', encoding='utf-8') as f:
+                json.dump(keys, f)
+            self.vectors = None
+            os.replace(tmp_vectors, self.cache_dir / VECTORS_FILE)
+            os.replace(tmp_keys, self.cache_dir / KEYS_FILE)
+            self._memory.clear()
+            self._load()
+            return self.cache_dir
+
+def cache_chunk_sentences(texts, embeddings, cache_dir=None, batch_size=256):
+    """Embed the sentences of ingested chunks that are not cached yet and save the cache"""
+    cache = SentenceCache(cache_dir)
+    sentences = list(dict.fromkeys(s for text in texts for s, _ in split_sentences(text) if s not in cache))
+    for start in range(0, len(sentences), batch_size):
+        cache.embed(sentences[start:start + batch_size], embeddings, persist=True)
+    cache.save()
+    return cache, len(sentences)
+
+class PromptCompressor:
+    def __init__(self, embeddings, cache=None, ratio=0.5, min_tokens=120):
+        self.embeddings = embeddings
+        self.cache = cache if cache is not None else SentenceCache()
+        self.ratio = ratio
+        self.min_tokens = min_tokens
+
+    def compress_texts(self, query, texts, ratio=None, query_vector=None):
+        """Keep the sentences of texts most similar to query, up to ratio of their tokens"""
+        ratio = self.ratio if ratio is None else ratio
+        segments = [split_sentences(text) for text in texts]
+        flat = [(i, j, sentence) for i, sentences in enumerate(segments) for j, (sentence, _) in enumerate(sentences)]
+        total = sum(estimate_tokens(sentence) for _, _, sentence in flat)
+        budget = max(self.min_tokens, int(total * ratio))
+        if not flat or ratio >= 1.0 or total <= budget:
+            return ["".join(s + sep for s, sep in sentences).strip() for sentences in segments]
+
+        with metrics.span('compress', sentences=len(flat)):
+            if query_vector is None:
+                query_vector = self.embeddings.embed_query(query)
+            query_vector = _normalize(query_vector)
+            scores = self.cache.embed([sentence for _, _, sentence in flat], self.embeddings) @ query_vector
+
+            keep, used = set(), 0
+            for index in np.argsort(-scores):
+                cost = estimate_tokens(flat[index][2])
+                # Skip sentences that don't fit, a shorter one may still fit
+                if used + cost > budget and keep:
+                    continue
+                keep.add((flat[index][0], flat[index][1]))
+                used += cost
+
+        metrics.incr('prompt_tokens_before', total)
+        metrics.incr('prompt_tokens_after', used)
+        return ["".join(s + sep for j, (s, sep) in enumerate(sentences) if (i, j) in keep).strip()
+                for i, sentences in enumerate(segments)]
+
+    def compress(self, query, docs, ratio=None):
+        """Compressed context for Documents: kept sentences of each chunk, empty chunks dropped"""
+        texts = self.compress_texts(query, [doc.page_content for doc in docs], ratio)
+        return "\n\n".join(text for text in texts if text)
+
+def load_compressor(embeddings, ratio=0.5, cache_dir=None):
+    """Compressor backed by the ingestion-time sentence cache"""
+    return PromptCompressor(embeddings, SentenceCache(cache_dir), ratio=ratio)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect the sentence embedding cache")
+    parser.add_argument("command", choices=["build", "stats"])
+    args = parser.parse_args()
+    if args.command == "build":
+        from langchain_chroma import Chroma
+        from langchain_huggingface import HuggingFaceEmbeddings
+        from marvel_warm_start import resolve_model_path
+        from marvel_model_host import connect_model_host
+        embeddings = connect_model_host(normalize=True) or HuggingFaceEmbeddings(
+            model_name=resolve_model_path(), model_kwargs={"device": "cpu"},
+            encode_kwargs={"normalize_embeddings": True})
+        vectorstore = Chroma(collection_name="marvel_knowledge_base", embedding_function=embeddings,
+                             persist_directory=str(BASE_DIR / "vectorstore"))
+        texts = vectorstore._collection.get(include=['documents'])['documents']
+        cache, added = cache_chunk_sentences(texts, embeddings)
+        print(f"✅ {added} new sentences embedded, {len(cache)} cached in {cache.cache_dir}")
+    else:
+        cache = SentenceCache()
+        size = (cache.cache_dir / VECTORS_FILE).stat().st_size if len(cache) else 0
+        print(f"📊 {len(cache)} sentences cached ({size / 1024 / 1024:.1f} MB) in {cache.cache_dir}")
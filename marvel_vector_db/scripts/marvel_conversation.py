@@ -0,0 +1,243 @@
+"""
+Bounded conversation memory for the Marvel chats
+
+ConversationMemory keeps the most recent turns verbatim within a token
+budget. Turns that fall out of the window are folded into a rolling
+summary by a background thread, so adding a turn never waits for the LLM
+and the history block in the prompt stays the same size however long the
+conversation gets.
+
+Follow-up questions ("what about his enemies?") are rewritten into
+standalone queries for retrieval by substituting the last named entity
+for the pronouns. Only when no entity can be found is the (small) rewrite
+model asked, so most turns do not wait for an LLM before retrieval.
+"""
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from marvel_metrics import metrics
+
+# Pronouns and follow-up phrases; bare "it", "this", "that" and "more" appear in too many standalone questions
+FOLLOW_UP_RE = re.compile(
+    r"\b(he|she|him|his|her|hers|they|them|their|its|"
+    r"what about|how about|what else|and the)\b", re.IGNORECASE
+)
+PRONOUNS = {
+    'he': "{}", 'she': "{}", 'him': "{}", 'they': "{}", 'them': "{}", 'it': "{}",
+    'his': "{}'s", 'her': "{}'s", 'hers': "{}'s", 'their': "{}'s", 'its': "{}'s",
+}
+PRONOUN_RE = re.compile(r"\b(" + "|".join(PRONOUNS) + r")\b", re.IGNORECASE)
+# Capitalized names, including hyphenated ones like Spider-Man and Ant-Man
+ENTITY_RE = re.compile(r"\b[A-Z]\w*(?:'[A-Z]\w*)?(?:[- ](?:of |the )?[A-Z]\w*(?:'[A-Z]\w*)?)*")
+# Capitalized words that start a question or sentence rather than a name ("Is Thor" -> "Thor")
+NOT_ENTITIES = {'What', 'Who', 'Where', 'When', 'Why', 'How', 'Which', 'Tell', 'Describe', 'Is', 'Are',
+                'Does', 'Did', 'Do', 'Can', 'Has', 'Have', 'Had', 'Was', 'Were', 'Will', 'Would', 'Could',
+                'Should', 'List', 'Name', 'Explain', 'Compare', 'Give', 'Show', 'Please', 'He', 'She', 'They',
+                'It', 'His', 'Her', 'Their', 'Its', 'This', 'That', 'These', 'Those', 'But', 'So', 'Or', 'Also',
+                'The', 'A', 'An', 'In', 'Of', 'I', 'And', 'Marvel', 'the', 'of'}
+
+SUMMARY_PROMPT = """Update the summary of a conversation about Marvel Comics with the new turns below. Keep the characters, teams, events and facts that were discussed. Respond only with the updated summary in at most {words} words.
+
+Current summary: {summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+REWRITE_PROMPT = """Rewrite the follow-up question as a standalone question about Marvel Comics, replacing pronouns with the names they refer to. Respond only with the rewritten question.
+
+Conversation:
+{history}
+
+Follow-up question: {question}
+
+Standalone question:"""
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English)"""
+    return len(text) // 4 + 1
+
+def clip_tokens(text, max_tokens, keep="start"):
+    """Trim text to roughly max_tokens, keeping its start or its end"""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + "..." if keep == "start" else "..." + text[-max_chars:]
+
+def ollama_llm(model="mistral:7b", base_url="http://localhost:11434", num_predict=160, timeout=20):
+    """Short, low-temperature Ollama completions for summaries and rewrites"""
+    from marvel_summarizer import OllamaClient
+    client = OllamaClient(base_url, model, timeout=timeout,
+                          options={'temperature': 0.0, 'num_predict': num_predict})
+    return client.generate
+
+def find_entities(text, aliases=None):
+    """Capitalized names in text, in order; aliases (lowercase) confirm one-word names opening a sentence"""
+    names = []
+    for match in ENTITY_RE.finditer(text):
+        words = match.group(0).split(" ")
+        while words and words[0] in NOT_ENTITIES:
+            words.pop(0)
+        if not words:
+            continue
+        name = " ".join(words)
+        before = text[:match.start()]
+        opens_sentence = (len(words) == len(match.group(0).split(" ")) and
+                          (not before.strip() or before.rstrip()[-1] in ".!?:" or "\n" in before[len(before.rstrip()):]))
+        # "List his enemies", "Explain his powers": a lone word there is usually a verb, not a name
+        if opens_sentence and len(words) == 1 and "-" not in name and not (aliases and name.lower() in aliases):
+            continue
+        names.append((match.start() + match.group(0).index(name), name))
+    return names
+
+def last_entity(texts, aliases=None):
+    """First capitalized name of the latest text that has one (texts oldest first)"""
+    for text in reversed(texts):
+        names = find_entities(text, aliases)
+        if names:
+            return names[0][1]
+    return None
+
+class ConversationMemory:
+    def __init__(self, llm=None, rewrite_llm=None, max_recent_tokens=600, max_summary_tokens=200,
+                 max_answer_tokens=150, aliases=None):
+        # Callables prompt -> text: llm writes summaries in the background, rewrite_llm (a small,
+        # fast model; defaults to llm) rewrites follow-ups that entity substitution cannot resolve
+        self.llm = llm
+        self.rewrite_llm = rewrite_llm or llm
+        # Lowercase entity names and aliases (EntityIndex.aliases or FactStore.aliases), if available
+        self.aliases = aliases
+        self.max_recent_tokens = max_recent_tokens
+        self.max_summary_tokens = max_summary_tokens
+        self.max_answer_tokens = max_answer_tokens
+        self.summary = ""
+        self.turns = []
+        self._pending = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-summary")
+        self._summarizing = None
+        # Bumped by clear(); a summary started before the clear is discarded
+        self._generation = 0
+
+    def __len__(self):
+        return len(self.turns) + len(self._pending)
+
+    def _turn_text(self, turn):
+        return f"User: {clip_tokens(turn[0], 100)}\nAssistant: {clip_tokens(turn[1], self.max_answer_tokens)}"
+
+    def add(self, question, answer):
+        """Record a turn; turns beyond the token budget are summarized in the background"""
+        with self._lock:
+            self.turns.append((question, answer))
+            evicted = []
+            while len(self.turns) > 1 and sum(estimate_tokens(self._turn_text(t)) for t in self.turns) > self.max_recent_tokens:
+                evicted.append(self.turns.pop(0))
+            if not evicted:
+                return
+            self._pending.extend(evicted)
+            if self._summarizing is None or self._summarizing.done():
+                self._summarizing = self._executor.submit(self._fold_pending)
+
+    def _fold_pending(self):
+        """Fold evicted turns into the rolling summary until none are left"""
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return
+                turns, summary, generation = list(self._pending), self.summary, self._generation
+            updated = None
+            if self.llm is not None:
+                prompt = SUMMARY_PROMPT.format(
+                    words=self.max_summary_tokens * 3 // 4,
+                    summary=summary or "(none)",
+                    turns="\n".join(self._turn_text(turn) for turn in turns),
+                )
+                try:
+                    with metrics.span('conversation_summary'):
+                        updated = (self.llm(prompt) or "").strip()
+                except Exception as e:
+                    print(f"   ⚠️  Conversation summary failed: {e}")
+            if not updated:
+                updated = self._extractive_summary(summary, turns)
+            with self._lock:
+                if generation != self._generation:
+                    continue  # cleared while summarizing; these turns belong to the old conversation
+                self.summary = clip_tokens(updated, self.max_summary_tokens, keep="end")
+                del self._pending[:len(turns)]
+
+    def _extractive_summary(self, summary, turns):
+        """Fallback without an LLM: each question plus the first sentence of its answer"""
+        lines = [summary] if summary else []
+        for question, answer in turns:
+            first_sentence = re.split(r"(?<=[.!?])\s", answer.strip(), maxsplit=1)[0]
+            lines.append(f"Asked: {question} Answer: {clip_tokens(first_sentence, 40)}")
+        return " ".join(lines)
+
+    def history_block(self):
+        """Summary plus recent turns for the prompt; bounded by the token budgets"""
+        with self._lock:
+            summary, pending, turns = self.summary, list(self._pending), list(self.turns)
+        parts = []
+        if pending:
+            # Not summarized yet: stand in with the cheap summary so nothing is lost
+            summary = clip_tokens(self._extractive_summary(summary, pending), self.max_summary_tokens, keep="end")
+        if summary:
+            parts.append(f"Summary of the earlier conversation: {summary}")
+        if turns:
+            parts.append("Recent conversation:\n" + "\n".join(self._turn_text(turn) for turn in turns))
+        return "\n\n".join(parts)
+
+    def prompt_section(self):
+        """History block formatted for insertion ahead of the context, or ''"""
+        block = self.history_block()
+        return f"Conversation so far:\n{block}\n\n" if block else ""
+
+    def standalone_query(self, question):
+        """Rewrite a follow-up question into a standalone query for retrieval"""
+        with self._lock:
+            turns = list(self.turns[-2:])
+        if not turns or not FOLLOW_UP_RE.search(question):
+            return question
+        # "Who created Wolverine and when did he first appear?" names its own subject, while in
+        # "Compare his claws to Deadpool" the pronoun comes first and refers to the conversation
+        names = find_entities(question, self.aliases)
+        pronoun = next((m for m in PRONOUN_RE.finditer(question) if m.group(1).lower() != 'it'), None)
+        if names and (pronoun is None or names[0][0] < pronoun.start()):
+            return question
+
+        # Cheap first: the subject of the latest question, else of the latest answer
+        entity = last_entity([a for _, a in turns[-1:]] + [q for q, _ in turns], self.aliases)
+        if entity:
+            metrics.incr('query_rewrites')
+            if PRONOUN_RE.search(question):
+                return PRONOUN_RE.sub(lambda m: PRONOUNS[m.group(1).lower()].format(entity), question)
+            return f"{entity}: {question}"
+
+        if self.rewrite_llm is not None:
+            history = "\n".join(self._turn_text((q, clip_tokens(a, 60))) for q, a in turns)
+            try:
+                with metrics.span('query_rewrite'):
+                    rewritten = (self.rewrite_llm(REWRITE_PROMPT.format(history=history, question=question)) or "").strip()
+                rewritten = rewritten.splitlines()[0].strip().strip('"') if rewritten else ""
+                # Reject answers and rambling instead of a question
+                if 0 < len(rewritten) <= max(200, 3 * len(question)):
+                    metrics.incr('query_rewrites')
+                    return rewritten
+            except Exception as e:
+                print(f"   ⚠️  Query rewrite failed: {e}")
+        return question
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.summary = ""
+            self.turns = []
+            self._pending = []
+
+    def wait(self, timeout=None):
+        """Block until background summarization is finished (for scripts and benchmarks)"""
+        future = self._summarizing
+        if future is not None:
+            future.result(timeout)
@@ -0,0 +1,244 @@
+"""
+Entity and alias index for narrowing retrieval
+
+At ingestion every document contributes an entity: its ``Title:`` header
+(or file name) plus aliases from intro patterns such as
+``Spider-Man (Peter Parker) is ...`` and a small table of well-known
+nicknames. Hyphen-free spellings are added as well, so "Spiderman" and
+"spider man" also match. All aliases go into an Aho-Corasick automaton, so
+one pass over a question finds every entity it names, however many
+aliases there are.
+
+The same automaton is run over every document and image file name to
+record which sources mention each entity. At query time, the sources of
+the recognized entities become a ``source`` filter. The vector search
+then only scores those chunks, which MarvelRetriever scores exactly when
+the set is small.
+
+Usage:
+    python scripts/marvel_entities.py build
+    python scripts/marvel_entities.py match "What are Spidey's powers?"
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from marvel_facts import extract_facts
+
+BASE_DIR = Path(__file__).parent.parent
+ENTITIES_PATH = BASE_DIR / "processed_data" / "entities.json"
+
+FILE_PREFIX_RE = re.compile(r"^(characters?|teams?|events?|comics?|general)_", re.IGNORECASE)
+NICKNAMES = {
+    'Spider-Man': ["Spidey", "Web-Slinger", "Wall-Crawler", "Web-Head"],
+    'Iron Man': ["Shellhead", "Tony Stark"],
+    'Captain America': ["Cap", "Steve Rogers", "Sentinel of Liberty"],
+    'Thor': ["God of Thunder", "Odinson", "Thor Odinson"],
+    'Hulk': ["Bruce Banner", "Jade Giant", "Green Goliath", "Incredible Hulk"],
+    'Black Widow': ["Natasha Romanoff", "Natasha Romanova", "Natasha"],
+    'Doctor Strange': ["Dr. Strange", "Dr Strange", "Stephen Strange", "Sorcerer Supreme"],
+    'Wolverine': ["Logan", "Weapon X", "James Howlett"],
+    'Avengers': ["Earth's Mightiest Heroes"],
+    'X-Men': ["Xmen", "Children of the Atom"],
+    'Infinity Gauntlet': ["Infinity Gems", "Infinity Stones"],
+}
+WORD_CHARS = re.compile(r"[\w]")
+
+def normalize(text):
+    """Lowercase with curly quotes straightened, so offsets match the original text"""
+    return text.lower().replace("’", "'")
+
+def alias_variants(alias):
+    """Spellings of an alias: as written, without hyphens, with hyphens as spaces"""
+    alias = normalize(alias.replace('"', '').strip())
+    variants = {alias}
+    if "-" in alias:
+        variants.update({alias.replace("-", ""), alias.replace("-", " ")})
+    if alias.startswith("the "):
+        variants.add(alias[4:])
+    return {variant for variant in variants if len(variant) >= 3}
+
+class AhoCorasick:
+    """Multi-pattern matcher: every pattern found in one pass over the text"""
+    def __init__(self, patterns):
+        # patterns: {pattern: value}; goto/fail/output tables over characters
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for pattern, value in patterns.items():
+            self._add(pattern, value)
+        self._build_failure_links()
+
+    def _add(self, pattern, value):
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append((len(pattern), value))
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def iter_matches(self, text):
+        """(start, end, value) for every pattern occurrence, overlapping included"""
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, value in self.output[state]:
+                yield i - length + 1, i + 1, value
+
+    def find(self, text):
+        """Leftmost-longest, whole-word, non-overlapping matches as [(start, end, value)]"""
+        matches = []
+        for start, end, value in self.iter_matches(text):
+            # Whole words only: "cap" must not match inside "captain"
+            if start > 0 and WORD_CHARS.match(text[start - 1]):
+                continue
+            if end < len(text) and WORD_CHARS.match(text[end]):
+                continue
+            matches.append((start, end, value))
+        matches.sort(key=lambda m: (m[0], -(m[1] - m[0])))
+        selected, last_end = [], -1
+        for start, end, value in matches:
+            if start >= last_end:
+                selected.append((start, end, value))
+                last_end = end
+        return selected
+
+def document_entity(text, filename):
+    """Canonical entity name and aliases for one document"""
+    # Title, real name and "Tony Stark" style aliases come from the fact extractor
+    record = extract_facts(text, filename, name=FILE_PREFIX_RE.sub("", Path(filename).stem).replace("_", " "))
+    name = re.sub(r"\s*\((comics|character|marvel comics)\)$", "", record['entity'], flags=re.IGNORECASE)
+    aliases = set(record['aliases']) | {name}
+    aliases.update(NICKNAMES.get(name, []))
+    return name, aliases
+
+class EntityIndex:
+    def __init__(self, entities=None):
+        # entities: {name: {'aliases': [...], 'sources': [...]}}
+        self.entities = entities or {}
+        patterns = {}
+        for name, entry in self.entities.items():
+            for alias in entry['aliases']:
+                for variant in alias_variants(alias):
+                    # First entity claiming an alias keeps it
+                    patterns.setdefault(variant, name)
+        self.matcher = AhoCorasick(patterns)
+        self.num_patterns = len(patterns)
+        # Lowercase alias -> entity name
+        self.aliases = patterns
+
+    def __len__(self):
+        return len(self.entities)
+
+    @classmethod
+    def build(cls, text_files, image_files=()):
+        """Entities from documents, then which documents and images mention each one"""
+        texts = {}
+        entities = {}
+        for text_file in text_files:
+            with open(text_file, 'r', encoding='utf-8') as f:
+                texts[Path(text_file).name] = f.read()
+        for filename, text in texts.items():
+            name, aliases = document_entity(text, filename)
+            entry = entities.setdefault(name, {'aliases': [], 'sources': []})
+            entry['aliases'] = sorted(set(entry['aliases']) | aliases)
+        index = cls(entities)
+
+        mentions = {name: set() for name in entities}
+        for filename, text in texts.items():
+            for name in index.match(text):
+                mentions[name].add(filename)
+        for image_file in image_files:
+            # spider-man_cover.jpg -> "spider-man cover"
+            stem = Path(image_file).stem.replace("_", " ")
+            for name in index.match(stem):
+                mentions[name].add(Path(image_file).name)
+        for name, sources in mentions.items():
+            entities[name]['sources'] = sorted(sources)
+        return cls(entities)
+
+    @classmethod
+    def load(cls, path=None):
+        """Load entities.json, or return None if it has not been built"""
+        path = Path(path or ENTITIES_PATH)
+        if not path.exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f)['entities'])
+
+    def save(self, path=None):
+        path = Path(path or ENTITIES_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'entities': self.entities, 'built_at': time.strftime('%Y-%m-%d %H:%M:%S')}, f, indent=2)
+        return path
+
+    def match(self, text):
+        """Entity names mentioned in text, in order of first mention"""
+        return list(dict.fromkeys(value for _, _, value in self.matcher.find(normalize(text))))
+
+    def narrow(self, query, filters=None):
+        """Add a source filter for the entities a query names; returns (filters, entities)"""
+        filters = dict(filters or {})
+        # An explicit source filter wins over the guess
+        if filters.get('source'):
+            return filters, []
+        entities = self.match(query)
+        sources = sorted({source for name in entities for source in self.entities[name]['sources']})
+        if not sources:
+            return filters, []
+        filters['source'] = sources
+        return filters, entities
+
+def build_entity_index(raw_data_dir=None, path=None):
+    """Build entities.json from raw_data/documents and raw_data/images"""
+    raw_data_dir = Path(raw_data_dir or BASE_DIR / "raw_data")
+    text_files = sorted((raw_data_dir / "documents").glob("*.txt"))
+    images_dir = raw_data_dir / "images"
+    image_files = sorted(p for p in images_dir.iterdir() if p.is_file()) if images_dir.exists() else []
+    index = EntityIndex.build(text_files, image_files)
+    return index, index.save(path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the Marvel entity index")
+    parser.add_argument("command", choices=["build", "match"])
+    parser.add_argument("text", nargs="?", default="")
+    args = parser.parse_args()
+    if args.command == "build":
+        index, path = build_entity_index()
+        print(f"✅ {len(index)} entities, {index.num_patterns} alias patterns saved to {path}")
+    else:
+        index = EntityIndex.load()
+        if index is None:
+            print("❌ No entity index yet, run: python scripts/marvel_entities.py build")
+            sys.exit(1)
+        start = time.perf_counter()
+        filters, entities = index.narrow(args.text)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"Entities: {entities or 'none'} ({elapsed:.3f} ms)")
+        if entities:
+            print(f"Sources: {', '.join(filters['source'])}")
@@ -0,0 +1,291 @@
+"""
+Structured fact store with an LLM-free fast path
+
+The curated documents follow a fixed shape: an intro sentence with the
+real name, creators and first appearance, then "Heading:" blocks of
+"- item" lists (Powers and Abilities, Notable Storylines, Founding
+Members, Key Characters) or short paragraphs (Plot, Impact). Ingestion
+extracts these into processed_data/facts.json: one record per entity plus
+an alias index (name, real name, name without "The", ...).
+
+FactStore.answer() recognizes questions such as "When did Iron Man first
+appear?" or "Who are the founding members of the X-Men?" and answers them
+from the table in well under a millisecond, with the source file. The
+entity and the intent phrase must cover essentially the whole question:
+leftover words ("Did Spider-Man *lose* his powers", "first appear *in the
+MCU*") mean the question asks something the table cannot answer. Any
+other question returns None and goes through full RAG.
+
+Usage:
+    python scripts/marvel_facts.py build
+    python scripts/marvel_facts.py ask "Who created Wolverine and when did he first appear?"
+"""
+import re
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.parent
+FACTS_PATH = BASE_DIR / "processed_data" / "facts.json"
+
+HEADING_RE = re.compile(r"^([A-Z][A-Za-z ]+):\s*$")
+TITLE_RE = re.compile(r"^Title:\s*(.+)$", re.MULTILINE)
+CATEGORY_RE = re.compile(r"^Category:\s*(.+)$", re.MULTILINE)
+INTRO_NAME_RE = re.compile(r"^(?:The\s+)?([^\n(]+?)\s*\(([^)]+)\)\s+(?:is|are)\b", re.MULTILINE)
+CREATED_RE = re.compile(r"[Cc]reated by (.+?)(?:,\s*(?:he|she|they|the team)\s+first|,\s*first|\.\s)", re.DOTALL)
+FIRST_APPEARANCE_RE = re.compile(r"first appear(?:ed|ing) in (.+?\(\w+ \d{4}\))", re.DOTALL)
+PUBLISHED_RE = re.compile(r"Published in ([\d–-]+)")
+WRITTEN_RE = re.compile(r"written by (.+?)(?: and penciled by (.+?))?\.\s", re.DOTALL)
+
+# Question patterns -> fields; every matched field must exist for the fast path to answer
+INTENTS = [
+    ('first_appearance', re.compile(r"\bfirst (appearances?|appeared|appears?|issue|comic)\b|\bdebut(ed|s)?\b|\bintroduced\b", re.IGNORECASE)),
+    ('created_by', re.compile(r"\bwho (created|invented|came up with)\b|\bcreators?\b|\bcreated by\b", re.IGNORECASE)),
+    ('real_name', re.compile(r"\breal name\b|\bsecret identity\b|\balter ego\b", re.IGNORECASE)),
+    ('powers_and_abilities', re.compile(r"\bpowers\b|\bpower\b|\babilities\b", re.IGNORECASE)),
+    ('notable_storylines', re.compile(r"\b(notable |major |famous |best )?(storylines|story arcs)\b", re.IGNORECASE)),
+    ('founding_members', re.compile(r"\b(founding|original) members\b|\bfounders\b|\bwho founded\b", re.IGNORECASE)),
+    ('key_characters', re.compile(r"\bkey characters\b|\bwho (was|is|were) involved\b", re.IGNORECASE)),
+    ('written_by', re.compile(r"\bwho wrote\b|\bwritten by\b|\bwriters?\b", re.IGNORECASE)),
+    ('published', re.compile(r"\bwhen was .* published\b|\bwhat year\b|\bpublished\b", re.IGNORECASE)),
+]
+# Questions asking for explanation or comparison need the LLM even if a field matches
+NEEDS_REASONING_RE = re.compile(r"\b(why|explain|compare|difference|versus|vs\.?|better|stronger|how does|how do)\b",
+                                re.IGNORECASE)
+# Words a factual question may have besides the entity and the intent phrase
+FILLER_WORDS = {
+    'what', 'who', 'whose', 'when', 'which', 'is', 'are', 'was', 'were', 'did', 'does', 'do', 'has', 'have', 'had',
+    'the', 'a', 'an', 'of', 'in', 'and', 'to', 'for', 'by', 'he', 'she', 'they', 'his', 'her', 'its', 'their',
+    'tell', 'me', 'about', 'list', 'give', 'name', 'names', 'please', 'main', 'all', 'marvel', 'comic', 'comics',
+    'character', 'characters', 'team', 'event', 'storyline',
+}
+WORD_RE = re.compile(r"[a-z0-9]+")
+# Questions over the curated documents and the field each must be answered from (None = needs RAG)
+CHECK_QUESTIONS = [
+    ("What was Wolverine's first appearance?", 'first_appearance'),
+    ("What is the first appearance of Thor?", 'first_appearance'),
+    ("Wolverine first appearance", 'first_appearance'),
+    ("When did Hulk first appear?", 'first_appearance'),
+    ("When did Spider-Man debut?", 'first_appearance'),
+    ("Who created Spider-Man?", 'created_by'),
+    ("What are Thor's powers?", 'powers_and_abilities'),
+    ("What is Iron Man's real name?", 'real_name'),
+    ("Who were the founding members of the Avengers?", 'founding_members'),
+    ("Who wrote Civil War?", 'written_by'),
+    ("Who is Wolverine?", None),
+    ("What happened to Thor's hammer in his first appearance?", None),
+    ("Why is Hulk stronger than Thor?", None),
+]
+FIELD_LABELS = {
+    'first_appearance': "First appearance",
+    'created_by': "Created by",
+    'real_name': "Real name",
+    'powers_and_abilities': "Powers and abilities",
+    'notable_storylines': "Notable storylines",
+    'founding_members': "Founding members",
+    'key_characters': "Key characters",
+    'written_by': "Written by",
+    'published': "Published",
+}
+
+def _field_name(heading):
+    return re.sub(r"[^a-z0-9]+", "_", heading.lower()).strip("_")
+
+def _clean(text):
+    return re.sub(r"\s+", " ", text).strip().rstrip(",")
+
+def extract_facts(text, source, name=None):
+    """Fact record for one curated document: {'entity', 'aliases', 'source', fields...}"""
+    title = TITLE_RE.search(text)
+    entity = (title.group(1).strip() if title else None) or name or Path(source).stem
+    category = CATEGORY_RE.search(text)
+    body = text[category.end():] if category else (text[title.end():] if title else text)
+    record = {'entity': entity, 'aliases': [entity], 'source': Path(source).name,
+              'category': category.group(1).strip().rstrip('s') if category else 'general'}
+
+    intro = INTRO_NAME_RE.search(body)
+    if intro:
+        real_name = _clean(intro.group(2))
+        record['real_name'] = real_name
+        record['aliases'].append(real_name.replace('"', ''))
+        # Anthony Edward "Tony" Stark -> Tony Stark
+        nickname = re.search(r'"([^"]+)"', real_name)
+        if nickname:
+            record['aliases'].append(f"{nickname.group(1)} {real_name.split()[-1]}")
+    created = CREATED_RE.search(body)
+    if created:
+        record['created_by'] = _clean(created.group(1))
+    first = FIRST_APPEARANCE_RE.search(body)
+    if first:
+        record['first_appearance'] = _clean(first.group(1))
+    published = PUBLISHED_RE.search(body)
+    if published:
+        record['published'] = published.group(1)
+    written = WRITTEN_RE.search(body)
+    if written:
+        record['written_by'] = _clean(written.group(1))
+        if written.group(2):
+            record['penciled_by'] = _clean(written.group(2))
+
+    # "Heading:" blocks of "- item" lines become lists, prose blocks become text
+    def flush(heading, lines):
+        if heading and lines:
+            items = [l[2:].strip() for l in lines if l.startswith("- ")]
+            record[_field_name(heading)] = list(dict.fromkeys(items)) if items else _clean(" ".join(lines))
+
+    heading, lines = None, []
+    for line in body.splitlines():
+        match = HEADING_RE.match(line.strip())
+        if match or (heading and not line.strip() and lines and not lines[-1].startswith("- ")):
+            flush(heading, lines)
+            heading, lines = (match.group(1), []) if match else (None, [])
+            continue
+        if heading and line.strip():
+            lines.append(line.strip())
+    flush(heading, lines)
+
+    if entity.lower().startswith("the "):
+        record['aliases'].append(entity[4:])
+    record['aliases'] = sorted(set(record['aliases']), key=len, reverse=True)
+    return record
+
+class FactStore:
+    def __init__(self, entities=None):
+        self.entities = entities or {}
+        self._build_alias_index()
+
+    def _build_alias_index(self):
+        self.aliases = {}
+        for entity, record in self.entities.items():
+            for alias in record.get('aliases', [entity]):
+                self.aliases.setdefault(alias.lower(), entity)
+        # Longest aliases first so "Captain America" wins over "America"
+        ordered = sorted(self.aliases, key=len, reverse=True)
+        self._alias_re = re.compile(
+            r"(?<![\w-])(" + "|".join(re.escape(alias) for alias in ordered) + r")(?![\w-])", re.IGNORECASE
+        ) if ordered else None
+
+    def __len__(self):
+        return len(self.entities)
+
+    @classmethod
+    def build(cls, text_files):
+        entities = {}
+        for text_file in text_files:
+            with open(text_file, 'r', encoding='utf-8') as f:
+                text = f.read()
+            record = extract_facts(text, text_file)
+            # Only files in the curated shape carry facts worth a fast path
+            if any(field in record for field in FIELD_LABELS):
+                entities[record['entity']] = record
+        return cls(entities)
+
+    @classmethod
+    def load(cls, path=None):
+        """Load facts.json, or return None if it has not been built"""
+        path = Path(path or FACTS_PATH)
+        if not path.exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f)['entities'])
+
+    def save(self, path=None):
+        path = Path(path or FACTS_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'entities': self.entities, 'built_at': time.strftime('%Y-%m-%d %H:%M:%S')}, f, indent=2)
+        return path
+
+    def find_entity(self, question):
+        """The single entity a question is about, or None if there are none or several"""
+        if self._alias_re is None:
+            return None
+        found = {self.aliases[match.group(1).lower()] for match in self._alias_re.finditer(question)}
+        return found.pop() if len(found) == 1 else None
+
+    def _leftover_words(self, question, patterns):
+        """Words of the question not covered by the entity, the intent phrases or filler"""
+        text = self._alias_re.sub(" ", question)
+        for pattern in patterns:
+            text = pattern.sub(" ", text)
+        return [word for word in WORD_RE.findall(text.lower()) if len(word) > 1 and word not in FILLER_WORDS]
+
+    def lookup(self, entity, field):
+        return self.entities.get(entity, {}).get(field)
+
+    def answer(self, question):
+        """Answer a factual question from the table: {'answer', 'entity', 'fields', 'sources'} or None"""
+        if NEEDS_REASONING_RE.search(question):
+            return None
+        entity = self.find_entity(question)
+        if entity is None:
+            return None
+        fields = [field for field, pattern in INTENTS if pattern.search(question)]
+        record = self.entities[entity]
+        if not fields or any(field not in record for field in fields):
+            return None
+        if self._leftover_words(question, [pattern for field, pattern in INTENTS if field in fields]):
+            return None
+
+        lines = [f"**{entity}**"]
+        for field in fields:
+            value = record[field]
+            if isinstance(value, list):
+                lines.append(f"{FIELD_LABELS[field]}:\n" + "\n".join(f"- {item}" for item in value))
+            else:
+                lines.append(f"{FIELD_LABELS[field]}: {value}")
+        return {
+            'answer': "\n\n".join(lines),
+            'entity': entity,
+            'fields': fields,
+            'sources': [{'source': record['source'], 'type': 'fact', 'category': record.get('category')}],
+        }
+
+def check_facts(documents_dir=None):
+    """Run CHECK_QUESTIONS against a table built from the curated documents; returns the failures"""
+    documents_dir = Path(documents_dir or BASE_DIR / "raw_data" / "documents")
+    store = FactStore.build(sorted(documents_dir.glob("*.txt")))
+    failures = []
+    for question, expected in CHECK_QUESTIONS:
+        result = store.answer(question)
+        got = result['fields'][0] if result else None
+        if got != expected:
+            failures.append((question, expected, got))
+    return failures
+
+def build_facts(documents_dir=None, path=None):
+    """Extract facts from every raw_data/documents/*.txt and save facts.json"""
+    documents_dir = Path(documents_dir or BASE_DIR / "raw_data" / "documents")
+    store = FactStore.build(sorted(documents_dir.glob("*.txt")))
+    return store, store.save(path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the Marvel fact table")
+    parser.add_argument("command", choices=["build", "ask", "check"])
+    parser.add_argument("question", nargs="?", default=None)
+    args = parser.parse_args()
+    if args.command == "build":
+        store, path = build_facts()
+        print(f"✅ {len(store)} entities, {len(store.aliases)} aliases saved to {path}")
+    elif args.command == "check":
+        failures = check_facts()
+        for question, expected, got in failures:
+            print(f"❌ {question!r}: expected {expected}, got {got}")
+        if failures:
+            sys.exit(1)
+        print(f"✅ {len(CHECK_QUESTIONS)} questions routed as expected")
+    else:
+        store = FactStore.load()
+        if store is None:
+            print("❌ No fact table yet, run: python scripts/marvel_facts.py build")
+            sys.exit(1)
+        start = time.perf_counter()
+        result = store.answer(args.question or "")
+        elapsed = (time.perf_counter() - start) * 1000
+        if result:
+            print(result['answer'])
+            print(f"\n📚 {result['sources'][0]['source']} ({elapsed:.2f} ms)")
+        else:
+            print(f"No direct fact match ({elapsed:.2f} ms), this question needs full RAG")
@@ -0,0 +1,47 @@
+"""
+Fake embedding model for exercising the query layer without torch or bge-large
+
+Words are hashed into a fixed number of dimensions (feature hashing) and
+the vector is normalized, so texts sharing words are still close and
+retrieval returns plausible chunks. Each call sleeps for
+``latency + per_text_latency * len(texts)`` seconds to stand in for the
+model's compute time. Drop-in for HuggingFaceEmbeddings: embed_documents
+and embed_query.
+"""
+import re
+import time
+import hashlib
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+class FakeEmbeddings:
+    def __init__(self, dim=1024, latency=0.0, per_text_latency=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.calls = 0
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in TOKEN_RE.findall(text.lower()):
+            digest = hashlib.md5(token.encode('utf-8')).digest()
+            index = int.from_bytes(digest[:4], 'little') % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _sleep(self, count):
+        self.calls += 1
+        seconds = self.latency + self.per_text_latency * count
+        if seconds:
+            time.sleep(seconds)
+
+    def embed_documents(self, texts):
+        self._sleep(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self._sleep(1)
+        return self._vector(text)
@@ -0,0 +1,157 @@
+"""
+Fake Ollama server for exercising clients without a model
+
+Implements ``GET /``, ``GET /api/tags`` and ``POST /api/generate``
+(streaming and non-streaming). Each generation sleeps for
+``(latency + prefill * prompt_tokens / 1000) * max(1, active / capacity) ** overload_exponent``
+seconds, so
+the server slows down under load the way a saturated local Ollama does,
+and throughput drops when it is pushed far past capacity. Responses are
+deterministic for a given prompt.
+
+``model_latency`` gives each model its own idle latency, to stand in for a
+small and a large model, and ``unsure_rate`` makes a model answer a share
+of prompts with "I don't know" (for exercising escalation).
+
+Usage: python scripts/marvel_fake_ollama.py --port 11435 --capacity 4 --latency 0.2 \
+           --model llama3.2:3b=0.05 --model mistral:7b=0.3
+"""
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeOllamaState:
+    def __init__(self, latency=0.2, capacity=4, tokens=40, fail_rate=0.0, overload_exponent=1.5, prefill=0.0,
+                 model_latency=None, unsure_rate=None):
+        self.latency = latency
+        self.model_latency = model_latency or {}
+        self.unsure_rate = unsure_rate or {}
+        self.prefill = prefill
+        self.capacity = capacity
+        self.overload_exponent = overload_exponent
+        self.tokens = tokens
+        self.fail_rate = fail_rate
+        self.active = 0
+        self.peak_active = 0
+        self.requests = 0
+        self.abandoned = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.active += 1
+            self.requests += 1
+            self.peak_active = max(self.peak_active, self.active)
+            return self.active, self.requests
+
+    def leave(self):
+        with self._lock:
+            self.active -= 1
+
+    def models(self):
+        return sorted(set(self.model_latency) | {"mistral:7b", "llava:7b"})
+
+def fake_response(prompt, tokens):
+    """Deterministic pseudo-summary of a prompt"""
+    digest = hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+    words = [w for w in prompt.split() if w.isalpha()][:tokens] or ["marvel"]
+    return f"Summary {digest[:8]}: " + " ".join(words)
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/":
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == "/api/tags":
+            self._send_json({'models': [{'name': name} for name in self.state.models()]})
+        else:
+            self._send_json({'error': "not found"}, 404)
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._send_json({'error': "not found"}, 404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        state = self.state
+        active, count = state.enter()
+        try:
+            # Prefill grows with the prompt (about 4 characters per token), and
+            # everything slows down once more than `capacity` requests run
+            model = request.get('model')
+            prompt = request.get('prompt', '')
+            latency = state.model_latency.get(model, state.latency)
+            service = latency + state.prefill * len(prompt) / 4000
+            time.sleep(service * max(1.0, active / state.capacity) ** state.overload_exponent)
+            if state.fail_rate and (count * 7919) % 1000 < state.fail_rate * 1000:
+                self._send_json({'error': "model overloaded"}, 503)
+                return
+            text = fake_response(prompt, state.tokens)
+            unsure = state.unsure_rate.get(model, 0.0)
+            if unsure and int(hashlib.sha1(prompt.encode('utf-8')).hexdigest()[8:12], 16) % 1000 < unsure * 1000:
+                text = "I don't know."
+            if not request.get('stream', True):
+                self._send_json({'model': request.get('model'), 'response': text, 'done': True})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for word in text.split(" "):
+                line = json.dumps({'model': request.get('model'), 'response': word + " ", 'done': False})
+                self.wfile.write(line.encode('utf-8') + b"\n")
+            self.wfile.write(json.dumps({'model': request.get('model'), 'response': "", 'done': True}).encode('utf-8') + b"\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out; like Ollama, the generation time was spent anyway
+            state.abandoned += 1
+        finally:
+            state.leave()
+
+def start_fake_ollama(port=0, latency=0.2, capacity=4, tokens=40, fail_rate=0.0, prefill=0.0,
+                      model_latency=None, unsure_rate=None):
+    """Run the fake server in a background thread; returns (server, state, base_url)"""
+    state = FakeOllamaState(latency, capacity, tokens, fail_rate, prefill=prefill,
+                            model_latency=model_latency, unsure_rate=unsure_rate)
+    handler = type("BoundFakeOllamaHandler", (FakeOllamaHandler,), {'state': state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per generation when idle")
+    parser.add_argument("--capacity", type=int, default=4, help="concurrent requests before slowing down")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--prefill", type=float, default=0.0, help="extra seconds per 1000 prompt tokens")
+    parser.add_argument("--model", action="append", default=[], metavar="NAME=SECONDS",
+                        help="serve a model with its own idle latency (repeatable)")
+    args = parser.parse_args()
+    model_latency = {name: float(seconds) for name, seconds in (m.rsplit("=", 1) for m in args.model)}
+    server, state, url = start_fake_ollama(args.port, args.latency, args.capacity, fail_rate=args.fail_rate,
+                                           prefill=args.prefill, model_latency=model_latency)
+    print(f"🧪 Fake Ollama listening on {url} (latency {args.latency}s, capacity {args.capacity})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,278 @@
+"""
+Federated search over the per-file preprocessed vectorstores
+
+Every preprocessed document and audio file has its own Chroma store
+(``preprocessed_documents/<id>/vectorstore``,
+``preprocessed_audio/<id>/vectorstore``). FederatedSearch embeds a
+question once, queries every store concurrently with a bounded thread
+pool and merges the hits by distance.
+
+``consolidate`` copies the stored vectors (no re-embedding) of all those
+stores into one collection keyed by ``doc_id``, with ``file_id`` and
+``store_kind`` metadata. While it is fresh, a corpus-wide query is a single
+search of that collection. Stores added or changed since the last
+consolidation are still searched directly and merged in, until the next
+consolidation picks them up.
+
+Usage:
+    python marvel_vector_db/scripts/marvel_federated.py consolidate
+    python marvel_vector_db/scripts/marvel_federated.py search "Which files mention Thanos?"
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from marvel_metrics import metrics
+
+ROOT_DIR = Path(__file__).parent.parent.parent
+STORE_ROOTS = {
+    'document': ROOT_DIR / "preprocessed_documents",
+    'audio': ROOT_DIR / "preprocessed_audio",
+}
+CONSOLIDATED_DIR = ROOT_DIR / "preprocessed_index"
+CONSOLIDATED_COLLECTION = "marvel_preprocessed"
+MANIFEST_NAME = "consolidated.json"
+
+def _client(path):
+    import chromadb
+    return chromadb.PersistentClient(path=str(path))
+
+def _collection_names(client):
+    # chromadb >= 0.6 returns names, older versions return Collection objects
+    return [getattr(collection, 'name', collection) for collection in client.list_collections()]
+
+def store_fingerprint(path):
+    """Cheap change marker for a store: size and mtime of its SQLite file"""
+    sqlite_path = Path(path) / "chroma.sqlite3"
+    if not sqlite_path.exists():
+        return None
+    stat = sqlite_path.stat()
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+def discover_stores(roots=None):
+    """Every <root>/<file_id>/vectorstore, as {'key', 'kind', 'file_id', 'path', 'fingerprint'}"""
+    stores = []
+    for kind, root in (roots or STORE_ROOTS).items():
+        root = Path(root)
+        if not root.exists():
+            continue
+        for folder in sorted(p for p in root.iterdir() if p.is_dir() and not p.name.startswith('.')):
+            path = folder / "vectorstore"
+            fingerprint = store_fingerprint(path)
+            if fingerprint:
+                stores.append({
+                    'key': f"{kind}:{folder.name}",
+                    'kind': kind,
+                    'file_id': folder.name,
+                    'path': str(path),
+                    'fingerprint': fingerprint,
+                })
+    return stores
+
+def load_manifest(consolidated_dir=None):
+    path = Path(consolidated_dir or CONSOLIDATED_DIR) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+class FederatedSearch:
+    def __init__(self, embeddings, roots=None, consolidated_dir=None, max_workers=8):
+        self.embeddings = embeddings
+        self.roots = roots
+        self.consolidated_dir = Path(consolidated_dir or CONSOLIDATED_DIR)
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="federated")
+        # Opened collections per store key, so a store is opened once per process
+        self._collections = {}
+        self._consolidated = None
+
+    def _store_collections(self, store):
+        cached = self._collections.get(store['key'])
+        if cached and cached[0] == store['fingerprint']:
+            return cached[1]
+        client = _client(store['path'])
+        collections = [client.get_collection(name) for name in _collection_names(client)]
+        self._collections[store['key']] = (store['fingerprint'], collections)
+        return collections
+
+    def _consolidated_collection(self):
+        if self._consolidated is None:
+            client = _client(self.consolidated_dir)
+            self._consolidated = client.get_or_create_collection(CONSOLIDATED_COLLECTION)
+        return self._consolidated
+
+    def plan(self, kinds=None):
+        """Split stores into those served by the consolidated collection and those searched directly"""
+        stores = [s for s in discover_stores(self.roots) if not kinds or s['kind'] in kinds]
+        manifest = load_manifest(self.consolidated_dir)
+        consolidated = (manifest or {}).get('stores', {})
+        fresh = [s for s in stores if consolidated.get(s['key']) == s['fingerprint']]
+        direct = [s for s in stores if consolidated.get(s['key']) != s['fingerprint']]
+        return fresh, direct
+
+    @staticmethod
+    def _hits(result, extra=None):
+        hits = []
+        for text, metadata, distance in zip(result['documents'][0], result['metadatas'][0], result['distances'][0]):
+            metadata = dict(metadata or {})
+            metadata.update(extra or {})
+            hits.append((text, metadata, distance))
+        return hits
+
+    def _search_store(self, store, embedding, k):
+        hits = []
+        try:
+            for collection in self._store_collections(store):
+                n = min(k, collection.count())
+                if n == 0:
+                    continue
+                result = collection.query(query_embeddings=[embedding], n_results=n,
+                                          include=['documents', 'metadatas', 'distances'])
+                hits.extend(self._hits(result, {'file_id': store['file_id'], 'store_kind': store['kind']}))
+        except Exception as e:
+            # e.g. a store built with a different embedding size
+            print(f"   ⚠️  Skipping {store['key']}: {e}")
+        return hits
+
+    def _search_consolidated(self, fresh, embedding, k, all_fresh):
+        collection = self._consolidated_collection()
+        n = min(k, collection.count())
+        if n == 0:
+            return []
+        # Stale entries of changed stores are excluded; those stores are searched directly
+        where = None if all_fresh else {'store_key': {'$in': [s['key'] for s in fresh]}}
+        result = collection.query(query_embeddings=[embedding], n_results=n, where=where,
+                                  include=['documents', 'metadatas', 'distances'])
+        return self._hits(result)
+
+    def search_with_score(self, query, k=5, kinds=None, plan=None):
+        """Top-k (text, metadata, distance) over all stores, best first; plan is a (fresh, direct) from plan(kinds)"""
+        fresh, direct = plan or self.plan(kinds)
+        embedding = self.embeddings.embed_query(query)
+        all_fresh = not direct and not kinds
+        with metrics.span('federated_search', stores=len(direct), consolidated=len(fresh)):
+            futures = [self._pool.submit(self._search_store, store, embedding, k) for store in direct]
+            hits = self._search_consolidated(fresh, embedding, k, all_fresh) if fresh else []
+            for future in futures:
+                hits.extend(future.result())
+        hits.sort(key=lambda hit: hit[2])
+        return hits[:k]
+
+    def search(self, query, k=5, kinds=None, plan=None):
+        """Top-k hits as LangChain Documents with file_id/store_kind metadata"""
+        from langchain.schema.document import Document
+        return [Document(page_content=text, metadata=metadata)
+                for text, metadata, _ in self.search_with_score(query, k, kinds, plan)]
+
+    def search_files(self, query, k=5, chunks=30, kinds=None, plan=None):
+        """Files ranked by their best-matching chunk: [{'file_id', 'kind', 'distance', 'hits', 'snippet'}]"""
+        files = {}
+        for text, metadata, distance in self.search_with_score(query, chunks, kinds, plan):
+            key = (metadata['store_kind'], metadata['file_id'])
+            entry = files.setdefault(key, {
+                'file_id': metadata['file_id'], 'kind': metadata['store_kind'],
+                'distance': distance, 'hits': 0, 'snippet': text[:300],
+            })
+            entry['hits'] += 1
+        return sorted(files.values(), key=lambda entry: entry['distance'])[:k]
+
+def consolidate(roots=None, consolidated_dir=None, rebuild=False, batch_size=500):
+    """Copy every per-file store into the consolidated collection; only changed stores are re-copied"""
+    consolidated_dir = Path(consolidated_dir or CONSOLIDATED_DIR)
+    consolidated_dir.mkdir(parents=True, exist_ok=True)
+    client = _client(consolidated_dir)
+    if rebuild and CONSOLIDATED_COLLECTION in _collection_names(client):
+        client.delete_collection(CONSOLIDATED_COLLECTION)
+    target = client.get_or_create_collection(CONSOLIDATED_COLLECTION)
+
+    manifest = (None if rebuild else load_manifest(consolidated_dir)) or {'stores': {}}
+    stores = discover_stores(roots)
+    current = {store['key'] for store in stores}
+    stats = {'stores': len(stores), 'copied_stores': 0, 'chunks': 0, 'removed_stores': 0}
+
+    # Files whose folder is gone
+    for key in [key for key in manifest['stores'] if key not in current]:
+        target.delete(where={'store_key': key})
+        del manifest['stores'][key]
+        stats['removed_stores'] += 1
+
+    for store in stores:
+        if manifest['stores'].get(store['key']) == store['fingerprint']:
+            continue
+        target.delete(where={'store_key': store['key']})
+        source_client = _client(store['path'])
+        copied = 0
+        for name in _collection_names(source_client):
+            collection = source_client.get_collection(name)
+            for offset in range(0, collection.count(), batch_size):
+                batch = collection.get(include=['embeddings', 'documents', 'metadatas'],
+                                       limit=batch_size, offset=offset)
+                ids, metadatas = [], []
+                for chunk_id, metadata in zip(batch['ids'], batch['metadatas']):
+                    metadata = dict(metadata or {})
+                    # doc_id links a summary to its original chunk; fall back to the chunk id
+                    doc_id = str(metadata.get('doc_id') or chunk_id)
+                    ids.append(f"{store['key']}:{doc_id}")
+                    metadata.update({'doc_id': doc_id, 'file_id': store['file_id'],
+                                     'store_kind': store['kind'], 'store_key': store['key']})
+                    metadatas.append(metadata)
+                if ids:
+                    target.upsert(ids=ids, embeddings=batch['embeddings'], documents=batch['documents'],
+                                  metadatas=metadatas)
+                copied += len(ids)
+        manifest['stores'][store['key']] = store['fingerprint']
+        stats['copied_stores'] += 1
+        stats['chunks'] += copied
+        print(f"   ✅ {store['key']}: {copied} chunks")
+
+    manifest['updated_at'] = time.time()
+    tmp_path = consolidated_dir / (MANIFEST_NAME + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, consolidated_dir / MANIFEST_NAME)
+    stats['total_chunks'] = target.count()
+    return stats
+
+def _load_embeddings():
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from marvel_warm_start import resolve_model_path
+    from marvel_model_host import connect_model_host
+    # Same settings as the Streamlit app, which queries these stores
+    return connect_model_host(normalize=False) or HuggingFaceEmbeddings(
+        model_name=resolve_model_path(), model_kwargs={"device": "cpu"},
+        encode_kwargs={"normalize_embeddings": False})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search or consolidate the per-file preprocessed vectorstores")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    consolidate_parser = subparsers.add_parser("consolidate", help="merge all per-file stores into one collection")
+    consolidate_parser.add_argument("--rebuild", action="store_true", help="drop and re-copy everything")
+    search_parser = subparsers.add_parser("search", help="search every per-file store")
+    search_parser.add_argument("query")
+    search_parser.add_argument("-k", type=int, default=5)
+    search_parser.add_argument("--kind", choices=list(STORE_ROOTS), action="append", default=None)
+    search_parser.add_argument("--workers", type=int, default=8, help="stores searched concurrently")
+    args = parser.parse_args()
+
+    if args.command == "consolidate":
+        print("🔄 Consolidating per-file vectorstores")
+        stats = consolidate(rebuild=args.rebuild)
+        print(f"✅ {stats['copied_stores']} of {stats['stores']} stores copied ({stats['chunks']} chunks), "
+              f"{stats['removed_stores']} removed, {stats['total_chunks']} chunks in total")
+    else:
+        federated = FederatedSearch(_load_embeddings(), max_workers=args.workers)
+        fresh, direct = federated.plan(args.kind)
+        print(f"🔍 {args.query} ({len(fresh)} stores consolidated, {len(direct)} searched directly)")
+        start = time.perf_counter()
+        files = federated.search_files(args.query, k=args.k, kinds=args.kind, plan=(fresh, direct))
+        print(f"   {(time.perf_counter() - start) * 1000:.0f} ms")
+        for i, entry in enumerate(files, 1):
+            print(f"   {i}. [{entry['kind']}] {entry['file_id']} (distance {entry['distance']:.3f}, {entry['hits']} hits)")
+            print(f"      {entry['snippet'][:150]}")
@@ -0,0 +1,246 @@
+"""
+Lightweight tracing and metrics for the Marvel ingestion and query paths
+
+Stages are timed with ``metrics.span("embed")`` and counted with
+``metrics.incr("chunks", n)``. Everything is a no-op until metrics are
+enabled, either with ``MARVEL_METRICS=1`` or ``metrics.enable()``.
+"""
+import os
+import json
+import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stage names used across ingestion and query
+STAGES = [
+    'file_read',
+    'chunk',
+    'embed',
+    'upsert',
+    'search',
+    'prompt_build',
+    'llm_first_token',
+    'llm_total',
+]
+
+class _NullSpan:
+    """Shared do-nothing span used while metrics are disabled"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    """Timed span that reports its duration to the registry on exit"""
+    def __init__(self, registry, name, attrs):
+        self.registry = registry
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.registry.observe(self.name, elapsed, **self.attrs)
+        return False
+
+    def set(self, **attrs):
+        """Attach extra attributes (e.g. a chunk count) to the span"""
+        self.attrs.update(attrs)
+
+class MarvelMetrics:
+    def __init__(self, enabled=False, max_samples=2048, jsonl_path=None):
+        self.enabled = enabled
+        self.max_samples = max_samples
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._totals = {}
+        self._counters = {}
+        self._jsonl_file = None
+        self._server = None
+
+    def enable(self, jsonl_path=None):
+        """Turn on collection, optionally streaming events to a JSON lines file"""
+        self.enabled = True
+        if jsonl_path:
+            self.jsonl_path = str(jsonl_path)
+        return self
+
+    def disable(self):
+        """Turn off collection and close the JSON lines file"""
+        self.enabled = False
+        with self._lock:
+            if self._jsonl_file:
+                self._jsonl_file.close()
+                self._jsonl_file = None
+
+    def reset(self):
+        """Forget all recorded samples and counters"""
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+            self._counters.clear()
+
+    def span(self, name, **attrs):
+        """Time a block of code under the given stage name"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, attrs)
+
+    def observe(self, name, seconds, **attrs):
+        """Record a duration for a stage"""
+        if not self.enabled:
+            return
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.max_samples)
+            samples.append(seconds)
+            count, total = self._totals.get(name, (0, 0.0))
+            self._totals[name] = (count + 1, total + seconds)
+            self._write_event({'type': 'span', 'name': name, 'seconds': round(seconds, 6), **attrs})
+
+    def incr(self, name, value=1):
+        """Increment a counter"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def _write_event(self, event):
+        """Append one event to the JSON lines file (caller holds the lock)"""
+        if not self.jsonl_path:
+            return
+        if self._jsonl_file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.jsonl_path)), exist_ok=True)
+            self._jsonl_file = open(self.jsonl_path, 'a', encoding='utf-8')
+        event['ts'] = time.time()
+        event['pid'] = os.getpid()
+        self._jsonl_file.write(json.dumps(event) + "\n")
+        self._jsonl_file.flush()
+
+    def percentiles(self, name, quantiles=(0.5, 0.95, 0.99)):
+        """Return {quantile: seconds} over the recent samples of a stage"""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if not samples:
+            return {}
+        result = {}
+        for q in quantiles:
+            index = min(len(samples) - 1, int(round(q * (len(samples) - 1))))
+            result[q] = samples[index]
+        return result
+
+    def snapshot(self):
+        """Return a JSON-serialisable summary of all stages and counters"""
+        with self._lock:
+            names = list(self._samples)
+            totals = dict(self._totals)
+            counters = dict(self._counters)
+        stages = {}
+        for name in names:
+            count, total = totals.get(name, (0, 0.0))
+            pct = self.percentiles(name)
+            stages[name] = {
+                'count': count,
+                'total_seconds': round(total, 6),
+                'p50': pct.get(0.5, 0.0),
+                'p95': pct.get(0.95, 0.0),
+                'p99': pct.get(0.99, 0.0),
+            }
+        return {'stages': stages, 'counters': counters}
+
+    def write_snapshot(self, path):
+        """Write the current snapshot to a JSON file"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        return path
+
+    def to_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP marvel_stage_seconds Time spent per pipeline stage",
+            "# TYPE marvel_stage_seconds summary",
+        ]
+        for name, stats in sorted(snapshot['stages'].items()):
+            for q, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                value = stats[key]
+                lines.append(f'marvel_stage_seconds{{stage="{name}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'marvel_stage_seconds_sum{{stage="{name}"}} {stats["total_seconds"]:.6f}')
+            lines.append(f'marvel_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+        lines.append("# HELP marvel_events_total Event counters")
+        lines.append("# TYPE marvel_events_total counter")
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f'marvel_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port=9464, host=None):
+        """Expose /metrics on a background HTTP server (loopback unless MARVEL_METRICS_HOST says otherwise)"""
+        if self._server is not None:
+            return self._server
+        host = host or os.environ.get('MARVEL_METRICS_HOST') or "127.0.0.1"
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+        return self._server
+
+class InstrumentedEmbeddings:
+    """Wrap an embeddings object so every call is timed as the 'embed' stage"""
+    def __init__(self, embeddings, registry=None):
+        self.embeddings = embeddings
+        self.registry = registry or metrics
+
+    def embed_documents(self, texts):
+        with self.registry.span('embed', items=len(texts)):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        with self.registry.span('embed', items=1):
+            return self.embeddings.embed_query(text)
+
+    def __getattr__(self, name):
+        return getattr(self.embeddings, name)
+
+def configure_from_env(registry=None):
+    """Enable metrics from MARVEL_METRICS / MARVEL_METRICS_JSONL / MARVEL_METRICS_PORT / MARVEL_METRICS_HOST"""
+    registry = registry or metrics
+    if os.environ.get('MARVEL_METRICS', '').lower() in ('1', 'true', 'yes'):
+        registry.enable(os.environ.get('MARVEL_METRICS_JSONL'))
+        port = os.environ.get('MARVEL_METRICS_PORT')
+        if port:
+            registry.serve_prometheus(int(port))
+    return registry
+
+# Process-wide registry
+metrics = configure_from_env(MarvelMetrics())
@@ -0,0 +1,385 @@
+"""
+Embedding model host shared by every Marvel process on a machine
+
+Each Streamlit server, ingestion worker and query CLI used to load its own
+copy of bge-large (about 1.3 GB resident). The model host loads it once
+and serves embeddings over a local socket: a Unix socket, or 127.0.0.1
+where Unix sockets are not available. RemoteEmbeddings is a drop-in for
+HuggingFaceEmbeddings, so resident memory stays about the same as more
+processes are started.
+
+- Requests from all clients share one queue. The model thread drains it
+  in batches of up to ``max_batch`` texts, so concurrent questions cost
+  one forward pass.
+- The socket is bound before the model loads. A second host started by
+  another process exits right away, and clients wait until the host
+  reports it is ready.
+- connect_model_host() returns RemoteEmbeddings when a host is running
+  (or starts one with ``autostart=True``). It returns None otherwise, and
+  the caller loads the model itself as before.
+
+A host started in the background keeps the model resident until it is
+stopped; start_model_host() callers that own it should call
+stop_model_host() when they are done.
+
+Usage:
+    python scripts/marvel_model_host.py serve [--address PATH] [--device cpu]
+    python scripts/marvel_model_host.py status
+    python scripts/marvel_model_host.py stop
+"""
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import struct
+import getpass
+import argparse
+import tempfile
+import threading
+import subprocess
+import socketserver
+
+import numpy as np
+
+from marvel_warm_start import resolve_model_path, SNAPSHOT_DIR
+from marvel_profiling import current_rss_mb
+
+HEADER = struct.Struct("!I")
+TCP_PREFIX = "tcp://"
+
+def default_address():
+    """MARVEL_MODEL_HOST, else a per-user Unix socket in the temp dir (127.0.0.1:8765 on Windows)"""
+    address = os.environ.get("MARVEL_MODEL_HOST")
+    if address:
+        return address
+    if hasattr(socket, 'AF_UNIX'):
+        return os.path.join(tempfile.gettempdir(), f"marvel-model-host-{getpass.getuser()}.sock")
+    return f"{TCP_PREFIX}127.0.0.1:8765"
+
+def _tcp_address(address):
+    host, port = address[len(TCP_PREFIX):].rsplit(":", 1)
+    return host, int(port)
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("model host closed the connection")
+        data.extend(chunk)
+    return bytes(data)
+
+def send_message(sock, header, payload=b""):
+    """Length-prefixed JSON header followed by an optional binary payload"""
+    header = json.dumps({**header, 'payload': len(payload)}).encode('utf-8')
+    sock.sendall(HEADER.pack(len(header)) + header + payload)
+
+def recv_message(sock):
+    (length,) = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    header = json.loads(_recv_exact(sock, length))
+    payload = _recv_exact(sock, header['payload']) if header['payload'] else b""
+    return header, payload
+
+class _Request:
+    def __init__(self, texts, normalize):
+        self.texts = texts
+        self.normalize = normalize
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+class ModelHost:
+    def __init__(self, model_name=None, device=None, max_batch=64, max_wait_ms=5):
+        self.model_name = model_name or resolve_model_path()
+        self.device = device
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_ms / 1000
+        self.model = None
+        self.load_error = None
+        self.ready = threading.Event()
+        self._queue = queue.Queue()
+        self.stats = {'requests': 0, 'texts': 0, 'batches': 0, 'connections': 0}
+
+    def load(self):
+        """Load the model once; every client shares these weights"""
+        try:
+            if os.path.isdir(self.model_name):
+                os.environ.setdefault("HF_HUB_OFFLINE", "1")
+            import torch
+            from sentence_transformers import SentenceTransformer
+            device = self.device or ("cuda" if torch.cuda.is_available() else "cpu")
+            self.model = SentenceTransformer(self.model_name, device=device)
+            self.model.encode(["warm up"])
+            print(f"   ✅ {self.model_name} loaded on {device}")
+        except Exception as e:
+            self.load_error = e
+            print(f"   ❌ Could not load {self.model_name}: {e}")
+        finally:
+            self.ready.set()
+
+    def embed(self, texts, normalize=True):
+        """Embed through the shared batch queue; returns a float32 array"""
+        request = _Request(texts, normalize)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next_batch(self):
+        """First queued request plus whatever arrives within max_wait_s, up to max_batch texts"""
+        batch = [self._queue.get()]
+        size = len(batch[0].texts)
+        deadline = time.monotonic() + self.max_wait_s
+        while size < self.max_batch:
+            try:
+                request = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def run_model(self):
+        """Model thread: encode queued requests in batches"""
+        self.ready.wait()
+        while True:
+            batch = self._next_batch()
+            if self.load_error is not None:
+                for request in batch:
+                    request.error = RuntimeError(f"model host could not load the model: {self.load_error}")
+                    request.done.set()
+                continue
+            for normalize in (True, False):
+                group = [request for request in batch if request.normalize == normalize]
+                if not group:
+                    continue
+                # Same preprocessing as HuggingFaceEmbeddings.embed_documents
+                texts = [text.replace("\n", " ") for request in group for text in request.texts]
+                try:
+                    vectors = np.asarray(self.model.encode(texts, normalize_embeddings=normalize),
+                                         dtype=np.float32)
+                except Exception as e:
+                    for request in group:
+                        request.error = e
+                        request.done.set()
+                    continue
+                start = 0
+                for request in group:
+                    request.result = vectors[start:start + len(request.texts)]
+                    start += len(request.texts)
+                    request.done.set()
+            self.stats['batches'] += 1
+
+    def status(self):
+        return {'ready': self.ready.is_set() and self.load_error is None, 'model': self.model_name,
+                'error': str(self.load_error) if self.load_error is not None else None,
+                'pid': os.getpid(), 'rss_mb': current_rss_mb(), **self.stats}
+
+    def serve(self, address=None):
+        """Bind the socket, load the model and serve until interrupted"""
+        address = address or default_address()
+        host = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                host.stats['connections'] += 1
+                while True:
+                    try:
+                        header, _ = recv_message(self.request)
+                    except (ConnectionError, OSError):
+                        return
+                    if header.get('op') == 'status':
+                        send_message(self.request, host.status())
+                        continue
+                    if header.get('op') == 'stop':
+                        send_message(self.request, {'stopping': True, 'pid': os.getpid()})
+                        print("🛑 Stop requested, shutting down")
+                        # Handlers run on their own threads, so this can wait for serve_forever to return
+                        self.server.shutdown()
+                        return
+                    try:
+                        vectors = host.embed(header['texts'], header.get('normalize', True))
+                        host.stats['requests'] += 1
+                        host.stats['texts'] += len(header['texts'])
+                        send_message(self.request, {'shape': list(vectors.shape)}, vectors.tobytes())
+                    except Exception as e:
+                        send_message(self.request, {'error': str(e)})
+
+        if address.startswith(TCP_PREFIX):
+            server_class, bind_to = socketserver.ThreadingTCPServer, _tcp_address(address)
+        else:
+            server_class, bind_to = socketserver.ThreadingUnixStreamServer, address
+            if os.path.exists(address):
+                if RemoteEmbeddings(address).status() is not None:
+                    print(f"   ℹ️  A model host is already serving {address}")
+                    return False
+                os.unlink(address)  # left behind by a host that died
+        server = server_class(bind_to, Handler, bind_and_activate=False)
+        server.daemon_threads = True
+        try:
+            server.server_bind()
+            server.server_activate()
+        except OSError as e:
+            server.server_close()
+            print(f"   ℹ️  Could not bind {address} ({e}); another model host is probably running")
+            return False
+
+        print(f"🧠 Model host listening on {address} (pid {os.getpid()})")
+        threading.Thread(target=self.load, name="model-load", daemon=True).start()
+        threading.Thread(target=self.run_model, name="model", daemon=True).start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if not address.startswith(TCP_PREFIX) and os.path.exists(address):
+                os.unlink(address)
+        return True
+
+class RemoteEmbeddings:
+    """Embeddings computed by the model host; one connection per thread"""
+    def __init__(self, address=None, normalize=True, timeout=120, max_batch=64):
+        self.address = address or default_address()
+        self.normalize = normalize
+        # Per request: large inputs are sent in max_batch pieces so each finishes well within it
+        self.timeout = timeout
+        self.max_batch = max_batch
+        self._local = threading.local()
+
+    def _connect(self):
+        if self.address.startswith(TCP_PREFIX):
+            sock = socket.create_connection(_tcp_address(self.address), timeout=self.timeout)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+        return sock
+
+    def _request(self, header):
+        # Reconnect once if the host restarted since the last call. A request the host may be
+        # working on (e.g. one that timed out) is not sent again, or the host would encode it twice
+        for attempt in (0, 1):
+            sock = getattr(self._local, 'sock', None)
+            reused, sent = sock is not None, False
+            try:
+                if sock is None:
+                    sock = self._local.sock = self._connect()
+                send_message(sock, header)
+                sent = True
+                return recv_message(sock)
+            except (ConnectionError, OSError) as e:
+                self._local.sock = None
+                if sock is not None:
+                    sock.close()
+                # Retry a failed connect or send, or an old connection the host closed (restarted)
+                stale = reused and isinstance(e, ConnectionError)
+                if attempt or (sent and not stale):
+                    raise
+
+    def status(self):
+        """Host status, or None when no host is reachable"""
+        try:
+            header, _ = self._request({'op': 'status'})
+            return header
+        except (ConnectionError, OSError):
+            return None
+
+    def stop(self):
+        """Ask the host to shut down; returns its pid, or None when no host is reachable"""
+        try:
+            header, _ = self._request({'op': 'stop'})
+            return header.get('pid')
+        except (ConnectionError, OSError):
+            return None
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = []
+        for start in range(0, len(texts), self.max_batch):
+            batch = texts[start:start + self.max_batch]
+            header, payload = self._request({'op': 'embed', 'texts': batch, 'normalize': self.normalize})
+            if 'error' in header:
+                raise RuntimeError(f"model host: {header['error']}")
+            vectors.extend(np.frombuffer(payload, dtype=np.float32).reshape(header['shape']).tolist())
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def start_model_host(address=None, device=None, timeout=600):
+    """Start a model host in the background and wait until its model is loaded"""
+    address = address or default_address()
+    cmd = [sys.executable, os.path.abspath(__file__), "serve", "--address", address]
+    if device:
+        cmd += ["--device", device]
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    log = open(SNAPSHOT_DIR / "model_host.log", 'a', encoding='utf-8')
+    # Detached, so the host outlives the process that started it and serves the next ones
+    kwargs = {'start_new_session': True} if os.name != 'nt' else {
+        'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, **kwargs)
+    return wait_for_host(address, timeout)
+
+def wait_for_host(address=None, timeout=600):
+    """Status of the host once it is ready, or None on timeout or load failure"""
+    client = RemoteEmbeddings(address)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.status()
+        if status and status['ready']:
+            return status
+        if status and status.get('error'):
+            print(f"   ⚠️  Model host could not load the model: {status['error']}")
+            return None
+        time.sleep(0.5)
+    return None
+
+def stop_model_host(address=None, timeout=10):
+    """Stop a running host and wait for its socket to close; True if one was stopped"""
+    client = RemoteEmbeddings(address)
+    pid = client.stop()
+    if pid is None:
+        return False
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and RemoteEmbeddings(address).status() is not None:
+        time.sleep(0.2)
+    print(f"   🛑 Stopped the model host (pid {pid})")
+    return True
+
+def connect_model_host(normalize=True, address=None, autostart=False, device=None):
+    """RemoteEmbeddings if a model host is (or, with autostart, can be) running, else None"""
+    client = RemoteEmbeddings(address, normalize=normalize)
+    status = client.status()
+    if status is None and autostart:
+        print("   🧠 Starting the shared model host...")
+        status = start_model_host(client.address, device)
+    elif status is not None and not status['ready']:
+        status = wait_for_host(client.address)
+    if not status or not status['ready']:
+        return None
+    print(f"   ✅ Using the shared model host at {client.address} (pid {status['pid']})")
+    return client
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the embedding model to every Marvel process")
+    parser.add_argument("command", choices=["serve", "status", "stop"])
+    parser.add_argument("--address", default=None, help=f"socket path or tcp://host:port (default {default_address()})")
+    parser.add_argument("--device", default=None, help="cpu or cuda (default: cuda when available)")
+    parser.add_argument("--max-batch", type=int, default=64)
+    args = parser.parse_args()
+    if args.command == "serve":
+        ModelHost(device=args.device, max_batch=args.max_batch).serve(args.address)
+    elif args.command == "stop":
+        if not stop_model_host(args.address):
+            print(f"❌ No model host at {args.address or default_address()}")
+            sys.exit(1)
+    else:
+        status = RemoteEmbeddings(args.address).status()
+        if status is None:
+            print(f"❌ No model host at {args.address or default_address()}")
+            sys.exit(1)
+        print(json.dumps(status, indent=2))
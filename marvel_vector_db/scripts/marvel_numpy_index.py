@@ -0,0 +1,227 @@
+"""
+Exact in-memory vector index for the Marvel collection
+
+All normalized embeddings from ``marvel_knowledge_base`` are copied into
+one contiguous float32 (or float16) ``.npy`` file that is memory-mapped
+at query time. Top-k is a matrix product plus ``argpartition``, and many
+queries can be answered in one batch. The index stores a version stamp of
+the Chroma collection it was built from and is rebuilt when that changes.
+Image payloads (``image_b64``) are not copied into the records; hits keep
+an ``image_id`` and fetch_image() reads the image from Chroma on demand.
+"""
+import sys
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from marvel_metrics import metrics
+from marvel_retrieval import normalize_filters, collection_version
+
+VECTORS_FILE = "vectors.npy"
+RECORDS_FILE = "records.json"
+META_FILE = "index_meta.json"
+
+class NumpyVectorIndex:
+    def __init__(self, index_dir, vectors, records, meta):
+        self.index_dir = Path(index_dir)
+        self.vectors = vectors
+        self.records = records
+        self.meta = meta
+        self.version = meta.get('version')
+        self.embeddings = None
+        # Chroma collection, for image payloads that are not kept in the records
+        self.collection = None
+        self._field_rows = self._build_field_rows()
+
+    @classmethod
+    def build(cls, collection, persist_directory, index_dir, dtype='float32', page_size=5000):
+        """Copy every embedding from the collection into a memory-mappable array"""
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        version = collection_version(collection, persist_directory)
+        total = collection.count()
+
+        records = []
+        vectors = None
+        offset = 0
+        while offset < total:
+            batch = collection.get(include=['embeddings', 'documents', 'metadatas'],
+                                   limit=page_size, offset=offset)
+            ids = batch.get('ids') or []
+            if not ids:
+                break
+            block = np.asarray(batch['embeddings'], dtype=np.float32)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(
+                    index_dir / VECTORS_FILE, mode='w+', dtype=dtype, shape=(total, block.shape[1])
+                )
+            # Normalize defensively so dot product == cosine similarity
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors[offset:offset + len(ids)] = (block / norms).astype(dtype)
+            for doc_id, text, metadata in zip(ids, batch['documents'], batch['metadatas']):
+                metadata = dict(metadata or {})
+                # Every query process loads the records; base64 images would dwarf the texts
+                if metadata.pop('image_b64', None) is not None:
+                    metadata['image_id'] = doc_id
+                records.append({'id': doc_id, 'text': text, 'metadata': metadata})
+            offset += len(ids)
+
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(index_dir / VECTORS_FILE, mode='w+', dtype=dtype, shape=(0, 1))
+        vectors.flush()
+        del vectors
+
+        with open(index_dir / RECORDS_FILE, 'w', encoding='utf-8') as f:
+            json.dump(records, f)
+        meta = {
+            'version': version,
+            'count': len(records),
+            'dtype': dtype,
+            'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'build_seconds': round(time.perf_counter() - start, 3),
+        }
+        with open(index_dir / META_FILE, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        print(f"   🧮 Built exact index: {len(records)} vectors ({dtype}) in {meta['build_seconds']}s")
+        return cls.load(index_dir)
+
+    @classmethod
+    def load(cls, index_dir):
+        """Memory-map a previously built index (None if it doesn't exist)"""
+        index_dir = Path(index_dir)
+        if not (index_dir / META_FILE).exists():
+            return None
+        with open(index_dir / META_FILE, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        vectors = np.load(index_dir / VECTORS_FILE, mmap_mode='r')
+        with open(index_dir / RECORDS_FILE, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        return cls(index_dir, vectors, records, meta)
+
+    @classmethod
+    def open_or_build(cls, vectorstore, persist_directory, index_dir=None, dtype='float32'):
+        """Load the index, rebuilding it if the Chroma collection changed since the last build"""
+        index_dir = Path(index_dir) if index_dir else Path(persist_directory) / "numpy_index"
+        collection = vectorstore._collection
+        index = cls.load(index_dir)
+        current = collection_version(collection, persist_directory)
+        if index is None or index.version != current or index.meta.get('dtype') != dtype:
+            index = cls.build(collection, persist_directory, index_dir, dtype=dtype)
+        index.embeddings = vectorstore.embeddings
+        index.collection = collection
+        return index
+
+    def is_stale(self, collection, persist_directory):
+        """True if the Chroma collection changed since this index was built"""
+        return collection_version(collection, persist_directory) != self.version
+
+    def records_bytes(self):
+        """Approximate resident size of the records (texts, metadata and their containers)"""
+        def size(value):
+            if isinstance(value, dict):
+                return sys.getsizeof(value) + sum(size(k) + size(v) for k, v in value.items())
+            if isinstance(value, list):
+                return sys.getsizeof(value) + sum(size(item) for item in value)
+            return sys.getsizeof(value)
+        return size(self.records)
+
+    def _build_field_rows(self):
+        """field -> value -> row indices, for metadata filters"""
+        field_rows = {}
+        for row, record in enumerate(self.records):
+            for field, value in record['metadata'].items():
+                if isinstance(value, (str, int, float, bool)) and field not in ('image_b64', 'image_id'):
+                    field_rows.setdefault(field, {}).setdefault(value, []).append(row)
+        return {
+            field: {value: np.asarray(rows, dtype=np.int64) for value, rows in values.items()}
+            for field, values in field_rows.items()
+        }
+
+    def _candidate_rows(self, filters):
+        """Row indices matching all filters (None if there are no filters)"""
+        rows = None
+        for field, values in normalize_filters(filters).items():
+            field_index = self._field_rows.get(field, {})
+            matched = [field_index[v] for v in values if v in field_index]
+            matched = np.unique(np.concatenate(matched)) if matched else np.empty(0, dtype=np.int64)
+            rows = matched if rows is None else np.intersect1d(rows, matched)
+        return rows
+
+    def search_vectors(self, query_vectors, k=5, filters=None, block_size=65536):
+        """Top-k (row, cosine) per query for a batch of query vectors"""
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        queries = queries / norms
+
+        rows = self._candidate_rows(filters)
+        if rows is not None:
+            if len(rows) == 0:
+                return [[] for _ in queries]
+            scores = np.asarray(self.vectors[rows], dtype=np.float32) @ queries.T
+            return [self._top_k(scores[:, q], k, rows) for q in range(len(queries))]
+
+        total = self.vectors.shape[0]
+        if total <= block_size:
+            scores = np.asarray(self.vectors, dtype=np.float32) @ queries.T
+            return [self._top_k(scores[:, q], k) for q in range(len(queries))]
+
+        # Large indexes are scanned in blocks, keeping a running top-k per query
+        best = [[] for _ in queries]
+        for start in range(0, total, block_size):
+            block = np.asarray(self.vectors[start:start + block_size], dtype=np.float32)
+            scores = block @ queries.T
+            for q in range(len(queries)):
+                hits = self._top_k(scores[:, q], k, offset=start)
+                best[q] = sorted(best[q] + hits, key=lambda hit: -hit[1])[:k]
+        return best
+
+    def _top_k(self, scores, k, rows=None, offset=0):
+        """argpartition then sort only the k survivors"""
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if rows is not None:
+            return [(int(rows[i]), float(scores[i])) for i in top]
+        return [(int(i) + offset, float(scores[i])) for i in top]
+
+    def _to_documents(self, hits):
+        # Imported on first use so mapping the index at fast start does not load langchain
+        from langchain.schema.document import Document
+        # Distances match Chroma's squared L2 on unit vectors: 2 - 2 * cosine
+        return [
+            (Document(page_content=self.records[row]['text'], metadata=self.records[row]['metadata']),
+             2.0 - 2.0 * score)
+            for row, score in hits
+        ]
+
+    def fetch_image(self, document):
+        """base64 image of an image hit, read from Chroma by id (None for text hits)"""
+        image_id = document.metadata.get('image_id')
+        if image_id is None or self.collection is None:
+            return document.metadata.get('image_b64')
+        metadatas = self.collection.get(ids=[image_id], include=['metadatas']).get('metadatas') or [None]
+        return (metadatas[0] or {}).get('image_b64')
+
+    def similarity_search_with_score(self, query, k=5, filters=None):
+        """Chroma-compatible search returning [(Document, distance)]"""
+        with metrics.span('numpy_search', k=k):
+            query_vector = self.embeddings.embed_query(query)
+            hits = self.search_vectors([query_vector], k=k, filters=filters)[0]
+        return self._to_documents(hits)
+
+    def similarity_search(self, query, k=5, filters=None):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filters)]
+
+    def batch_search(self, queries, k=5, filters=None):
+        """Answer many queries with one embedding call and one matrix product"""
+        with metrics.span('numpy_batch_search', queries=len(queries), k=k):
+            query_vectors = self.embeddings.embed_documents(list(queries))
+            results = self.search_vectors(query_vectors, k=k, filters=filters)
+        return [self._to_documents(hits) for hits in results]
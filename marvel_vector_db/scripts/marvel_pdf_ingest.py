@@ -0,0 +1,293 @@
+"""
+Parallel PDF ingestion into the Marvel vector database
+
+PDFs under raw_data/pdfs are partitioned with unstructured's
+``partition_pdf`` (by_title chunking, same settings as the notebook's
+DocumentProcessor.process_pdf) in a process pool, since partitioning and
+OCR are CPU-bound. Large PDFs are split into page ranges that are
+partitioned independently.
+
+Each (file hash, page range) result is cached as JSON under
+processed_data/pdf_cache, so re-runs only partition new or changed files.
+Results stream into the vectorstore as ranges finish, and the ranges
+already written are recorded next to the vectorstore so re-runs do not
+embed them again (``--rewrite`` writes every range anyway). At most
+``max_in_flight`` ranges are pending at once, which keeps memory bounded
+for PDFs with thousands of pages.
+
+Usage: python scripts/marvel_pdf_ingest.py [PDF_OR_DIR ...] [--workers 4] [--pages-per-task 25] [--rewrite]
+"""
+import os
+import sys
+import json
+import uuid
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from marvel_metrics import metrics
+
+BASE_DIR = Path(__file__).parent.parent
+WRITTEN_NAME = "pdf_ranges_written.json"
+# Bump when the partition settings change so cached ranges are re-partitioned
+PARTITION_VERSION = 1
+PARTITION_KWARGS = {
+    'chunking_strategy': "by_title",
+    'max_characters': 4000,
+    'infer_table_structure': True,
+    'extract_image_block_types': ["Image"],
+    'extract_image_block_to_payload': True,
+}
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def pdf_page_count(path):
+    """Number of pages, or None if pypdf is not installed"""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+    return len(PdfReader(str(path)).pages)
+
+def page_ranges(page_count, pages_per_task=25, split_threshold=50):
+    """1-based inclusive page ranges; small or uncounted PDFs are one range"""
+    if not page_count or page_count <= split_threshold:
+        return [(1, page_count or 0)]
+    return [(start, min(start + pages_per_task - 1, page_count))
+            for start in range(1, page_count + 1, pages_per_task)]
+
+def _write_page_range(pdf_path, start, end, output_path):
+    from pypdf import PdfReader, PdfWriter
+    reader = PdfReader(str(pdf_path))
+    writer = PdfWriter()
+    for page in range(start - 1, end):
+        writer.add_page(reader.pages[page])
+    with open(output_path, 'wb') as f:
+        writer.write(f)
+
+def _element_records(chunks, page_offset):
+    """Flatten partition_pdf output into text/table/image records"""
+    records = []
+    for chunk in chunks:
+        kind = type(chunk).__name__
+        page = getattr(chunk.metadata, 'page_number', None) or 1
+        page += page_offset
+        if "Table" in kind:
+            records.append({'kind': 'table', 'text': str(chunk), 'page': page})
+        elif "CompositeElement" in kind:
+            records.append({'kind': 'text', 'text': str(chunk), 'page': page})
+            for element in getattr(chunk.metadata, 'orig_elements', None) or []:
+                image_b64 = getattr(element.metadata, 'image_base64', None)
+                if "Image" in type(element).__name__ and image_b64:
+                    records.append({'kind': 'image', 'text': str(element), 'page': page, 'image_b64': image_b64})
+    return records
+
+def partition_range(task):
+    """Process-pool worker: partition one page range and write its cache file"""
+    from unstructured.partition.pdf import partition_pdf
+
+    start, end = task['start'], task['end']
+    if task['split']:
+        # Only this range's pages are loaded into the worker
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            range_path = os.path.join(tmp_dir, "range.pdf")
+            _write_page_range(task['path'], start, end, range_path)
+            chunks = partition_pdf(filename=range_path, **PARTITION_KWARGS)
+        records = _element_records(chunks, page_offset=start - 1)
+    else:
+        chunks = partition_pdf(filename=task['path'], **PARTITION_KWARGS)
+        records = _element_records(chunks, page_offset=0)
+
+    tmp_path = task['cache_path'] + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': PARTITION_VERSION, 'records': records}, f)
+    os.replace(tmp_path, task['cache_path'])
+    return task
+
+class PdfIngestor:
+    def __init__(self, processor, cache_dir=None, workers=None, pages_per_task=25,
+                 split_threshold=50, max_in_flight=None, batch_size=64, rewrite=False):
+        self.processor = processor
+        self.cache_dir = Path(cache_dir) if cache_dir else BASE_DIR / "processed_data" / "pdf_cache"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.pages_per_task = pages_per_task
+        self.split_threshold = split_threshold
+        self.max_in_flight = max_in_flight or self.workers * 2
+        self.batch_size = batch_size
+        self.rewrite = rewrite
+        # Cache file name -> chunk count of every range already in this vectorstore
+        self.written_path = Path(processor.vectorstore_dir) / WRITTEN_NAME
+        self.written = self._load_written()
+        self.stats = {'pdfs': 0, 'ranges': 0, 'cached_ranges': 0, 'written_ranges': 0, 'chunks': 0,
+                      'failed_ranges': 0}
+
+    def _load_written(self):
+        if not self.written_path.exists():
+            return {}
+        try:
+            with open(self.written_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_written(self):
+        tmp_path = str(self.written_path) + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.written, f, indent=2)
+        os.replace(tmp_path, self.written_path)
+
+    def _tasks(self, pdf_paths):
+        """One task per (file, page range), with its cache path"""
+        for pdf_path in pdf_paths:
+            pdf_path = Path(pdf_path)
+            sha = file_sha256(pdf_path)
+            try:
+                count = pdf_page_count(pdf_path)
+            except Exception as e:
+                print(f"   ⚠️  Could not read page count of {pdf_path.name}: {e}")
+                count = None
+            self.stats['pdfs'] += 1
+            ranges = page_ranges(count, self.pages_per_task, self.split_threshold)
+            for start, end in ranges:
+                cache_path = self.cache_dir / f"{sha[:32]}_v{PARTITION_VERSION}_{start}-{end}.json"
+                yield {
+                    'path': str(pdf_path),
+                    'name': pdf_path.name,
+                    'sha': sha,
+                    'start': start,
+                    'end': end,
+                    'split': len(ranges) > 1,
+                    'cache_path': str(cache_path),
+                }
+
+    def _documents(self, task):
+        """Build Documents and stable ids from a cached range"""
+        from langchain.schema.document import Document
+        with open(task['cache_path'], 'r', encoding='utf-8') as f:
+            records = json.load(f)['records']
+        category = self.processor._extract_category(task['name'])
+        documents, ids = [], []
+        for i, record in enumerate(records):
+            metadata = {
+                'source': task['name'],
+                'type': 'image' if record['kind'] == 'image' else 'document',
+                'element': record['kind'],
+                'category': category,
+                'page': record['page'],
+                'chunk_id': i,
+            }
+            text = record['text']
+            if record['kind'] == 'image':
+                metadata['image_b64'] = record['image_b64']
+                text = text or f"Image from {task['name']} page {record['page']}"
+            if not text.strip():
+                continue
+            documents.append(Document(page_content=text, metadata=metadata))
+            ids.append(str(uuid.uuid5(uuid.NAMESPACE_URL, f"pdf:{task['sha']}:{task['start']}:{i}")))
+        return documents, ids
+
+    def _write(self, task):
+        """Stream one finished range into the vectorstore in batches"""
+        documents, ids = self._documents(task)
+        for start in range(0, len(documents), self.batch_size):
+            self.processor._add_documents(documents[start:start + self.batch_size],
+                                          ids[start:start + self.batch_size])
+        self.written[Path(task['cache_path']).name] = len(documents)
+        self._save_written()
+        self.stats['chunks'] += len(documents)
+        metrics.incr('pdf_chunks', len(documents))
+        pages = f"pages {task['start']}-{task['end']}" if task['end'] else "all pages"
+        print(f"   ✅ {task['name']} ({pages}): {len(documents)} chunks")
+
+    def ingest(self, pdf_paths):
+        """Partition PDFs in a process pool and write each range as soon as it is done"""
+        pending = set()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for task in self._tasks(pdf_paths):
+                self.stats['ranges'] += 1
+                if os.path.exists(task['cache_path']) and not self.rewrite \
+                        and Path(task['cache_path']).name in self.written:
+                    self.stats['written_ranges'] += 1
+                    continue
+                if os.path.exists(task['cache_path']):
+                    self.stats['cached_ranges'] += 1
+                    self._write(task)
+                    continue
+                # Bound the number of ranges held by the pool at once
+                while len(pending) >= self.max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(done)
+                pending.add(pool.submit(partition_range, task))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                self._collect(done)
+        return self.stats
+
+    def _collect(self, futures):
+        for future in futures:
+            try:
+                task = future.result()
+            except Exception as e:
+                self.stats['failed_ranges'] += 1
+                print(f"   ❌ Partitioning failed: {e}")
+                continue
+            self._write(task)
+
+def find_pdfs(paths):
+    found = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            found.extend(sorted(path.glob("*.pdf")))
+        elif path.suffix.lower() == ".pdf":
+            found.append(path)
+    return found
+
+def main(paths=None, workers=None, pages_per_task=25, split_threshold=50, rewrite=False):
+    """Ingest PDFs (default: raw_data/pdfs) into the Marvel vector database"""
+    from marvel_pipeline import load_script_module
+
+    print("🦸 Marvel PDF Ingestion")
+    print("=" * 50)
+    pdfs = find_pdfs(paths or [BASE_DIR / "raw_data" / "pdfs"])
+    if not pdfs:
+        print("   No PDFs found, nothing to do")
+        return None
+
+    content = load_script_module(Path(__file__).parent / "4_process_marvel_content.py")
+    processor = content.MarvelContentProcessor()
+    ingestor = PdfIngestor(processor, workers=workers, pages_per_task=pages_per_task,
+                           split_threshold=split_threshold, rewrite=rewrite)
+    print(f"📄 {len(pdfs)} PDFs, {ingestor.workers} worker processes")
+    stats = ingestor.ingest(pdfs)
+    processor.save_metadata()
+
+    print("\n" + "=" * 50)
+    print(f"✅ PDF ingestion complete: {stats['chunks']} chunks from {stats['pdfs']} PDFs")
+    print(f"   Ranges: {stats['ranges']} ({stats['written_ranges']} already written, "
+          f"{stats['cached_ranges']} cached, {stats['failed_ranges']} failed)")
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partition PDFs in parallel and add them to the vector database")
+    parser.add_argument("paths", nargs="*", help="PDF files or directories (default: raw_data/pdfs)")
+    parser.add_argument("--workers", type=int, default=None, help="partitioning processes (default: CPUs - 1)")
+    parser.add_argument("--pages-per-task", type=int, default=25,
+                        help="pages per task when a large PDF is split")
+    parser.add_argument("--split-threshold", type=int, default=50,
+                        help="split PDFs with more pages than this into page ranges")
+    parser.add_argument("--rewrite", action="store_true",
+                        help="write every range to the vectorstore, including ranges written before")
+    args = parser.parse_args()
+    main(args.paths, workers=args.workers, pages_per_task=args.pages_per_task,
+         split_threshold=args.split_threshold, rewrite=args.rewrite)
@@ -0,0 +1,246 @@
+"""
+Dependency-aware pipeline runner for the Marvel vector database
+
+Stages declare the stages they depend on and the input files they read.
+Independent stages run concurrently, and a stage whose script and inputs
+hash to the same digest as its last successful run is skipped, unless one
+of its declared outputs has gone missing since.
+"""
+import sys
+import json
+import time
+import hashlib
+import importlib.util
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+from marvel_metrics import metrics
+from marvel_profiling import get_active_profiler, profile_stage
+
+class Stage:
+    def __init__(self, name, script, description, deps=(), inputs=(), outputs=(), confirm=None):
+        self.name = name
+        self.script = script
+        self.description = description
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        # Globs that must each match a file for the stage to count as up to date
+        self.outputs = list(outputs)
+        # Question asked before running interactively (None = never ask)
+        self.confirm = confirm
+
+class StageResult:
+    def __init__(self, status, seconds=0.0, error=None):
+        self.status = status
+        self.seconds = seconds
+        self.error = error
+
+class _InlineExecutor:
+    """Executor that runs each task immediately in the calling thread"""
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+def load_script_module(script_path):
+    """Import a numbered pipeline script from its file path"""
+    script_path = Path(script_path)
+    spec = importlib.util.spec_from_file_location(script_path.stem, script_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[script_path.stem] = module
+    spec.loader.exec_module(module)
+    return module
+
+def _file_sha256(path):
+    """Hash a file in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class PipelineRunner:
+    def __init__(self, stages, base_dir, script_dir, stamp_dir=None, jobs=3,
+                 force=None, assume_yes=False, interactive=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.base_dir = Path(base_dir)
+        self.script_dir = Path(script_dir)
+        self.stamp_dir = Path(stamp_dir) if stamp_dir else self.base_dir / ".pipeline_stamps"
+        self.stamp_dir.mkdir(parents=True, exist_ok=True)
+        self.jobs = max(1, jobs)
+        # force: None (no stages), a set of stage names, or 'all'
+        self.force = force or set()
+        self.assume_yes = assume_yes
+        self.interactive = sys.stdin.isatty() if interactive is None else interactive
+        self.results = {}
+        self.order = self._topological_order()
+
+    def _topological_order(self):
+        """Validate dependencies and return a stable topological order"""
+        order = []
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}' (required by {path[-1] if path else 'pipeline'})")
+            state[name] = 'visiting'
+            for dep in self.stages[name].deps:
+                visit(dep, path + [name])
+            state[name] = 'done'
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, [])
+        return order
+
+    def _stamp_path(self, stage):
+        return self.stamp_dir / f"{stage.name}.json"
+
+    def _read_stamp(self, stage):
+        stamp_path = self._stamp_path(stage)
+        if not stamp_path.exists():
+            return None
+        try:
+            with open(stamp_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _input_files(self, stage):
+        """Script file plus every file matching the stage's input globs"""
+        files = [self.script_dir / stage.script]
+        for pattern in stage.inputs:
+            files.extend(p for p in sorted(self.base_dir.glob(pattern)) if p.is_file())
+        return files
+
+    def _input_digest(self, stage, previous=None):
+        """Hash the stage inputs, reusing hashes of files whose size and mtime are unchanged"""
+        known = (previous or {}).get('files', {})
+        files = {}
+        digest = hashlib.sha256()
+        for path in self._input_files(stage):
+            key = str(path.relative_to(self.base_dir)) if path.is_relative_to(self.base_dir) else str(path)
+            stat = path.stat()
+            entry = known.get(key)
+            if not (entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns):
+                entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': _file_sha256(path)}
+            files[key] = entry
+            digest.update(f"{key}:{entry['sha256']}\n".encode('utf-8'))
+        return digest.hexdigest(), files
+
+    def _missing_outputs(self, stage):
+        """Output globs that no longer match any file"""
+        return [pattern for pattern in stage.outputs if not any(self.base_dir.glob(pattern))]
+
+    def _is_forced(self, stage):
+        return self.force == 'all' or stage.name in self.force
+
+    def _confirm(self, stage):
+        """Ask before running a stage that requires confirmation"""
+        if not stage.confirm or self.assume_yes:
+            return True
+        if not self.interactive:
+            print(f"⏭️  Skipping {stage.name}: needs confirmation, pass --yes to run non-interactively")
+            return False
+        response = input(f"\n   {stage.confirm} (y/n): ")
+        return response.lower() == 'y'
+
+    def _run_stage(self, stage):
+        """Run one stage unless its stamp shows the inputs are unchanged"""
+        previous = self._read_stamp(stage)
+        digest, files = self._input_digest(stage, previous)
+        if previous and previous.get('digest') == digest and not self._is_forced(stage):
+            missing = self._missing_outputs(stage)
+            if not missing:
+                print(f"⏭️  {stage.name}: inputs unchanged, skipping")
+                return StageResult('skipped')
+            print(f"🔄 {stage.name}: outputs missing ({', '.join(missing)}), running again")
+
+        print(f"\n{'='*60}")
+        print(f"📋 {stage.description}")
+        print(f"{'='*60}")
+
+        start = time.perf_counter()
+        try:
+            module = load_script_module(self.script_dir / stage.script)
+            if not hasattr(module, 'main'):
+                raise RuntimeError(f"Script {stage.script} doesn't have a main() function")
+            with metrics.span('stage', stage=stage.name), profile_stage(stage.name):
+                module.main()
+        except Exception as e:
+            print(f"❌ Error running {stage.script}: {e}")
+            traceback.print_exc()
+            return StageResult('failed', time.perf_counter() - start, str(e))
+
+        elapsed = time.perf_counter() - start
+        with open(self._stamp_path(stage), 'w', encoding='utf-8') as f:
+            json.dump({
+                'stage': stage.name,
+                'digest': digest,
+                'files': files,
+                'completed_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'seconds': round(elapsed, 3),
+            }, f, indent=2)
+        return StageResult('ran', elapsed)
+
+    def run(self):
+        """Run all stages respecting dependencies; returns True if none failed"""
+        # The profiler samples the main thread, so profiled runs stay in it
+        profiling = get_active_profiler() is not None
+        jobs = 1 if profiling else self.jobs
+        pending = list(self.order)
+        running = {}
+        run_start = time.perf_counter()
+
+        with (_InlineExecutor() if profiling else ThreadPoolExecutor(max_workers=jobs)) as pool:
+            while pending or running:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    dep_states = [self.results.get(dep) for dep in stage.deps]
+                    if any(r is not None and r.status not in ('ran', 'skipped') for r in dep_states):
+                        self.results[name] = StageResult('blocked')
+                        pending.remove(name)
+                        print(f"⛔ {name}: blocked by failed or declined dependency")
+                        continue
+                    if any(r is None for r in dep_states) or len(running) >= jobs:
+                        continue
+                    pending.remove(name)
+                    if not self._confirm(stage):
+                        self.results[name] = StageResult('declined')
+                        continue
+                    running[pool.submit(self._run_stage, stage)] = name
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.results[running.pop(future)] = future.result()
+
+        self.total_seconds = time.perf_counter() - run_start
+        return not any(r.status == 'failed' for r in self.results.values())
+
+    def print_summary(self):
+        """Print a per-stage timing table"""
+        icons = {'ran': '✅', 'skipped': '⏭️ ', 'failed': '❌', 'blocked': '⛔', 'declined': '⏸️ '}
+        print("\n" + "=" * 60)
+        print("⏱️  Stage Timing Summary")
+        print("=" * 60)
+        for name in self.order:
+            result = self.results.get(name, StageResult('not run'))
+            icon = icons.get(result.status, '  ')
+            print(f"   {icon} {name:<20} {result.status:<9} {result.seconds:8.2f}s")
+        print(f"   {'total wall time':<23} {'':<9} {getattr(self, 'total_seconds', 0.0):8.2f}s")
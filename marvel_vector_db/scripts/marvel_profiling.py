@@ -0,0 +1,212 @@
+"""
+Opt-in profiling for the Marvel ingestion pipeline
+
+Each stage gets a cProfile dump, tracemalloc top allocators and the peak
+RSS seen so far. A background sampler records the main thread's stacks
+into a collapsed-stack ``.folded`` file that flamegraph.pl, speedscope or
+inferno can render directly.
+"""
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None if unavailable)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    if sys.platform == 'darwin':
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+def current_rss_mb():
+    """Current resident set size of this process in MB (None where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+
+class _StackSampler(threading.Thread):
+    """Periodically sample one thread's Python stack into collapsed stacks"""
+    def __init__(self, thread_id, interval=0.005):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stage = None
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            stage = self.stage
+            if stage is None:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            frames.append(stage)
+            self.stacks[";".join(reversed(frames))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=1)
+
+class PipelineProfiler:
+    def __init__(self, output_dir=None, top_allocators=10, sample_interval=0.005):
+        if output_dir is None:
+            script_dir = Path(__file__).parent.parent
+            output_dir = script_dir / "profiles"
+        self.run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.output_dir = Path(output_dir) / self.run_id
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.top_allocators = top_allocators
+        self.sample_interval = sample_interval
+        self.stages = []
+        self._stack = []
+        self._sampler = None
+
+    def start(self):
+        """Start tracemalloc and the stack sampler for this run"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._sampler = _StackSampler(threading.get_ident(), self.sample_interval)
+        self._sampler.start()
+        print(f"🔬 Profiling enabled, writing to {self.output_dir}")
+        return self
+
+    @contextmanager
+    def stage(self, name):
+        """Profile a pipeline stage; stages may nest"""
+        if self._sampler is None:
+            self.start()
+
+        parent = self._stack[-1] if self._stack else None
+        if parent:
+            parent['profile'].disable()
+            # Keep the parent's peak so far before the child resets it
+            parent['child_peak'] = max(parent['child_peak'], tracemalloc.get_traced_memory()[1])
+
+        record = {
+            'name': name,
+            'profile': cProfile.Profile(),
+            'child_peak': 0,
+            'start_snapshot': tracemalloc.take_snapshot(),
+        }
+        self._stack.append(record)
+        self._sampler.stage = ";".join(r['name'] for r in self._stack)
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        record['profile'].enable()
+        try:
+            yield record
+        finally:
+            record['profile'].disable()
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            # Don't attribute the profiler's own bookkeeping to any stage
+            self._sampler.stage = None
+            self._finish_stage(record, elapsed)
+            if parent:
+                parent['child_peak'] = max(parent['child_peak'], record['python_peak'])
+                self._sampler.stage = ";".join(r['name'] for r in self._stack)
+                parent['profile'].enable()
+            else:
+                self._sampler.stage = None
+
+    def _finish_stage(self, record, elapsed):
+        """Write the cProfile dump and collect memory statistics for a stage"""
+        _, python_peak = tracemalloc.get_traced_memory()
+        record['python_peak'] = max(python_peak, record['child_peak'])
+        tracemalloc.reset_peak()
+
+        end_snapshot = tracemalloc.take_snapshot()
+        diff = end_snapshot.compare_to(record['start_snapshot'], 'lineno')
+        allocators = []
+        for stat in diff[:self.top_allocators]:
+            frame = stat.traceback[0]
+            allocators.append({
+                'location': f"{frame.filename}:{frame.lineno}",
+                'size_diff_kb': round(stat.size_diff / 1024, 1),
+                'count_diff': stat.count_diff,
+            })
+
+        safe_name = "".join(c if c.isalnum() or c in '-_' else '_' for c in record['name'])
+        prof_path = self.output_dir / f"{len(self.stages):02d}_{safe_name}.prof"
+        record['profile'].dump_stats(str(prof_path))
+
+        summary = {
+            'stage': record['name'],
+            'seconds': round(elapsed, 3),
+            'peak_rss_mb': peak_rss_mb(),
+            'python_peak_mb': round(record['python_peak'] / (1024 * 1024), 1),
+            'cprofile': prof_path.name,
+            'top_allocators': allocators,
+        }
+        self.stages.append(summary)
+        print(f"   🔬 {record['name']}: {summary['seconds']}s, peak RSS {summary['peak_rss_mb']} MB")
+
+    def finish(self):
+        """Stop sampling and write the flamegraph and summary files"""
+        if self._sampler is not None:
+            self._sampler.stop()
+            folded_path = self.output_dir / "flamegraph.folded"
+            with open(folded_path, 'w', encoding='utf-8') as f:
+                for stack, count in sorted(self._sampler.stacks.items()):
+                    f.write(f"{stack} {count}\n")
+            self._sampler = None
+
+        summary_path = self.output_dir / "profile_summary.json"
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'run_id': self.run_id,
+                'peak_rss_mb': peak_rss_mb(),
+                'sample_interval': self.sample_interval,
+                'stages': self.stages,
+            }, f, indent=2)
+
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        print(f"🔬 Profile written to {self.output_dir}")
+        print(f"   Flamegraph: flamegraph.pl {self.output_dir / 'flamegraph.folded'} > flamegraph.svg")
+        return summary_path
+
+# Profiler shared by the pipeline runner and the scripts it calls
+_active_profiler = None
+
+def get_active_profiler():
+    """Return the profiler started by the current run, if any"""
+    return _active_profiler
+
+def set_active_profiler(profiler):
+    global _active_profiler
+    _active_profiler = profiler
+
+@contextmanager
+def profile_stage(name):
+    """Profile a stage if a profiler is active, otherwise do nothing"""
+    if _active_profiler is None:
+        yield None
+    else:
+        with _active_profiler.stage(name) as record:
+            yield record
@@ -0,0 +1,238 @@
+"""
+Compressed Marvel vector index with exact reranking
+
+Codes are built from the exact NumPy index (see marvel_numpy_index.py) in
+one of two formats:
+- ``int8``: per-dimension scalar quantization, 1 byte per dimension (4x smaller)
+- ``pq``: product quantization, 1 byte per subspace (64 bytes per chunk by default)
+
+A search scores every code against the query, keeps a shortlist of
+``rerank_factor * k`` rows and reranks it with the exact float32 vectors
+read from the memory-mapped ``vectors.npy``, so only the codes need to
+stay resident.
+"""
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from marvel_metrics import metrics
+from marvel_numpy_index import NumpyVectorIndex
+
+CODES_FILE = "codes.npy"
+CODEBOOK_FILE = "codebook.npz"
+META_FILE = "quantized_meta.json"
+MODES = ['int8', 'pq']
+
+def _kmeans(data, clusters, iterations=15, seed=0):
+    """Plain Lloyd's k-means; returns float32 centroids"""
+    rng = np.random.default_rng(seed)
+    clusters = min(clusters, len(data))
+    centroids = data[rng.choice(len(data), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest(data, centroids)
+        for c in range(clusters):
+            members = data[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+            else:
+                # Re-seed empty clusters from a random point
+                centroids[c] = data[rng.integers(len(data))]
+    return centroids
+
+def _nearest(data, centroids):
+    """Index of the closest centroid for each row (squared L2)"""
+    distances = (
+        (data ** 2).sum(axis=1, keepdims=True)
+        - 2.0 * data @ centroids.T
+        + (centroids ** 2).sum(axis=1)
+    )
+    return distances.argmin(axis=1)
+
+class QuantizedVectorIndex:
+    def __init__(self, index_dir, exact, codes, codebook, meta):
+        self.index_dir = Path(index_dir)
+        self.exact = exact
+        self.codes = codes
+        self.codebook = codebook
+        self.meta = meta
+        self.mode = meta['mode']
+        self.version = meta.get('version')
+        self.records = exact.records
+
+    @property
+    def embeddings(self):
+        return self.exact.embeddings
+
+    @classmethod
+    def build(cls, exact, index_dir, mode='int8', num_subspaces=64, train_size=20000, block_size=65536):
+        """Quantize every vector of an exact index"""
+        if mode not in MODES:
+            raise ValueError(f"Unknown quantization mode '{mode}', expected one of {MODES}")
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        vectors = exact.vectors
+        total, dim = vectors.shape
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(total, min(train_size, total), replace=False)) if total else []
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+        if mode == 'int8':
+            low = sample.min(axis=0) if total else np.zeros(dim, dtype=np.float32)
+            high = sample.max(axis=0) if total else np.ones(dim, dtype=np.float32)
+            scale = np.maximum(high - low, 1e-8) / 255.0
+            codebook = {'low': low.astype(np.float32), 'scale': scale.astype(np.float32)}
+            codes = np.lib.format.open_memmap(index_dir / CODES_FILE, mode='w+', dtype=np.uint8, shape=(total, dim))
+            for offset in range(0, total, block_size):
+                block = np.asarray(vectors[offset:offset + block_size], dtype=np.float32)
+                codes[offset:offset + len(block)] = np.clip(np.rint((block - low) / scale), 0, 255)
+        else:
+            if dim % num_subspaces:
+                raise ValueError(f"Dimension {dim} is not divisible by {num_subspaces} subspaces")
+            sub_dim = dim // num_subspaces
+            centroids = np.stack([
+                _kmeans(sample[:, m * sub_dim:(m + 1) * sub_dim], 256)
+                for m in range(num_subspaces)
+            ]) if total else np.zeros((num_subspaces, 1, sub_dim), dtype=np.float32)
+            codebook = {'centroids': centroids.astype(np.float32)}
+            codes = np.lib.format.open_memmap(
+                index_dir / CODES_FILE, mode='w+', dtype=np.uint8, shape=(total, num_subspaces)
+            )
+            for offset in range(0, total, block_size):
+                block = np.asarray(vectors[offset:offset + block_size], dtype=np.float32)
+                for m in range(num_subspaces):
+                    codes[offset:offset + len(block), m] = _nearest(
+                        block[:, m * sub_dim:(m + 1) * sub_dim], centroids[m]
+                    )
+
+        codes.flush()
+        del codes
+        np.savez(index_dir / CODEBOOK_FILE, **codebook)
+        meta = {
+            'mode': mode,
+            'version': exact.version,
+            'count': total,
+            'dim': dim,
+            'num_subspaces': num_subspaces if mode == 'pq' else None,
+            'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'build_seconds': round(time.perf_counter() - start, 3),
+        }
+        with open(index_dir / META_FILE, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        print(f"   🗜️ Built {mode} index: {total} vectors in {meta['build_seconds']}s")
+        return cls.load(index_dir, exact)
+
+    @classmethod
+    def load(cls, index_dir, exact):
+        """Load the codes into memory (None if the index doesn't exist)"""
+        index_dir = Path(index_dir)
+        if not (index_dir / META_FILE).exists():
+            return None
+        with open(index_dir / META_FILE, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        codes = np.load(index_dir / CODES_FILE)
+        with np.load(index_dir / CODEBOOK_FILE) as data:
+            codebook = {name: data[name] for name in data.files}
+        return cls(index_dir, exact, codes, codebook, meta)
+
+    @classmethod
+    def open_or_build(cls, vectorstore, persist_directory, mode='int8', index_dir=None, num_subspaces=64):
+        """Load the compressed index, rebuilding it when the exact index changed"""
+        exact = NumpyVectorIndex.open_or_build(vectorstore, persist_directory)
+        index_dir = Path(index_dir) if index_dir else Path(persist_directory) / f"quantized_{mode}"
+        index = cls.load(index_dir, exact)
+        if (index is None or index.version != exact.version or index.mode != mode
+                or (mode == 'pq' and index.meta.get('num_subspaces') != num_subspaces)):
+            index = cls.build(exact, index_dir, mode=mode, num_subspaces=num_subspaces)
+        return index
+
+    def is_stale(self, collection, persist_directory):
+        return self.exact.is_stale(collection, persist_directory)
+
+    def memory_report(self):
+        """Resident bytes of the codes versus the uncompressed float32 vectors, plus the records both keep"""
+        codebook_bytes = sum(array.nbytes for array in self.codebook.values())
+        float32_bytes = self.meta['count'] * self.meta['dim'] * 4
+        code_bytes = self.codes.nbytes + codebook_bytes
+        # Texts and metadata stay resident whichever vectors are used, and are often the larger part
+        records_bytes = self.exact.records_bytes()
+        mb = 1024 ** 2
+        return {
+            'mode': self.mode,
+            'count': self.meta['count'],
+            'code_mb': round(code_bytes / mb, 2),
+            'float32_mb': round(float32_bytes / mb, 2),
+            'records_mb': round(records_bytes / mb, 2),
+            'resident_mb': round((code_bytes + records_bytes) / mb, 2),
+            'float32_resident_mb': round((float32_bytes + records_bytes) / mb, 2),
+            'compression': round(float32_bytes / code_bytes, 1) if code_bytes else None,
+            'build_seconds': self.meta['build_seconds'],
+        }
+
+    def _approximate_scores(self, codes, query):
+        """Dot product of the query with the decoded codes, without decoding them"""
+        if self.mode == 'int8':
+            low, scale = self.codebook['low'], self.codebook['scale']
+            return codes.astype(np.float32) @ (query * scale) + float(low @ query)
+        centroids = self.codebook['centroids']
+        num_subspaces, _, sub_dim = centroids.shape
+        # Lookup table: query sub-vector . every centroid, per subspace
+        table = np.einsum('mcd,md->mc', centroids, query.reshape(num_subspaces, sub_dim))
+        return table[np.arange(num_subspaces), codes].sum(axis=1)
+
+    def search_vectors(self, query_vectors, k=5, filters=None, rerank_factor=10, block_size=65536):
+        """Top-k (row, cosine) per query: compressed shortlist, exact rerank"""
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        queries = queries / norms
+        rows = self.exact._candidate_rows(filters)
+        if rows is not None and len(rows) == 0:
+            return [[] for _ in queries]
+
+        shortlist_size = max(k, k * rerank_factor)
+        results = []
+        for query in queries:
+            if rows is not None:
+                scores = self._approximate_scores(self.codes[rows], query)
+                shortlist = rows[self._top_rows(scores, shortlist_size)]
+            else:
+                candidates = []
+                for start in range(0, len(self.codes), block_size):
+                    scores = self._approximate_scores(self.codes[start:start + block_size], query)
+                    top = self._top_rows(scores, shortlist_size)
+                    candidates.append((top + start, scores[top]))
+                if not candidates:
+                    results.append([])
+                    continue
+                all_rows = np.concatenate([c[0] for c in candidates])
+                all_scores = np.concatenate([c[1] for c in candidates])
+                shortlist = all_rows[self._top_rows(all_scores, shortlist_size)]
+
+            # Sorted reads keep the memory-mapped rerank mostly sequential
+            shortlist = np.sort(shortlist)
+            exact_scores = np.asarray(self.exact.vectors[shortlist], dtype=np.float32) @ query
+            order = np.argsort(-exact_scores)[:k]
+            results.append([(int(shortlist[i]), float(exact_scores[i])) for i in order])
+        return results
+
+    def _top_rows(self, scores, n):
+        n = min(n, len(scores))
+        if n == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.argpartition(-scores, n - 1)[:n]
+
+    def fetch_image(self, document):
+        return self.exact.fetch_image(document)
+
+    def similarity_search_with_score(self, query, k=5, filters=None):
+        """Chroma-compatible search returning [(Document, distance)]"""
+        with metrics.span('quantized_search', mode=self.mode, k=k):
+            query_vector = self.embeddings.embed_query(query)
+            hits = self.search_vectors([query_vector], k=k, filters=filters)[0]
+        return self.exact._to_documents(hits)
+
+    def similarity_search(self, query, k=5, filters=None):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filters)]
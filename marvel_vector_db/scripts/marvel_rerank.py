@@ -0,0 +1,100 @@
+"""
+Cross-encoder reranking of retrieved Marvel chunks
+
+Retrieval over-fetches (``fetch_k`` dense hits, 50 by default) and a
+small CPU cross-encoder rescores the (question, chunk) pairs in batches.
+Scores are cached per pair in an LRU, and a wall-clock budget bounds the
+stage: batches that would run past ``budget_ms`` are not scored, and the
+chunks left unscored keep their dense order after the scored ones. The
+budget starts once the model is loaded.
+"""
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from marvel_metrics import metrics
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+class CrossEncoderReranker:
+    def __init__(self, model_name=DEFAULT_RERANK_MODEL, fetch_k=50, batch_size=16,
+                 budget_ms=500, cache_size=20000, device="cpu"):
+        self.model_name = model_name
+        self.fetch_k = fetch_k
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.cache_size = cache_size
+        self.device = device
+        self._model = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        """Load the cross-encoder on first use"""
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(self.model_name, device=self.device, max_length=512)
+        return self._model
+
+    def _key(self, query, doc):
+        digest = hashlib.sha1(doc.page_content.encode('utf-8')).hexdigest()
+        return (query, digest)
+
+    def _cached(self, key):
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _store(self, key, score):
+        with self._lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def score(self, query, docs, budget_ms=None):
+        """Cross-encoder scores for docs; None for docs left unscored when the budget ran out"""
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        keys = [self._key(query, doc) for doc in docs]
+        scores = [self._cached(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        metrics.incr('rerank_cache_hits', len(docs) - len(missing))
+        if not missing:
+            return scores
+
+        # Loading the weights is a one-off cost, not part of the per-query budget
+        model = self.model
+        start_time = time.perf_counter()
+        deadline = start_time + budget_ms / 1000.0 if budget_ms else None
+        batch_s = 0.0
+        for start in range(0, len(missing), self.batch_size):
+            # Stop before a batch that would likely end past the deadline
+            if deadline and time.perf_counter() + batch_s > deadline:
+                metrics.incr('rerank_budget_exceeded')
+                break
+            batch_start = time.perf_counter()
+            batch = missing[start:start + self.batch_size]
+            pairs = [(query, docs[i].page_content) for i in batch]
+            for i, value in zip(batch, model.predict(pairs, batch_size=self.batch_size)):
+                scores[i] = float(value)
+                self._store(keys[i], scores[i])
+            batch_s = time.perf_counter() - batch_start
+        return scores
+
+    def rerank(self, query, docs, top_n=5, budget_ms=None):
+        """Reorder dense hits by cross-encoder score; hits not scored within the budget follow in dense order"""
+        if len(docs) <= 1:
+            return docs[:top_n]
+        with metrics.span('rerank', candidates=len(docs)):
+            scores = self.score(query, docs, budget_ms)
+        scored = sorted((i for i in range(len(docs)) if scores[i] is not None), key=lambda i: scores[i], reverse=True)
+        unscored = [i for i in range(len(docs)) if scores[i] is None]
+        return [docs[i] for i in (scored + unscored)[:top_n]]
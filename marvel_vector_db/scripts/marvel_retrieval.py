@@ -0,0 +1,194 @@
+"""
+Filtered retrieval over the Marvel collection
+
+Structured filters on the ``type``, ``category`` and ``source`` metadata
+written at ingestion are pushed down into Chroma ``where`` clauses. An
+optional in-memory MetadataIndex resolves the candidate ids up front:
+an empty candidate set returns immediately, and small candidate sets are
+scored exactly with one matrix-vector product instead of an HNSW search.
+The index re-reads the metadata when the collection's version stamp
+changes, so chunks ingested after it was built are found too.
+"""
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from marvel_metrics import metrics
+
+FILTER_FIELDS = ['type', 'category', 'source']
+
+def normalize_filters(filters):
+    """Turn {'type': 'image', 'category': ['event', 'team']} into {field: [values]}"""
+    normalized = {}
+    for field, values in (filters or {}).items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unsupported filter field '{field}', expected one of {FILTER_FIELDS}")
+        if values is None or values == []:
+            continue
+        if isinstance(values, str):
+            values = [values]
+        normalized[field] = list(values)
+    return normalized
+
+def build_where(filters):
+    """Build a Chroma where clause from normalized filters (None if no filters)"""
+    clauses = []
+    for field, values in normalize_filters(filters).items():
+        if len(values) == 1:
+            clauses.append({field: values[0]})
+        else:
+            clauses.append({field: {"$in": values}})
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+def _write_sequence(sqlite_path):
+    """Highest sequence number in Chroma's write log; it grows with every add, update and delete"""
+    try:
+        db = sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True)
+        try:
+            return db.execute("SELECT MAX(seq_id) FROM embeddings_queue").fetchone()[0]
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return None
+
+def _mtime(path):
+    return path.stat().st_mtime_ns if path.exists() else 0
+
+def collection_version(collection, persist_directory):
+    """Cheap version stamp: chunk count, Chroma's write sequence and the SQLite/WAL mtimes"""
+    # The count alone misses same-size upserts and delete-then-add; the WAL
+    # mtime catches writes not yet checkpointed into chroma.sqlite3
+    sqlite_path = Path(persist_directory) / "chroma.sqlite3"
+    wal_path = sqlite_path.with_name(sqlite_path.name + "-wal")
+    sequence = _write_sequence(sqlite_path) if sqlite_path.exists() else None
+    return f"{collection.count()}:{sequence}:{_mtime(sqlite_path)}:{_mtime(wal_path)}"
+
+class MetadataIndex:
+    """In-memory field -> value -> ids index over a Chroma collection"""
+    def __init__(self, collection, fields=None, page_size=5000, persist_directory=None, check_interval=30.0):
+        self.collection = collection
+        self.fields = fields or FILTER_FIELDS
+        self.page_size = page_size
+        # Without the persist directory only the chunk count tells that the collection changed
+        self.persist_directory = persist_directory
+        self.check_interval = check_interval
+        self.index = {}
+        self.size = 0
+        self.version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _current_version(self):
+        if self.persist_directory is None:
+            return str(self.collection.count())
+        return collection_version(self.collection, self.persist_directory)
+
+    def refresh(self):
+        """Re-read all metadata from the collection"""
+        # Taken before the scan, so writes during the scan trigger another refresh
+        version = self._current_version()
+        index = {field: {} for field in self.fields}
+        size = 0
+        offset = 0
+        while True:
+            batch = self.collection.get(include=['metadatas'], limit=self.page_size, offset=offset)
+            ids = batch.get('ids') or []
+            for doc_id, metadata in zip(ids, batch.get('metadatas') or []):
+                for field in self.fields:
+                    value = (metadata or {}).get(field)
+                    if value is not None:
+                        index[field].setdefault(value, set()).add(doc_id)
+            size += len(ids)
+            if len(ids) < self.page_size:
+                break
+            offset += self.page_size
+        self.index = index
+        self.size = size
+        self.version = version
+        self._checked_at = time.monotonic()
+        return self
+
+    def ensure_fresh(self):
+        """Refresh if the collection changed (checked at most every check_interval s)"""
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                self._checked_at = time.monotonic()
+                if self._current_version() != self.version:
+                    self.refresh()
+        return self
+
+    def values(self, field):
+        """Known values of a field with their chunk counts"""
+        self.ensure_fresh()
+        return {value: len(ids) for value, ids in sorted(self.index.get(field, {}).items())}
+
+    def candidates(self, filters):
+        """Ids matching all filters (None if there are no filters)"""
+        self.ensure_fresh()
+        index = self.index
+        result = None
+        for field, values in normalize_filters(filters).items():
+            field_index = index.get(field, {})
+            matched = set()
+            for value in values:
+                matched |= field_index.get(value, set())
+            result = matched if result is None else result & matched
+            if not result:
+                return set()
+        return result
+
+class MarvelRetriever:
+    def __init__(self, vectorstore, embeddings, metadata_index=None, brute_force_threshold=256):
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings
+        self.metadata_index = metadata_index
+        self.brute_force_threshold = brute_force_threshold
+
+    def search(self, query, k=5, filters=None):
+        """Return [(Document, distance)] for the top-k chunks matching the filters"""
+        filters = normalize_filters(filters)
+        if not filters:
+            return self.vectorstore.similarity_search_with_score(query, k=k)
+
+        if self.metadata_index is not None:
+            candidates = self.metadata_index.candidates(filters)
+            metrics.incr('filter_candidates', len(candidates))
+            if not candidates:
+                return []
+            if len(candidates) <= self.brute_force_threshold:
+                return self._exact_search(query, candidates, k)
+
+        return self.vectorstore.similarity_search_with_score(query, k=k, filter=build_where(filters))
+
+    def _exact_search(self, query, candidate_ids, k):
+        """Score a small candidate set with a single matrix-vector product"""
+        with metrics.span('filter_exact_search', candidates=len(candidate_ids)):
+            batch = self.vectorstore._collection.get(
+                ids=list(candidate_ids),
+                include=['embeddings', 'documents', 'metadatas']
+            )
+            matrix = np.asarray(batch['embeddings'], dtype=np.float32)
+            query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+            query_vector /= np.linalg.norm(query_vector) or 1.0
+            # Embeddings are normalized, so squared L2 distance = 2 - 2 * cosine
+            distances = 2.0 - 2.0 * (matrix @ query_vector)
+            top = np.argsort(distances)[:k]
+            from langchain.schema.document import Document
+            return [
+                (Document(page_content=batch['documents'][i], metadata=batch['metadatas'][i] or {}),
+                 float(distances[i]))
+                for i in top
+            ]
+
+    def get_relevant_documents(self, query, k=5, filters=None):
+        return [doc for doc, _ in self.search(query, k=k, filters=filters)]
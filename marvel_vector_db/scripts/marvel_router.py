@@ -0,0 +1,241 @@
+"""
+Latency-aware routing between a small and a large local model
+
+Most questions ("What are Spider-Man's powers?") are answered from the
+retrieved context almost word for word, and a 1-3B model does that in a
+fraction of the time mistral:7b needs. ModelRouter picks the model for
+each request:
+
+- complexity of the question: explanations and comparisons, several
+  entities, multi-part and open-ended questions score higher
+- confidence in the retrieved context: the share of the question's
+  content words that appear in it
+- queue depth: when requests are waiting for Ollama, questions that are
+  not clearly hard go to the small model, which frees the slot sooner
+
+Hard questions and thin context go to the large model. A small-model
+answer that is empty, very short or gives up ("the context does not
+mention...") is escalated to the large model. The router keeps per-model
+calls, errors, escalations and latency percentiles.
+
+Usage: python scripts/marvel_router.py "Why did Iron Man and Captain America fight in Civil War?"
+"""
+import re
+import sys
+import time
+import threading
+from collections import deque
+
+import numpy as np
+import requests
+
+from marvel_metrics import metrics
+from marvel_conversation import find_entities
+
+SMALL_MODEL = "llama3.2:3b"
+LARGE_MODEL = "mistral:7b"
+
+WORD_RE = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+STOPWORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'been', 'do', 'does', 'did', 'of', 'in', 'on', 'at',
+    'to', 'for', 'with', 'by', 'from', 'and', 'or', 'what', 'who', 'whom', 'which', 'when', 'where', 'why',
+    'how', 'tell', 'me', 'about', 'describe', 'explain', 'his', 'her', 'their', 'its', 'he', 'she', 'they',
+    'it', 'this', 'that', 'as', 'has', 'have', 'had', 'can', 'could', 'would', 'should', 'i', 'you', 'marvel',
+}
+# Explanations, comparisons and hypotheticals
+REASONING_RE = re.compile(r"\b(why|explain|compare|comparison|difference|differ|versus|vs\.?|better|stronger|"
+                          r"weaker|would win|what if|in common)\b", re.IGNORECASE)
+# Open-ended requests that need a longer, organized answer
+BROAD_RE = re.compile(r"\b(describe|summari[sz]e|overview|history|timeline|storyline|list (all|every)|everything|"
+                      r"relationship|impact|influence|evolve[ds]?|changed?)\b", re.IGNORECASE)
+# A second question in the same message: "Who created X and when did he first appear?"
+MULTI_PART_RE = re.compile(r"\?.*\?|\b(and|also) (who|what|when|where|why|how|which)\b", re.IGNORECASE)
+# Answers that give up instead of answering
+UNSURE_RE = re.compile(
+    r"\b(i (don't|do not) know|i'm not sure|i am not sure|not (enough|sufficient) information|"
+    r"(context|text|documents?) (does|do) not (mention|contain|say|provide|include)|"
+    r"(cannot|can't|unable to) (answer|determine|find))\b", re.IGNORECASE
+)
+
+class ModelStats:
+    def __init__(self, max_samples=512, alpha=0.2):
+        self.calls = 0
+        self.errors = 0
+        self.escalations = 0
+        self.samples = deque(maxlen=max_samples)
+        self.ewma = None
+        self.alpha = alpha
+
+    def add(self, seconds, ok):
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+            return
+        self.samples.append(seconds)
+        self.ewma = seconds if self.ewma is None else self.ewma + self.alpha * (seconds - self.ewma)
+
+    def as_dict(self, total_calls):
+        samples = np.array(self.samples) * 1000 if self.samples else np.zeros(1)
+        return {
+            'calls': self.calls,
+            'share': round(self.calls / total_calls, 3) if total_calls else 0.0,
+            'errors': self.errors,
+            'escalations': self.escalations,
+            'p50_ms': round(float(np.percentile(samples, 50)), 1),
+            'p95_ms': round(float(np.percentile(samples, 95)), 1),
+            'ewma_ms': round((self.ewma or 0.0) * 1000, 1),
+        }
+
+def content_words(text):
+    """Lowercased non-stopwords without possessives and plural s (Spider-Man's powers -> spider-man, power)"""
+    words = set()
+    for word in WORD_RE.findall(text.lower()):
+        word = word[:-2] if word.endswith("'s") else word
+        if word in STOPWORDS or len(word) < 2:
+            continue
+        words.add(word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word)
+    return words
+
+class ModelRouter:
+    def __init__(self, small=SMALL_MODEL, large=LARGE_MODEL, base_url="http://localhost:11434",
+                 complexity_threshold=0.5, hard_complexity=0.8, min_confidence=0.6, busy_depth=2,
+                 min_answer_chars=40, tags_ttl_s=60.0):
+        self.small = small
+        self.large = large
+        self.base_url = base_url.rstrip('/')
+        self.complexity_threshold = complexity_threshold
+        self.hard_complexity = hard_complexity
+        self.min_confidence = min_confidence
+        self.busy_depth = busy_depth
+        self.min_answer_chars = min_answer_chars
+        self.tags_ttl_s = tags_ttl_s
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._tags = None
+        self._tags_at = 0.0
+
+    def complexity(self, question):
+        """0..1 estimate of how much reasoning a question needs"""
+        score = 0.0
+        if REASONING_RE.search(question):
+            score += 0.5
+        entities = {name for _, name in find_entities(question)}
+        if len(entities) >= 2:
+            score += 0.25
+        if MULTI_PART_RE.search(question):
+            score += 0.25
+        if BROAD_RE.search(question):
+            score += 0.25
+        if len(question.split()) > 20:
+            score += 0.2
+        return min(1.0, score)
+
+    def confidence(self, question, context):
+        """Share of the question's content words found in the retrieved context"""
+        words = content_words(question)
+        if not context:
+            return 0.0
+        if not words:
+            return 1.0
+        return len(words & content_words(context)) / len(words)
+
+    def available(self, model):
+        """Whether Ollama has the model pulled; unknown (Ollama unreachable) counts as available"""
+        now = time.monotonic()
+        if self._tags is None or now - self._tags_at > self.tags_ttl_s:
+            try:
+                response = requests.get(f"{self.base_url}/api/tags", timeout=2)
+                self._tags = {entry['name'] for entry in response.json().get('models', [])}
+            except Exception:
+                self._tags = set()
+            self._tags_at = now
+        if not self._tags:
+            return True
+        return model in self._tags or (":" not in model and f"{model}:latest" in self._tags)
+
+    def route(self, question, context="", queue_depth=0):
+        """Pick a model: {'model', 'reason', 'complexity', 'confidence', 'queue_depth'}"""
+        complexity = self.complexity(question)
+        confidence = self.confidence(question, context)
+        busy = queue_depth >= self.busy_depth
+        if self.small == self.large or not self.available(self.small):
+            model, reason = self.large, "small model not available"
+        elif complexity >= self.hard_complexity:
+            model, reason = self.large, "complex question"
+        elif complexity >= self.complexity_threshold:
+            model, reason = (self.small, "queue busy") if busy else (self.large, "complex question")
+        elif confidence < self.min_confidence:
+            model, reason = (self.small, "queue busy") if busy else (self.large, "weak context")
+        else:
+            model, reason = self.small, "simple question"
+        metrics.incr('router_small' if model == self.small else 'router_large')
+        return {'model': model, 'reason': reason, 'complexity': round(complexity, 2),
+                'confidence': round(confidence, 2), 'queue_depth': queue_depth}
+
+    def should_escalate(self, decision, answer):
+        """True when a small-model answer is missing, too short or gives up"""
+        if decision['model'] == self.large:
+            return False
+        answer = (answer or "").strip()
+        return len(answer) < self.min_answer_chars or bool(UNSURE_RE.search(answer))
+
+    def _model_stats(self, model):
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats()
+        return stats
+
+    def record(self, model, seconds, ok=True):
+        """Add one generation's latency to the model's statistics"""
+        with self._lock:
+            self._model_stats(model).add(seconds, ok)
+        metrics.observe(f"llm_{model}", seconds)
+
+    def escalate(self, decision):
+        """Count an escalation from the routed model and return the model to retry with"""
+        with self._lock:
+            self._model_stats(decision['model']).escalations += 1
+        metrics.incr('router_escalations')
+        decision['escalated_from'] = decision['model']
+        decision['model'] = self.large
+        return self.large
+
+    def generate(self, question, context, prompt, call, queue_depth=0):
+        """Answer with the routed model, escalating if needed; call(model, prompt) -> text.
+
+        Returns (answer, decision).
+        """
+        decision = self.route(question, context, queue_depth)
+        answer = None
+        start = time.perf_counter()
+        try:
+            answer = call(decision['model'], prompt)
+            self.record(decision['model'], time.perf_counter() - start)
+        except Exception:
+            self.record(decision['model'], time.perf_counter() - start, ok=False)
+            if decision['model'] == self.large:
+                raise
+        if self.should_escalate(decision, answer):
+            model = self.escalate(decision)
+            start = time.perf_counter()
+            try:
+                answer = call(model, prompt)
+            except Exception:
+                self.record(model, time.perf_counter() - start, ok=False)
+                raise
+            self.record(model, time.perf_counter() - start)
+        return answer, decision
+
+    def stats(self):
+        """{model: calls, share, errors, escalations, p50/p95/EWMA latency in ms}"""
+        with self._lock:
+            total = sum(stats.calls for stats in self._stats.values())
+            return {model: stats.as_dict(total) for model, stats in self._stats.items()}
+
+if __name__ == "__main__":
+    router = ModelRouter()
+    for question in sys.argv[1:] or ["What are Spider-Man's powers?",
+                                     "Why did Iron Man and Captain America fight in Civil War?"]:
+        decision = router.route(question, context=question)
+        print(f"🔀 {decision['model']:<14} {decision['reason']:<26} complexity={decision['complexity']} "
+              f"{question}")
@@ -0,0 +1,191 @@
+"""
+Sharded Marvel vector collections with parallel fan-out search
+
+Chunks are split across several Chroma collections, either by the
+``category`` metadata set at ingestion or by a hash of the source file.
+Queries go only to the shards a lightweight keyword classifier (or an
+explicit filter) picks, or fan out to every shard concurrently with the
+per-shard top-k merged by distance. The fan-out threads are shared by
+every store in the process, so reopening a store (one per Streamlit
+session) does not start a new pool.
+"""
+import re
+import json
+import zlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from langchain_chroma import Chroma
+
+from marvel_metrics import metrics
+
+CATEGORIES = ['character', 'team', 'event', 'comic', 'general']
+MANIFEST_NAME = "shards.json"
+
+# Keyword cues for routing a question to category shards
+QUERY_CUES = {
+    'team': [r'\bteams?\b', r'\bavengers\b', r'\bx-men\b', r'\bfounding\b', r'\bmembers?\b', r'\blineup\b'],
+    'event': [r'\bevents?\b', r'\bcrossover\b', r'\bsaga\b', r'\bcivil war\b', r'\binfinity gauntlet\b',
+              r'\bsecret (wars|invasion)\b', r'\bstoryline\b'],
+    'comic': [r'\bcomics? (book|issue|cover)s?\b', r'\bissue\b', r'#\d+', r'\bcovers?\b'],
+    'character': [r'\bpowers?\b', r'\babilit(y|ies)\b', r'\bwho is\b', r'\bcreated\b', r'\bfirst appear',
+                  r'\bspider-man\b', r'\biron man\b', r'\bcaptain america\b', r'\bthor\b', r'\bhulk\b',
+                  r'\bblack widow\b', r'\bdoctor strange\b', r'\bwolverine\b'],
+}
+_COMPILED_CUES = {
+    category: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+    for category, patterns in QUERY_CUES.items()
+}
+
+def classify_query(query):
+    """Guess which category shards can answer a question; None means search all"""
+    matched = [category for category, patterns in _COMPILED_CUES.items()
+               if any(p.search(query) for p in patterns)]
+    if not matched:
+        return None
+    # Curated files that match no category live in 'general'
+    return matched + ['general']
+
+_fanout_pools = {}
+_fanout_lock = threading.Lock()
+
+def fanout_pool(max_workers):
+    """Process-wide fan-out pool with max_workers threads"""
+    with _fanout_lock:
+        pool = _fanout_pools.get(max_workers)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-fanout")
+            _fanout_pools[max_workers] = pool
+        return pool
+
+def shard_collection_name(base_name, shard):
+    return f"{base_name}__{shard}"
+
+class ShardRouter:
+    def __init__(self, mode='category', num_shards=4):
+        if mode not in ('category', 'hash'):
+            raise ValueError(f"Unknown shard mode: {mode}")
+        self.mode = mode
+        self.num_shards = num_shards
+
+    @property
+    def shards(self):
+        if self.mode == 'category':
+            return list(CATEGORIES)
+        return [f"h{i}" for i in range(self.num_shards)]
+
+    def shard_for(self, metadata):
+        """Pick the shard for a chunk from its metadata"""
+        if self.mode == 'category':
+            category = metadata.get('category', 'general')
+            return category if category in CATEGORIES else 'general'
+        source = str(metadata.get('source', ''))
+        return f"h{zlib.crc32(source.encode('utf-8')) % self.num_shards}"
+
+class ShardedVectorStore:
+    def __init__(self, persist_directory, embeddings, mode='category', num_shards=4,
+                 base_name="marvel_knowledge_base", max_workers=None):
+        self.persist_directory = Path(persist_directory)
+        self.embeddings = embeddings
+        self.base_name = base_name
+        self.router = ShardRouter(mode, num_shards)
+        self.max_workers = max_workers or len(self.router.shards)
+        self.stores = {
+            shard: Chroma(
+                collection_name=shard_collection_name(base_name, shard),
+                embedding_function=embeddings,
+                persist_directory=str(self.persist_directory)
+            )
+            for shard in self.router.shards
+        }
+        self._pool = fanout_pool(self.max_workers)
+
+    @classmethod
+    def load(cls, persist_directory, embeddings):
+        """Open a sharded store from its manifest, or return None if unsharded"""
+        manifest_path = Path(persist_directory) / MANIFEST_NAME
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return cls(
+            persist_directory,
+            embeddings,
+            mode=manifest['mode'],
+            num_shards=manifest.get('num_shards', 4),
+            base_name=manifest.get('base_name', "marvel_knowledge_base"),
+        )
+
+    def write_manifest(self):
+        """Record the shard layout so query processes can find the shards"""
+        self.persist_directory.mkdir(parents=True, exist_ok=True)
+        with open(self.persist_directory / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+            json.dump({
+                'mode': self.router.mode,
+                'num_shards': self.router.num_shards,
+                'base_name': self.base_name,
+                'shards': self.router.shards,
+            }, f, indent=2)
+
+    def upsert(self, ids, vectors, metadatas, texts):
+        """Route precomputed vectors to their shards"""
+        grouped = {}
+        for item in zip(ids, vectors, metadatas, texts):
+            grouped.setdefault(self.router.shard_for(item[2]), []).append(item)
+        for shard, items in grouped.items():
+            shard_ids, shard_vectors, shard_metadatas, shard_texts = zip(*items)
+            self.stores[shard]._collection.upsert(
+                ids=list(shard_ids),
+                embeddings=list(shard_vectors),
+                metadatas=list(shard_metadatas),
+                documents=list(shard_texts)
+            )
+
+    def rebuild_shard(self, shard):
+        """Drop and recreate one shard's collection"""
+        self.stores[shard].delete_collection()
+        self.stores[shard] = Chroma(
+            collection_name=shard_collection_name(self.base_name, shard),
+            embedding_function=self.embeddings,
+            persist_directory=str(self.persist_directory)
+        )
+
+    def count(self):
+        return sum(store._collection.count() for store in self.stores.values())
+
+    def shard_counts(self):
+        return {shard: store._collection.count() for shard, store in self.stores.items()}
+
+    def select_shards(self, query, categories=None):
+        """Shards to search: explicit categories, classifier guess, or all"""
+        if self.router.mode != 'category':
+            return list(self.stores)
+        wanted = categories or classify_query(query)
+        if not wanted:
+            return list(self.stores)
+        return [shard for shard in self.stores if shard in wanted]
+
+    def similarity_search_with_score(self, query, k=4, categories=None, filter=None):
+        """Search the selected shards concurrently and merge by distance"""
+        shards = self.select_shards(query, categories)
+        embedding = self.embeddings.embed_query(query)
+
+        def search(shard):
+            return self.stores[shard].similarity_search_by_vector_with_relevance_scores(
+                embedding, k=k, filter=filter
+            )
+
+        with metrics.span('shard_fanout', shards=len(shards)):
+            if len(shards) == 1:
+                per_shard = [search(shards[0])]
+            else:
+                per_shard = list(self._pool.map(search, shards))
+
+        merged = [hit for hits in per_shard for hit in hits]
+        merged.sort(key=lambda hit: hit[1])
+        return merged[:k]
+
+    def similarity_search(self, query, k=4, categories=None, filter=None):
+        """Drop-in replacement for Chroma.similarity_search"""
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, categories, filter)]
@@ -0,0 +1,117 @@
+"""
+Single-flight coalescing of identical concurrent requests
+
+When several users ask the same question at the same time, only the first
+request (the leader) runs the search or the Mistral generation. Requests
+with the same key that arrive while it runs wait for it and share its
+result. ``stream`` also fans out a token stream: the generator runs once in
+a background thread, and every caller gets all tokens from the start,
+including callers that join halfway. The leader's session can go away
+without cutting the others off.
+
+A key is only shared while its computation is in flight; once it finishes
+the next identical request starts a new one. This is not a cache.
+"""
+import re
+import hashlib
+import threading
+
+from marvel_metrics import metrics
+
+def flight_key(*parts):
+    """Key for normalized-equal requests: case, whitespace and trailing punctuation are ignored"""
+    normalized = []
+    for part in parts:
+        if isinstance(part, (list, tuple, set)):
+            part = ",".join(sorted(str(item) for item in part))
+        text = re.sub(r"\s+", " ", str(part)).strip().lower().rstrip("?!. ")
+        normalized.append(text)
+    return hashlib.sha1("\x1f".join(normalized).encode('utf-8')).hexdigest()
+
+class _Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.items = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self.waiters = 1
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def _join(self, key):
+        """The flight for key and whether this caller leads it"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                metrics.incr('singleflight_shared')
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            metrics.incr('singleflight_leader')
+            return flight, True
+
+    def _finish(self, key, flight, result=None, error=None):
+        # Unregister first, so requests from now on start a new flight
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.result, flight.error, flight.done = result, error, True
+            flight.cond.notify_all()
+
+    def do(self, key, fn):
+        """Run fn() once for concurrent callers with the same key; all get its result or exception"""
+        flight, leader = self._join(key)
+        if leader:
+            try:
+                result = fn()
+            except BaseException as e:
+                self._finish(key, flight, error=e)
+                raise
+            self._finish(key, flight, result=result)
+            return result
+        with flight.cond:
+            flight.cond.wait_for(lambda: flight.done)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _produce(self, key, flight, make_iter):
+        try:
+            for item in make_iter():
+                with flight.cond:
+                    flight.items.append(item)
+                    flight.cond.notify_all()
+        except Exception as e:
+            self._finish(key, flight, error=e)
+            return
+        self._finish(key, flight)
+
+    def stream(self, key, make_iter):
+        """Iterate make_iter() once for concurrent callers with the same key; every caller gets every item"""
+        flight, leader = self._join(key)
+        if leader:
+            threading.Thread(target=self._produce, args=(key, flight, make_iter),
+                             name="singleflight", daemon=True).start()
+        position = 0
+        while True:
+            with flight.cond:
+                flight.cond.wait_for(lambda: len(flight.items) > position or flight.done)
+                items, done, error = flight.items[position:], flight.done, flight.error
+            for item in items:
+                yield item
+            position += len(items)
+            # Nothing is appended after done, so everything has been yielded
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+    def in_flight(self):
+        """{key: number of callers} for the computations running now"""
+        with self._lock:
+            return {key: flight.waiters for key, flight in self._flights.items()}
@@ -0,0 +1,293 @@
+"""
+Adaptive-concurrency summarization of text, table and image chunks
+
+Summaries are requested from Ollama with a concurrency limit that follows
+AIMD (additive increase, multiplicative decrease): the limit grows by
+one request per window of fast responses and halves when latency rises
+well above the best observed latency or a request fails. Shorter chunks
+are dispatched first. Every summary is memoized in SQLite by content
+hash and model as soon as it arrives, so an interrupted run resumes
+where it stopped.
+
+Usage:
+    python scripts/marvel_summarizer.py --fake --chunks 200 --compare
+    python scripts/marvel_summarizer.py --input processed_data/pdf_cache/*.json
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import sqlite3
+import hashlib
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import closing
+from pathlib import Path
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from marvel_metrics import metrics
+
+BASE_DIR = Path(__file__).parent.parent
+
+# Prompts from DocumentProcessor in the notebook
+PROMPTS = {
+    'text': """You are a Marvel Comics expert assistant. Summarize this text focusing on Marvel characters, storylines, events, and universe details. Extract key information about heroes, villains, teams, powers, and story arcs.
+Respond only with the summary, no additional comment.
+
+Text chunk: {content}""",
+    'table': """You are a Marvel Comics expert. Summarize this table focusing on Marvel-related data such as character statistics, comic issue information, movie details, timeline events, or character relationships.
+Respond only with the summary, no additional comment.
+
+Table: {content}""",
+    'image': "Describe this image in detail focusing on Marvel Comics content. Identify characters, costumes, artwork style, comic panels, action scenes, team compositions, iconic moments, or any Marvel-related visual elements. If this appears to be comic book art, describe the art style, characters visible, and what scene or storyline it might represent.",
+}
+
+class OllamaClient:
+    def __init__(self, base_url="http://localhost:11434", model="mistral:7b", timeout=120, options=None):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.timeout = timeout
+        self.options = options or {'temperature': 0.1}
+
+    def generate(self, prompt, images=None):
+        payload = {'model': self.model, 'prompt': prompt, 'stream': False, 'options': self.options}
+        if images:
+            payload['images'] = images
+        response = requests.post(f"{self.base_url}/api/generate", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get('response', '').strip()
+
+class SummaryStore:
+    """SQLite memo of summaries keyed by content hash and model"""
+    def __init__(self, db_path=None):
+        self.db_path = str(db_path or BASE_DIR / "processed_data" / "summaries.sqlite3")
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS summaries (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                created_at REAL
+            )""")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get_many(self, keys):
+        found = {}
+        with closing(self._connect()) as conn:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, summary FROM summaries WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def put(self, key, model, kind, summary):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, model, kind, summary, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, kind, summary, time.time())
+            )
+
+class AIMDController:
+    """Concurrency limit driven by observed latency"""
+    def __init__(self, initial=2, minimum=1, maximum=16, latency_tolerance=1.5, backoff=0.5, window=50):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.baseline = None
+        self._recent = deque(maxlen=window)
+        self.peak = int(initial)
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def concurrency(self):
+        return max(self.minimum, int(self.limit))
+
+    def on_result(self, latency, ok=True):
+        with self._lock:
+            if ok:
+                # Baseline is the best latency over a recent window, so it follows
+                # slower (longer) chunks without drifting up under overload
+                self._recent.append(latency)
+                self.baseline = min(self._recent)
+            if not ok or latency > self.baseline * self.latency_tolerance:
+                # At most one decrease per round trip, so one burst doesn't collapse the limit
+                now = time.monotonic()
+                if now - self._last_decrease >= (self.baseline or latency):
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_decrease = now
+                    metrics.incr('summarizer_backoffs')
+            else:
+                # +1 request per window of `limit` fast responses
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.peak = max(self.peak, self.concurrency)
+
+class FixedController:
+    """Constant concurrency, for comparison with the notebook's 4 threads"""
+    def __init__(self, concurrency=4):
+        self.concurrency = concurrency
+        self.maximum = concurrency
+        self.peak = concurrency
+
+    def on_result(self, latency, ok=True):
+        pass
+
+def summary_key(model, kind, content, images=None):
+    digest = hashlib.sha256()
+    for part in (model, kind, content, *(images or [])):
+        digest.update(part.encode('utf-8'))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+class SummaryScheduler:
+    def __init__(self, client, store=None, controller=None, retries=2, max_chars=2000):
+        self.client = client
+        self.store = store
+        self.controller = controller or AIMDController()
+        self.retries = retries
+        self.max_chars = max_chars
+        self.stats = {}
+
+    def _prompt(self, job):
+        return PROMPTS[job['kind']].format(content=job['content'][:self.max_chars])
+
+    def _call(self, index, job):
+        start = time.perf_counter()
+        try:
+            summary = self.client.generate(self._prompt(job), job.get('images'))
+            return index, summary, time.perf_counter() - start, None
+        except Exception as e:
+            return index, None, time.perf_counter() - start, e
+
+    def summarize(self, jobs, progress_callback=None):
+        """Summaries for jobs ({'kind', 'content', 'images'?}), in input order"""
+        start = time.perf_counter()
+        keys = [summary_key(self.client.model, job['kind'], job['content'], job.get('images')) for job in jobs]
+        cached = self.store.get_many(keys) if self.store else {}
+        results = [cached.get(key) for key in keys]
+
+        # Shortest chunks first: quick wins and early latency samples
+        queue = [(len(job['content']), i) for i, job in enumerate(jobs) if results[i] is None]
+        heapq.heapify(queue)
+        attempts = {}
+        stats = {'jobs': len(jobs), 'cached': len(jobs) - len(queue), 'completed': 0, 'failed': 0}
+        total = len(queue)
+
+        in_flight = set()
+        limit_samples = []
+        with ThreadPoolExecutor(max_workers=self.controller.maximum) as pool:
+            while queue or in_flight:
+                while queue and len(in_flight) < self.controller.concurrency:
+                    _, index = heapq.heappop(queue)
+                    in_flight.add(pool.submit(self._call, index, jobs[index]))
+                limit_samples.append(self.controller.concurrency)
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, summary, latency, error = future.result()
+                    self.controller.on_result(latency, ok=error is None and bool(summary))
+                    metrics.observe('summarize', latency)
+                    if error is None and summary:
+                        results[index] = summary
+                        stats['completed'] += 1
+                        if self.store:
+                            self.store.put(keys[index], self.client.model, jobs[index]['kind'], summary)
+                    else:
+                        attempts[index] = attempts.get(index, 0) + 1
+                        if attempts[index] <= self.retries:
+                            heapq.heappush(queue, (len(jobs[index]['content']), index))
+                        else:
+                            # Same fallback as the notebook, but not memoized
+                            print(f"   ⚠️  Summary failed after {attempts[index]} attempts: {error}")
+                            results[index] = jobs[index]['content'][:100]
+                            stats['failed'] += 1
+                    if progress_callback:
+                        progress_callback(stats['completed'] + stats['failed'], total)
+
+        seconds = time.perf_counter() - start
+        stats.update({
+            'seconds': round(seconds, 3),
+            'summaries_per_s': round(stats['completed'] / seconds, 2) if seconds else 0.0,
+            'peak_concurrency': self.controller.peak,
+            'mean_concurrency': round(sum(limit_samples) / len(limit_samples), 1) if limit_samples else 0.0,
+            'final_concurrency': self.controller.concurrency,
+        })
+        self.stats = stats
+        return results
+
+def jobs_from_pdf_cache(paths):
+    """Summary jobs from marvel_pdf_ingest.py range cache files"""
+    jobs = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for record in json.load(f)['records']:
+                if record['kind'] == 'image':
+                    jobs.append({'kind': 'image', 'content': record.get('text', ''), 'images': [record['image_b64']]})
+                else:
+                    jobs.append({'kind': record['kind'], 'content': record['text']})
+    return jobs
+
+def synthetic_jobs(count):
+    """Marvel-flavoured chunks of varying length for the fake server"""
+    names = ["Spider-Man", "Thor", "Black Widow", "Wolverine", "Doctor Strange", "Captain America", "Hulk"]
+    jobs = []
+    for i in range(count):
+        name = names[i % len(names)]
+        sentence = f"{name} appears in issue {i} alongside the Avengers during the storyline. "
+        jobs.append({'kind': 'table' if i % 10 == 0 else 'text', 'content': sentence * (1 + (i * 7) % 20)})
+    return jobs
+
+def print_stats(label, stats):
+    print(f"   {label:<10} {stats['completed']:>5} done  {stats['cached']:>5} cached  {stats['failed']:>3} failed  "
+          f"{stats['summaries_per_s']:>7.2f} summaries/s  concurrency mean {stats['mean_concurrency']} "
+          f"peak {stats['peak_concurrency']}")
+
+def main(inputs=None, url="http://localhost:11434", model="mistral:7b", fake=False, chunks=100,
+         compare=False, max_concurrency=16, no_cache=False):
+    print("🦸 Marvel Summarization Scheduler")
+    if fake:
+        from marvel_fake_ollama import start_fake_ollama
+        server, state, url = start_fake_ollama(latency=0.2, capacity=8)
+        print(f"   🧪 Using fake Ollama at {url}")
+    jobs = jobs_from_pdf_cache(inputs) if inputs else synthetic_jobs(chunks)
+    print(f"   {len(jobs)} chunks to summarize with {model}")
+
+    client = OllamaClient(url, model)
+    runs = [('adaptive', AIMDController(maximum=max_concurrency))]
+    if compare:
+        runs.insert(0, ('fixed-4', FixedController(4)))
+    for label, controller in runs:
+        # Comparison runs must not read each other's memoized summaries
+        store = None if (no_cache or compare) else SummaryStore()
+        scheduler = SummaryScheduler(client, store, controller)
+        scheduler.summarize(jobs)
+        print_stats(label, scheduler.stats)
+    if fake:
+        server.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize chunks with adaptive concurrency")
+    parser.add_argument("--input", nargs="*", default=None, help="pdf_cache JSON files to summarize")
+    parser.add_argument("--url", default="http://localhost:11434")
+    parser.add_argument("--model", default="mistral:7b")
+    parser.add_argument("--fake", action="store_true", help="run against an in-process fake Ollama")
+    parser.add_argument("--chunks", type=int, default=100, help="synthetic chunks when no --input is given")
+    parser.add_argument("--compare", action="store_true", help="also run the notebook's fixed 4-thread pool")
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write memoized summaries")
+    args = parser.parse_args()
+    main(args.input, args.url, args.model, args.fake, args.chunks, args.compare, args.max_concurrency, args.no_cache)
@@ -0,0 +1,234 @@
+"""
+Warm-start support for Marvel query processes
+
+- ``build`` saves bge-large as a local safetensors snapshot, so startup
+  needs no Hub lookups and the weights are memory-mapped when loaded. It
+  also builds the exact NumPy index that a fast-start process memory-maps
+  instead of opening Chroma.
+- WarmEmbeddings imports torch/transformers and loads the model in a
+  background thread; only the first embedding call waits for it.
+- StartupReport times the startup phases, and ``report`` compares
+  heavy-module import times and normal vs fast-start boot of the query CLI.
+
+Usage:
+    python scripts/marvel_warm_start.py build
+    python scripts/marvel_warm_start.py report
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.parent
+SNAPSHOT_DIR = BASE_DIR / "warm_start"
+MODEL_NAME = "BAAI/bge-large-en-v1.5"
+HEAVY_MODULES = [
+    'torch', 'transformers', 'sentence_transformers', 'langchain_huggingface',
+    'chromadb', 'langchain_chroma', 'langchain_ollama', 'langchain.schema.document',
+]
+
+class StartupReport:
+    """Wall-clock time of each startup phase, measured from module import"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+        self.marks = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def mark(self, name):
+        """Record the time since start, e.g. 'ready' for the first query"""
+        self.marks[name] = time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases},
+            'marks': {name: round(seconds, 3) for name, seconds in self.marks.items()},
+        }
+
+    def print_report(self):
+        print("\n⏱️  Startup report")
+        for name, seconds in self.phases:
+            print(f"   {name:<24} {seconds:8.3f}s")
+        for name, seconds in self.marks.items():
+            print(f"   {'→ ' + name:<24} {seconds:8.3f}s since start")
+
+startup = StartupReport()
+
+def resolve_model_path(snapshot_dir=None, model_name=MODEL_NAME):
+    """Local snapshot of the embedding model if one was built, else the Hub name"""
+    model_dir = Path(snapshot_dir or SNAPSHOT_DIR) / "model"
+    if (model_dir / "config.json").exists():
+        return str(model_dir)
+    return model_name
+
+class WarmEmbeddings:
+    """Embeddings that load the model in a background thread"""
+    def __init__(self, model_name=None, device=None, normalize=True):
+        self.model_name = model_name or resolve_model_path()
+        self.device = device
+        self.normalize = normalize
+        self._model = None
+        self._error = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._load, name="warm-embeddings", daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        try:
+            if os.path.isdir(self.model_name):
+                # Loading from the local snapshot must not touch the network
+                os.environ.setdefault("HF_HUB_OFFLINE", "1")
+            import torch
+            from langchain_huggingface import HuggingFaceEmbeddings
+            device = self.device or ("cuda" if torch.cuda.is_available() else "cpu")
+            model = HuggingFaceEmbeddings(
+                model_name=self.model_name,
+                model_kwargs={"device": device},
+                encode_kwargs={"normalize_embeddings": self.normalize}
+            )
+            # First call initializes kernels and tokenizer caches
+            model.embed_query("warm up")
+            self._model = model
+        except Exception as e:
+            self._error = e
+        finally:
+            self._ready.set()
+
+    @property
+    def ready(self):
+        return self._ready.is_set() and self._error is None
+
+    def wait(self, timeout=None):
+        """Block until the model is loaded; re-raises a loading error"""
+        self._ready.wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return self._model
+
+    def embed_query(self, text):
+        return self.wait().embed_query(text)
+
+    def embed_documents(self, texts):
+        return self.wait().embed_documents(texts)
+
+def run_in_background(fn, name):
+    """Run a warm-up task in a daemon thread"""
+    thread = threading.Thread(target=fn, name=name, daemon=True)
+    thread.start()
+    return thread
+
+def build_snapshot(vectorstore_dir=None, snapshot_dir=None, model_name=MODEL_NAME):
+    """Save the embedding model locally and build the memory-mapped index"""
+    from sentence_transformers import SentenceTransformer
+    from langchain_chroma import Chroma
+    from marvel_numpy_index import NumpyVectorIndex
+
+    vectorstore_dir = Path(vectorstore_dir or BASE_DIR / "vectorstore")
+    snapshot_dir = Path(snapshot_dir or SNAPSHOT_DIR)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+
+    print(f"📦 Saving {model_name} to {snapshot_dir / 'model'}")
+    start = time.perf_counter()
+    model = SentenceTransformer(model_name, device="cpu")
+    model.save(str(snapshot_dir / "model"))
+    model_seconds = time.perf_counter() - start
+
+    print("🧮 Building the exact index snapshot")
+    start = time.perf_counter()
+    vectorstore = Chroma(collection_name="marvel_knowledge_base", persist_directory=str(vectorstore_dir))
+    index = NumpyVectorIndex.open_or_build(vectorstore, vectorstore_dir)
+    index_seconds = time.perf_counter() - start
+
+    meta = {
+        'model_name': model_name,
+        'model_dir': str(snapshot_dir / "model"),
+        'index_dir': str(index.index_dir),
+        'index_version': index.version,
+        'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'model_seconds': round(model_seconds, 3),
+        'index_seconds': round(index_seconds, 3),
+    }
+    with open(snapshot_dir / "snapshot_meta.json", 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    print(f"✅ Warm-start snapshot ready ({len(index.records)} vectors)")
+    return meta
+
+def measure_import_times(modules=None):
+    """Cold import time of each module in a fresh interpreter (python -X importtime)"""
+    results = {}
+    for module in modules or HEAVY_MODULES:
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            results[module] = None
+            continue
+        # Lines look like "import time:  self [us] | cumulative | imported package"
+        cumulative = None
+        for line in proc.stderr.splitlines():
+            parts = [part.strip() for part in line.split('|')]
+            if len(parts) == 3 and parts[2] == module:
+                cumulative = int(parts[1])
+        results[module] = round(cumulative / 1e6, 3) if cumulative is not None else None
+    return results
+
+def measure_query_startup(extra_args=()):
+    """Wall time of the query CLI until it can answer its first question"""
+    script = Path(__file__).parent / "5_marvel_rag_query.py"
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, str(script), "--startup-report", *extra_args],
+        capture_output=True, text=True
+    )
+    return {
+        'seconds': round(time.perf_counter() - start, 3),
+        'ok': proc.returncode == 0,
+        'output': proc.stdout[-2000:],
+    }
+
+def report(output_path=None):
+    print("🦸 Warm-start report\n")
+    print("📥 Cold import times")
+    imports = measure_import_times()
+    for module, seconds in imports.items():
+        print(f"   {module:<28} {'unavailable' if seconds is None else f'{seconds:.3f}s'}")
+
+    print("\n🚀 Query process startup (until first query is answered)")
+    boots = {
+        'standard': measure_query_startup(),
+        'fast_start': measure_query_startup(["--fast-start"]),
+    }
+    for mode, result in boots.items():
+        status = f"{result['seconds']:.3f}s" if result['ok'] else "failed"
+        print(f"   {mode:<28} {status}")
+
+    output_path = Path(output_path or SNAPSHOT_DIR / "startup_report.json")
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({'imports': imports, 'startup': boots}, f, indent=2)
+    print(f"\n📄 Report saved to {output_path}")
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Build or measure the warm-start snapshot")
+    parser.add_argument("command", choices=["build", "report"])
+    parser.add_argument("--vectorstore-dir", default=None)
+    parser.add_argument("--snapshot-dir", default=None)
+    args = parser.parse_args()
+    if args.command == "build":
+        build_snapshot(args.vectorstore_dir, args.snapshot_dir)
+    else:
+        report()
@@ -0,0 +1,402 @@
+"""
+Offline ingestion of Marvel pages from a Wikipedia XML dump
+
+Reads a ``pages-articles.xml.bz2`` dump (or plain/gzipped XML) as a
+stream: the file is decompressed on the fly and iterparsed one <page> at
+a time, and each page element is cleared once it has been read, so memory
+stays flat for the full 20+ GB dump. Pages are kept when their title is
+in the title list or one of their categories matches the category
+patterns. The wikitext-to-text conversion runs in a process pool, and
+each page is written to raw_data/documents as one sectioned .txt file.
+
+The file name prefix (characters_, teams_, events_, comics_, general_)
+comes from the page categories, so 4_process_marvel_content.py picks the
+same category as for the curated files.
+
+Usage:
+    python scripts/marvel_wiki_dump.py enwiki-latest-pages-articles.xml.bz2 --workers 4
+    python scripts/marvel_wiki_dump.py fixture          # write a small fixture dump
+    python scripts/marvel_wiki_dump.py raw_data/wiki_fixture.xml.bz2 --output /tmp/wiki_docs
+"""
+import os
+import re
+import bz2
+import sys
+import gzip
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from xml.etree import ElementTree
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from marvel_metrics import metrics
+
+BASE_DIR = Path(__file__).parent.parent
+
+DEFAULT_TITLES = [
+    "Spider-Man", "Iron Man", "Captain America", "Thor (Marvel Comics)", "Hulk", "Black Widow",
+    "Doctor Strange", "Wolverine (character)", "Avengers (comics)", "X-Men", "Fantastic Four",
+    "Guardians of the Galaxy", "Infinity Gauntlet", "Civil War (comics)", "Thanos", "Loki (Marvel Comics)",
+]
+DEFAULT_CATEGORY_PATTERNS = [
+    r"^Marvel Comics\b", r"^Marvel Cinematic Universe", r"^Avengers\b", r"^X-Men\b",
+    r"^Spider-Man\b", r"^Fantastic Four\b", r"^Characters created by (Stan Lee|Jack Kirby|Steve Ditko)",
+]
+# Wikipedia categories -> file prefix understood by _extract_category
+CATEGORY_PREFIXES = [
+    ('teams', re.compile(r"\b(teams|organizations|groups)\b", re.IGNORECASE)),
+    ('events', re.compile(r"\b(storylines|crossover events|story arcs)\b", re.IGNORECASE)),
+    ('comics', re.compile(r"\b(titles|comics publications|limited series|comic book series)\b", re.IGNORECASE)),
+    ('characters', re.compile(r"\b(characters|superheroes|supervillains|mutants|deities)\b", re.IGNORECASE)),
+]
+SKIP_SECTIONS = {'references', 'external links', 'see also', 'further reading', 'notes', 'footnotes',
+                 'bibliography', 'sources', 'citations'}
+
+CATEGORY_RE = re.compile(r"\[\[\s*Category\s*:\s*([^\]|]+)", re.IGNORECASE)
+COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+REF_RE = re.compile(r"<ref[^>/]*/>|<ref[^>]*>.*?</ref>", re.DOTALL | re.IGNORECASE)
+TAG_BLOCK_RE = re.compile(r"<(gallery|math|timeline|score|syntaxhighlight)[^>]*>.*?</\1>", re.DOTALL | re.IGNORECASE)
+TAG_RE = re.compile(r"</?[a-zA-Z][^>]*>")
+HEADING_RE = re.compile(r"^(={2,6})\s*(.+?)\s*\1\s*$", re.MULTILINE)
+EXTERNAL_LINK_RE = re.compile(r"\[https?://[^\s\]]+\s*([^\]]*)\]")
+LINK_RE = re.compile(r"\[\[([^\[\]|]*)\|?([^\[\]]*)\]\]")
+FILE_PREFIXES = ("file:", "image:", "category:", "media:")
+
+def open_dump(path):
+    """Binary stream over a .bz2, .gz or plain XML dump"""
+    path = str(path)
+    if path.endswith(".bz2"):
+        return bz2.open(path, 'rb')
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def iter_pages(path):
+    """Yield {'title', 'ns', 'id', 'revision', 'redirect', 'text'} per <page>, in constant memory"""
+    with open_dump(path) as stream:
+        context = ElementTree.iterparse(stream, events=('start', 'end'))
+        root = None
+        for event, elem in context:
+            if root is None and event == 'start':
+                root = elem
+            if event != 'end' or _local(elem.tag) != 'page':
+                continue
+            page = {'title': '', 'ns': 0, 'id': None, 'revision': None, 'redirect': False, 'text': ''}
+            for child in elem:
+                name = _local(child.tag)
+                if name == 'title':
+                    page['title'] = child.text or ''
+                elif name == 'ns':
+                    page['ns'] = int(child.text or 0)
+                elif name == 'id':
+                    page['id'] = child.text
+                elif name == 'redirect':
+                    page['redirect'] = True
+                elif name == 'revision':
+                    for field in child:
+                        field_name = _local(field.tag)
+                        if field_name == 'id':
+                            page['revision'] = field.text
+                        elif field_name == 'text':
+                            page['text'] = field.text or ''
+            yield page
+            # Drop the parsed page (and the root's reference to it)
+            elem.clear()
+            root.clear()
+
+class MarvelPageFilter:
+    """Keep articles whose title is listed or whose categories match a pattern"""
+    def __init__(self, titles=None, category_patterns=None):
+        self.titles = {self._normalize(t) for t in (DEFAULT_TITLES if titles is None else titles)}
+        patterns = DEFAULT_CATEGORY_PATTERNS if category_patterns is None else category_patterns
+        self.category_re = re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE) if patterns else None
+
+    @staticmethod
+    def _normalize(title):
+        return title.replace('_', ' ').strip().lower()
+
+    def categories(self, text):
+        return [c.strip() for c in CATEGORY_RE.findall(text)]
+
+    def __call__(self, page):
+        if page['ns'] != 0 or page['redirect'] or not page['text']:
+            return False
+        if self._normalize(page['title']) in self.titles:
+            return True
+        if self.category_re is None:
+            return False
+        return any(self.category_re.search(category) for category in self.categories(page['text']))
+
+def file_prefix(categories):
+    for prefix, pattern in CATEGORY_PREFIXES:
+        if any(pattern.search(category) for category in categories):
+            return prefix
+    return 'general'
+
+def _strip_nested(text, open_token, close_token, keep=None):
+    """Remove balanced open/close blocks (templates, tables, file links), outermost first"""
+    tokens = re.compile(re.escape(open_token) + "|" + re.escape(close_token))
+    out = []
+    depth = 0
+    start = 0
+    block_start = 0
+    for match in tokens.finditer(text):
+        if match.group() == open_token:
+            if depth == 0:
+                out.append(text[start:match.start()])
+                block_start = match.start()
+            depth += 1
+        elif depth:
+            depth -= 1
+            if depth == 0:
+                if keep:
+                    out.append(keep(text[block_start:match.end()]))
+                start = match.end()
+    # An unclosed block keeps its text rather than swallowing the rest of the page
+    out.append(text[block_start if depth else start:])
+    return "".join(out)
+
+def _drop_file_links(block):
+    inner = block[2:-2].strip().lower()
+    return "" if inner.startswith(FILE_PREFIXES) else block
+
+def _link_text(match):
+    target, label = match.group(1), match.group(2)
+    if target.strip().lower().startswith(FILE_PREFIXES):
+        return ""
+    return (label or target).strip()
+
+def wikitext_to_text(wikitext):
+    """Plain text of a wikitext fragment: templates, refs, tables and markup removed"""
+    text = COMMENT_RE.sub("", wikitext)
+    text = REF_RE.sub("", text)
+    text = TAG_BLOCK_RE.sub("", text)
+    text = _strip_nested(text, "{{", "}}")
+    text = _strip_nested(text, "{|", "|}")
+    text = _strip_nested(text, "[[", "]]", keep=_drop_file_links)
+    text = LINK_RE.sub(_link_text, text)
+    text = EXTERNAL_LINK_RE.sub(lambda m: m.group(1), text)
+    text = TAG_RE.sub("", text)
+    text = re.sub(r"'{2,}", "", text)
+    text = text.replace("&nbsp;", " ").replace("&ndash;", "–").replace("&mdash;", "—")
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith(("*", "#", ";", ":")):
+            line = "- " + line.lstrip("*#;: ")
+        if line and line not in ("-", "__NOTOC__", "__TOC__"):
+            lines.append(line)
+    return "\n".join(lines)
+
+def wikitext_to_sections(wikitext):
+    """[(heading, text)] with the lead section first; reference-style sections are dropped"""
+    sections = []
+    heading, position = "Overview", 0
+    for match in HEADING_RE.finditer(wikitext):
+        sections.append((heading, wikitext[position:match.start()]))
+        heading, position = match.group(2).strip(), match.end()
+    sections.append((heading, wikitext[position:]))
+    converted = []
+    for heading, body in sections:
+        heading = wikitext_to_text(heading)
+        if heading.lower() in SKIP_SECTIONS:
+            continue
+        body = wikitext_to_text(body)
+        if body:
+            converted.append((heading, body))
+    return converted
+
+def page_filename(prefix, title):
+    slug = re.sub(r'[^\w\s-]', '', title).strip().replace(' ', '_')
+    return f"{prefix}_{slug}_wikipedia.txt"
+
+def convert_batch(task):
+    """Process-pool worker: convert a batch of pages and write their documents"""
+    output_dir = Path(task['output_dir'])
+    written = []
+    for page in task['pages']:
+        filepath = output_dir / page_filename(page['prefix'], page['title'])
+        # Re-runs over the same dump skip pages whose revision is already written
+        if page['revision'] and filepath.exists():
+            with open(filepath, 'r', encoding='utf-8') as f:
+                if f"Revision: {page['revision']}" in f.read(300):
+                    written.append({'title': page['title'], 'file': str(filepath), 'skipped': True})
+                    continue
+        sections = wikitext_to_sections(page['text'])
+        body = "\n\n".join(f"## {heading}\n{text}" for heading, text in sections)
+        if len(body) < task['min_chars']:
+            continue
+        tmp_path = filepath.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f"Title: {page['title']}\n")
+            f.write(f"Category: {page['prefix']}\n")
+            f.write(f"Source: Wikipedia dump (page {page['id']})\n")
+            f.write(f"Revision: {page['revision']}\n")
+            f.write(f"\n{body}\n")
+        os.replace(tmp_path, filepath)
+        written.append({'title': page['title'], 'file': str(filepath), 'sections': len(sections),
+                        'content_length': len(body), 'skipped': False})
+    return written
+
+def ingest_dump(dump_path, output_dir=None, page_filter=None, workers=None, batch_size=16,
+                max_in_flight=None, min_chars=200, limit=None):
+    """Stream the dump, filter Marvel pages and convert them in a process pool"""
+    output_dir = Path(output_dir or BASE_DIR / "raw_data" / "documents")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    page_filter = page_filter or MarvelPageFilter()
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    max_in_flight = max_in_flight or workers * 2
+    stats = {'scanned': 0, 'matched': 0, 'written': 0, 'unchanged': 0, 'failed_batches': 0}
+    files = []
+    progress = {'reported': 0}
+
+    def collect(done):
+        for future in done:
+            try:
+                results = future.result()
+            except Exception as e:
+                stats['failed_batches'] += 1
+                print(f"   ❌ Conversion failed: {e}")
+                continue
+            for result in results:
+                stats['unchanged' if result['skipped'] else 'written'] += 1
+                files.append(result)
+        if stats['written'] // 100 > progress['reported']:
+            progress['reported'] = stats['written'] // 100
+            print(f"   ... {stats['scanned']:,} pages scanned, {stats['written']} written")
+
+    start = time.perf_counter()
+    pending = set()
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for page in iter_pages(dump_path):
+            stats['scanned'] += 1
+            if not page_filter(page):
+                continue
+            stats['matched'] += 1
+            page['prefix'] = file_prefix(page_filter.categories(page['text']))
+            batch.append(page)
+            if len(batch) >= batch_size:
+                # Bound the wikitext held in flight so memory stays flat
+                while len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(pool.submit(convert_batch, {'pages': batch, 'output_dir': str(output_dir),
+                                                        'min_chars': min_chars}))
+                batch = []
+            if limit and stats['matched'] >= limit:
+                break
+        if batch:
+            pending.add(pool.submit(convert_batch, {'pages': batch, 'output_dir': str(output_dir),
+                                                    'min_chars': min_chars}))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    stats['seconds'] = round(time.perf_counter() - start, 2)
+    metrics.incr('wiki_pages_written', stats['written'])
+    metadata_path = output_dir / "wikidump_metadata.json"
+    with open(metadata_path, 'w', encoding='utf-8') as f:
+        json.dump({'dump': str(dump_path), 'stats': stats, 'files': files,
+                   'created_at': time.strftime('%Y-%m-%d %H:%M:%S')}, f, indent=2)
+    return stats
+
+FIXTURE_PAGES = [
+    ("Spider-Man", 0, """{{Infobox comics character| name = Spider-Man | publisher = [[Marvel Comics]]}}
+'''Spider-Man''' is a [[superhero]] appearing in [[American comic book]]s published by [[Marvel Comics]].<ref>{{cite web|url=http://example.org}}</ref> Created by [[Stan Lee]] and [[Steve Ditko]], he first appeared in ''[[Amazing Fantasy]]'' #15 (August 1962).
+
+== Powers and abilities ==
+[[File:Spider-Man.jpg|thumb|Spider-Man in action]]
+After being bitten by a radioactive spider, Peter Parker gained:
+* superhuman strength and agility
+* the ability to cling to walls
+* a precognitive [[Spider-sense|spider-sense]]
+
+== Enemies ==
+His enemies include the [[Green Goblin]], [[Doctor Octopus]] and [[Venom (character)|Venom]]. Spider-Man has a huge rogues gallery, and his fights with these villains span decades of comics.
+
+== References ==
+{{reflist}}
+
+[[Category:Marvel Comics superheroes]]
+[[Category:Characters created by Stan Lee]]"""),
+    ("Avengers (comics)", 0, """'''The Avengers''' are a team of [[superhero]]es appearing in comics published by [[Marvel Comics]]. The founding members were [[Iron Man]], [[Ant-Man]], [[Wasp (character)|the Wasp]], [[Thor (Marvel Comics)|Thor]] and the [[Hulk]].
+
+{| class="wikitable"
+! Member !! Joined
+|-
+| Iron Man || 1963
+|}
+
+== Publication history ==
+The team debuted in ''The Avengers'' #1 (September 1963), created by [[Stan Lee]] and [[Jack Kirby]]. Captain America joined in issue #4 and was named a founding member.
+
+[[Category:Marvel Comics superhero teams]]"""),
+    ("Civil War (comics)", 0, """'''"Civil War"''' is a 2006–2007 Marvel Comics [[crossover (fiction)|crossover]] storyline built around a seven-issue [[limited series]] written by [[Mark Millar]]. The storyline follows the conflict over the Superhuman Registration Act, which splits the heroes between [[Iron Man]] and [[Captain America]].
+
+== Plot ==
+After an explosion in Stamford, the government passes the Superhuman Registration Act. Iron Man leads the heroes who support it while Captain America leads the resistance.
+
+[[Category:Marvel Comics storylines]]"""),
+    ("Spiderman", 0, None),
+    ("Photosynthesis", 0, """'''Photosynthesis''' is a process used by plants to convert light energy into chemical energy. It has nothing to do with Marvel Comics.
+
+[[Category:Plant physiology]]"""),
+    ("Talk:Spider-Man", 1, "Discussion page about Spider-Man. [[Category:Marvel Comics superheroes]]"),
+]
+
+def write_fixture(path=None):
+    """Small bz2 dump with Marvel, non-Marvel, redirect and talk pages"""
+    path = Path(path or BASE_DIR / "raw_data" / "wiki_fixture.xml.bz2")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    parts = ['<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" xml:lang="en">',
+             '<siteinfo><sitename>Wikipedia</sitename></siteinfo>']
+    for page_id, (title, ns, text) in enumerate(FIXTURE_PAGES, 1):
+        escape = lambda value: value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        redirect = '<redirect title="Spider-Man" />' if text is None else ""
+        body = escape(text if text is not None else "#REDIRECT [[Spider-Man]]")
+        parts.append(f"<page><title>{escape(title)}</title><ns>{ns}</ns><id>{page_id}</id>{redirect}"
+                     f"<revision><id>{1000 + page_id}</id><text xml:space=\"preserve\">{body}</text></revision></page>")
+    parts.append("</mediawiki>")
+    with bz2.open(path, 'wt', encoding='utf-8') as f:
+        f.write("\n".join(parts))
+    return path
+
+def _read_list(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+def main(dump_path, output_dir=None, workers=None, titles_file=None, categories_file=None,
+         min_chars=200, limit=None):
+    print("🦸 Marvel Wikipedia Dump Ingestion")
+    print("=" * 50)
+    page_filter = MarvelPageFilter(
+        titles=_read_list(titles_file) if titles_file else None,
+        category_patterns=_read_list(categories_file) if categories_file else None,
+    )
+    stats = ingest_dump(dump_path, output_dir, page_filter, workers=workers, min_chars=min_chars, limit=limit)
+    print("\n" + "=" * 50)
+    print(f"✅ {stats['written']} documents written ({stats['unchanged']} unchanged) from "
+          f"{stats['matched']} Marvel pages out of {stats['scanned']:,} scanned in {stats['seconds']}s")
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest Marvel pages from a Wikipedia XML dump")
+    parser.add_argument("dump", help="pages-articles dump (.xml, .xml.bz2, .xml.gz), or 'fixture' to write a test dump")
+    parser.add_argument("--output", default=None, help="output directory (default: raw_data/documents)")
+    parser.add_argument("--workers", type=int, default=None, help="conversion processes (default: CPUs - 1)")
+    parser.add_argument("--titles", default=None, help="file with one page title per line")
+    parser.add_argument("--categories", default=None, help="file with one category regex per line")
+    parser.add_argument("--min-chars", type=int, default=200, help="skip pages shorter than this after conversion")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many matching pages")
+    args = parser.parse_args()
+    if args.dump == "fixture":
+        print(f"🧪 Fixture dump written to {write_fixture()}")
+    else:
+        main(args.dump, args.output, args.workers, args.titles, args.categories, args.min_chars, args.limit)
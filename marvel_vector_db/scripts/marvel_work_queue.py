@@ -0,0 +1,251 @@
+"""
+SQLite-backed work queue for distributed Marvel ingestion
+
+Worker processes on one host claim files under a time-limited lease,
+chunk and embed them, and hand the vectors back through the queue. A single writer process drains finished
+results into Chroma, so only one process ever writes to the vectorstore.
+A lease that is not renewed expires and the file is handed to another
+worker, up to ``max_attempts`` times.
+
+The queue uses SQLite's rollback journal rather than WAL: WAL keeps its
+index in shared memory that only processes on the same machine can see.
+SQLite locking is not reliable on network filesystems either, so the
+queue file belongs on a local disk and every worker on that host.
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+from array import array
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    fingerprint TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, lease_expires);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    task_id INTEGER NOT NULL REFERENCES tasks(id),
+    documents TEXT NOT NULL,
+    vectors BLOB NOT NULL,
+    dim INTEGER NOT NULL,
+    written INTEGER NOT NULL DEFAULT 0,
+    created_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_results_written ON results(written);
+"""
+
+def file_fingerprint(path):
+    """size:mtime_ns, so an edited file is queued again"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def default_worker_id():
+    """host:pid identifies a worker across machines sharing the queue"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class WorkQueue:
+    def __init__(self, db_path, lease_seconds=300, max_attempts=3):
+        self.db_path = str(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(tasks)")]
+            if 'fingerprint' not in columns:
+                # Queues created before fingerprints: every file is processed once more
+                conn.execute("ALTER TABLE tasks ADD COLUMN fingerprint TEXT")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute("PRAGMA busy_timeout=60000")
+        return conn
+
+    def enqueue(self, paths, kind):
+        """Add files to the queue; a queued file is reset to pending only if it changed since"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            before = conn.total_changes
+            conn.executemany(
+                """INSERT INTO tasks (path, kind, fingerprint, updated_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(path) DO UPDATE SET
+                       kind = excluded.kind, fingerprint = excluded.fingerprint, status = 'pending',
+                       attempts = 0, lease_owner = NULL, lease_expires = NULL, error = NULL,
+                       updated_at = excluded.updated_at
+                   WHERE tasks.fingerprint IS NOT excluded.fingerprint""",
+                [(str(path), kind, file_fingerprint(path), now) for path in paths]
+            )
+            return conn.total_changes - before
+
+    def claim(self, worker_id):
+        """Lease the next pending (or expired) task; returns a dict or None"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """SELECT id, path, kind, attempts FROM tasks
+                   WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+                     AND attempts < ?
+                   ORDER BY attempts, id LIMIT 1""",
+                (now, self.max_attempts)
+            ).fetchone()
+            if row is None:
+                # Expired leases that used up their attempts are failed for good
+                conn.execute(
+                    """UPDATE tasks SET status = 'failed', error = COALESCE(error, 'lease expired'), updated_at = ?
+                       WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?""",
+                    (now, now, self.max_attempts)
+                )
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                """UPDATE tasks SET status = 'leased', attempts = attempts + 1,
+                       lease_owner = ?, lease_expires = ?, updated_at = ?
+                   WHERE id = ?""",
+                (worker_id, now + self.lease_seconds, now, row[0])
+            )
+            conn.execute("COMMIT")
+            return {'id': row[0], 'path': row[1], 'kind': row[2], 'attempt': row[3] + 1}
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, task_id, worker_id):
+        """Extend a lease; returns False if the worker no longer owns it"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                """UPDATE tasks SET lease_expires = ?, updated_at = ?
+                   WHERE id = ? AND status = 'leased' AND lease_owner = ?""",
+                (now + self.lease_seconds, now, task_id, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, task_id, worker_id, documents, vectors):
+        """Store a task's chunks and vectors and mark it done, if still leased by this worker"""
+        dim = len(vectors[0]) if vectors else 0
+        flat = array('f')
+        for vector in vectors:
+            flat.extend(vector)
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(
+                """UPDATE tasks SET status = 'done', lease_owner = NULL, lease_expires = NULL, updated_at = ?
+                   WHERE id = ? AND status = 'leased' AND lease_owner = ?""",
+                (now, task_id, worker_id)
+            )
+            if cursor.rowcount != 1:
+                # Lease was lost and the task handed to someone else
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "INSERT INTO results (task_id, documents, vectors, dim, created_at) VALUES (?, ?, ?, ?, ?)",
+                (task_id, json.dumps(documents), flat.tobytes(), dim, now)
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def fail(self, task_id, worker_id, error):
+        """Release a task after an error; it is retried until max_attempts"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                """UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                       lease_owner = NULL, lease_expires = NULL, error = ?, updated_at = ?
+                   WHERE id = ? AND lease_owner = ?""",
+                (self.max_attempts, str(error)[:2000], now, task_id, worker_id)
+            )
+
+    def pending_results(self, limit=64):
+        """Yield unwritten results as (result_id, documents, vectors)"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id, documents, vectors, dim FROM results WHERE written = 0 ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+        for result_id, documents, blob, dim in rows:
+            flat = array('f')
+            flat.frombytes(blob)
+            vectors = [flat[i:i + dim].tolist() for i in range(0, len(flat), dim)] if dim else []
+            yield result_id, json.loads(documents), vectors
+
+    def mark_written(self, result_ids):
+        """Record that results were upserted and drop their vector payloads"""
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                "UPDATE results SET written = 1, vectors = X'' WHERE id = ?",
+                [(result_id,) for result_id in result_ids]
+            )
+
+    def stats(self):
+        """Counts of tasks per status plus unwritten results"""
+        with closing(self._connect()) as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+            counts['unwritten_results'] = conn.execute(
+                "SELECT COUNT(*) FROM results WHERE written = 0"
+            ).fetchone()[0]
+        return counts
+
+    def is_drained(self):
+        """True once every task is done or failed and every result is written"""
+        stats = self.stats()
+        return not stats.get('pending') and not stats.get('leased') and not stats['unwritten_results']
+
+    def failures(self):
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT path, attempts, error FROM tasks WHERE status = 'failed' ORDER BY id"
+            ).fetchall()
+
+class LeaseKeeper:
+    """Background thread that renews a task lease while the worker is busy"""
+    def __init__(self, queue, task_id, worker_id):
+        self.queue = queue
+        self.task_id = task_id
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        while not self._stop_event.wait(interval):
+            if not self.queue.heartbeat(self.task_id, self.worker_id):
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop_event.set()
+        self._thread.join(timeout=5)
+        return False